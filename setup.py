@@ -5,7 +5,8 @@ setup(  name='YTS Scraper',
         version='0.1.1',
         description='A command-line tool to for downloading .torrent files from YTS',
         packages=find_packages(),
-        install_requires=['requests', 'argparse', 'tqdm', 'fake-useragent','tabulate'],
+        install_requires=['requests', 'argparse', 'tqdm', 'tabulate'],
+        extras_require={'async': ['aiohttp'], 'parquet': ['pyarrow'], 'jobs': ['pyyaml']},
         entry_points={'console_scripts': 'yts-scraper = yts_scraper.main:main'},
         license=open('LICENSE').read(),
         keywords=['yts', 'yify', 'scraper', 'media', 'download', 'downloader', 'torrent']
@@ -0,0 +1,99 @@
+import hashlib
+
+import pytest
+
+from yts_scraper.bencode import BencodeError, decode, encode, parse_torrent
+
+INFO = {'name': 'Movie.mkv', 'piece length': 16384, 'pieces': b'\x01' * 40, 'length': 30000}
+
+
+def torrent(info=INFO, **top):
+    return encode(dict(top, info=info))
+
+
+def info_hash(info=INFO):
+    return hashlib.sha1(encode(info)).hexdigest().upper()
+
+
+@pytest.mark.parametrize('data', [b'', b'i12', b'5:ab', b'l1:a', b'd1:a', b'd1:ai1e', b'li1ei2e'])
+def test_decode_rejects_truncated_input(data):
+    with pytest.raises(BencodeError):
+        decode(data)
+
+
+@pytest.mark.parametrize('size', [1, 100, 10000])
+def test_parse_torrent_rejects_truncated_torrent(size):
+    data = torrent()
+    with pytest.raises(BencodeError):
+        parse_torrent(data[:len(data) - size])
+
+
+def test_decode_nested_values():
+    data = b'd4:listli1el1:ai-2eed1:xdeee5:empty0:e'
+    assert decode(data) == {b'list': [1, [b'a', -2], {b'x': {}}], b'empty': b''}
+    assert encode(decode(data)) == b'd5:empty0:4:listli1el1:ai-2eed1:xdeeee'
+
+
+def test_decode_rejects_deep_nesting():
+    with pytest.raises(BencodeError, match='Nested too deeply'):
+        decode(b'l' * 100000 + b'e' * 100000)
+    with pytest.raises(BencodeError, match='Nested too deeply'):
+        parse_torrent(b'd4:info' + b'l' * 100000 + b'e' * 100000 + b'e')
+
+
+@pytest.mark.parametrize('data', [b'i1x2e', b'x', b'-1:a', b'di1e1:ae', b'i1ei2e', b'4:abcde'])
+def test_decode_rejects_malformed_input(data):
+    with pytest.raises(BencodeError):
+        decode(data)
+
+
+def test_decode_accepts_non_canonical_input():
+    assert decode(b'd1:bi1e1:ai2ee') == {b'a': 2, b'b': 1}
+    assert decode(b'i007e') == 7
+
+
+def test_info_hash_covers_info_as_written():
+    info = b'd6:lengthi30000e4:name9:Movie.mkv6:pieces40:' + b'\x01' * 40 + b'12:piece lengthi16384ee'
+    data = b'd8:announce3:url4:info' + info + b'e'
+
+    parsed = parse_torrent(data)
+
+    assert encode(decode(info)) != info
+    assert parsed.info_hash == hashlib.sha1(info).hexdigest().upper()
+
+
+def test_parse_torrent_reads_metadata():
+    parsed = parse_torrent(torrent(announce='url'), info_hash().lower())
+
+    assert parsed.info_hash == info_hash()
+    assert parsed.name == 'Movie.mkv'
+    assert parsed.files == ['Movie.mkv']
+    assert parsed.total_size == 30000
+    assert parsed.piece_count == 2
+
+
+def test_parse_torrent_reads_file_list():
+    info = dict(INFO, files=[{'length': 10, 'path': ['Sub', 'a.srt']}, {'length': 20, 'path': ['b.mkv']}])
+    del info['length']
+
+    parsed = parse_torrent(torrent(info))
+
+    assert parsed.files == ['Sub/a.srt', 'b.mkv']
+    assert parsed.total_size == 30
+
+
+def test_parse_torrent_rejects_info_hash_mismatch():
+    with pytest.raises(BencodeError, match='does not match'):
+        parse_torrent(torrent(), '0' * 40)
+
+
+@pytest.mark.parametrize('data', [
+    b'<html>503 Service Unavailable</html>',
+    encode({'announce': 'url'}),
+    torrent(dict(INFO, pieces=b'\x01' * 30)),
+    torrent(dict(INFO, length=-1)),
+    torrent() + b'trailing',
+])
+def test_parse_torrent_rejects_invalid_torrent(data):
+    with pytest.raises(BencodeError):
+        parse_torrent(data)
@@ -0,0 +1,126 @@
+import json
+import os
+import subprocess
+import sys
+from types import SimpleNamespace
+
+import pytest
+
+from yts_scraper.bench import MockCatalog, MockServer
+from yts_scraper.jobs import Query, plan_queries
+
+PACKAGE_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.fixture(scope='module')
+def server():
+    with MockServer(MockCatalog(30)) as server:
+        yield server
+
+
+def run_jobs(server, directory, jobs, *options):
+    jobs_path = os.path.join(str(directory), 'jobs.json')
+    with open(jobs_path, 'w') as jobs_file:
+        json.dump(jobs, jobs_file)
+    environment = dict(os.environ, PYTHONPATH=PACKAGE_ROOT)
+    subprocess.run([sys.executable, '-m', 'yts_scraper.main', '--host', server.url, '--jobs', jobs_path,
+                    '-o', 'out', '--cache-dir', 'cache', '-q', '1080p'] + list(options),
+                   cwd=str(directory), env=environment, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL,
+                   check=True, timeout=120)
+
+
+def files(directory, extension):
+    return [name for _, _, names in os.walk(str(directory)) for name in names if name.endswith(extension)]
+
+
+def test_job_background_fetches_posters_without_b(server, tmp_path):
+    run_jobs(server, tmp_path, [{'name': 'posters', 'background': True}, {'name': 'plain'}])
+
+    assert files(tmp_path / 'out' / 'posters', '.torrent')
+    assert len(files(tmp_path / 'out' / 'posters', '.jpg')) == len(files(tmp_path / 'out' / 'posters', '.torrent'))
+    assert files(tmp_path / 'out' / 'plain', '.torrent')
+    assert not files(tmp_path / 'out' / 'plain', '.jpg')
+
+
+def test_job_background_false_overrides_b(server, tmp_path):
+    run_jobs(server, tmp_path, [{'name': 'posters'}, {'name': 'plain', 'background': False}], '-b')
+
+    assert files(tmp_path / 'out' / 'posters', '.jpg')
+    assert files(tmp_path / 'out' / 'plain', '.torrent')
+    assert not files(tmp_path / 'out' / 'plain', '.jpg')
+
+
+def job(genre='all', rating='0', quality='all', text=''):
+    return SimpleNamespace(query=Query(genre, rating, quality, text))
+
+
+# movie_count for plan_queries that records the queries it was asked about
+class Counts:
+    def __init__(self, counts, default=50):
+        self.counts = counts
+        self.default = default
+        self.calls = []
+
+    def __call__(self, query):
+        self.calls.append(query)
+        return self.counts.get(query, self.default)
+
+
+def routes(plan):
+    return [(query, [id(routed) for routed in jobs], pages) for query, jobs, pages in plan]
+
+
+def test_plan_dedups_equal_queries():
+    jobs = [job('action'), job('action')]
+
+    plan = plan_queries(jobs, Counts({}))
+
+    assert routes(plan) == [(Query('action', '0', 'all', ''), [id(jobs[0]), id(jobs[1])], 1)]
+
+
+def test_plan_drops_covered_queries():
+    jobs = [job('action', '7', '1080p'), job(), job('comedy')]
+    counts = Counts({Query('all', '0', 'all', ''): 1000})
+
+    plan = plan_queries(jobs, counts)
+
+    assert routes(plan) == [(Query('all', '0', 'all', ''), [id(routed) for routed in jobs], 20)]
+    assert counts.calls == [Query('all', '0', 'all', '')]
+
+
+def test_plan_merges_when_it_saves_pages():
+    jobs = [job('action', '5'), job('comedy', '7')]
+    counts = Counts({Query('action', '5', 'all', ''): 60, Query('comedy', '7', 'all', ''): 60,
+                     Query('all', '5', 'all', ''): 100})
+
+    plan = plan_queries(jobs, counts)
+
+    assert routes(plan) == [(Query('all', '5', 'all', ''), [id(jobs[0]), id(jobs[1])], 2)]
+
+
+def test_plan_keeps_queries_when_merging_costs_pages():
+    jobs = [job('action', quality='2160p'), job('comedy', quality='2160p')]
+    counts = Counts({Query('all', '0', '2160p', ''): 1000})
+
+    plan = plan_queries(jobs, counts)
+
+    assert routes(plan) == [(Query('action', '0', '2160p', ''), [id(jobs[0])], 1),
+                            (Query('comedy', '0', '2160p', ''), [id(jobs[1])], 1)]
+
+
+def test_plan_never_merges_different_text():
+    jobs = [job(text='alien'), job(text='aliens'), job('horror', text='alien')]
+
+    plan = plan_queries(jobs, Counts({}, default=1))
+
+    assert routes(plan) == [(Query('all', '0', 'all', 'alien'), [id(jobs[0]), id(jobs[2])], 1),
+                            (Query('all', '0', 'all', 'aliens'), [id(jobs[1])], 1)]
+
+
+def test_plan_counts_each_query_once():
+    jobs = [job('action'), job('comedy'), job('drama'), job('horror')]
+    counts = Counts({Query('all', '0', 'all', ''): 1000})
+
+    plan_queries(jobs, counts)
+
+    assert len(counts.calls) == len(set(counts.calls))
@@ -0,0 +1,142 @@
+import time
+from datetime import datetime, timedelta, timezone
+from email.utils import format_datetime
+from types import SimpleNamespace
+
+import pytest
+
+from yts_scraper import ratelimit
+from yts_scraper.ratelimit import HostLimiter, parse_retry_after
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = SimpleNamespace(now=1000.0)
+    monkeypatch.setattr(ratelimit, 'time', SimpleNamespace(monotonic=lambda: clock.now, sleep=time.sleep))
+    return clock
+
+
+def http_date(seconds):
+    return format_datetime(datetime.now(timezone.utc) + timedelta(seconds=seconds), usegmt=True)
+
+
+@pytest.mark.parametrize('value, expected', [('120', 120.0), ('1.5', 1.5), ('0', 0.0), ('-5', 0.0)])
+def test_retry_after_seconds(value, expected):
+    assert parse_retry_after(value) == expected
+
+
+def test_retry_after_http_date():
+    assert 55 <= parse_retry_after(http_date(60)) <= 60
+
+
+def test_retry_after_http_date_in_the_past():
+    assert parse_retry_after(http_date(-60)) == 0.0
+
+
+def test_retry_after_http_date_without_zone():
+    assert 55 <= parse_retry_after(http_date(60).replace(' GMT', ' -0000')) <= 60
+
+
+@pytest.mark.parametrize('value', [None, '', 'soon', 'Mon, 99 Foo 2024'])
+def test_retry_after_invalid(value):
+    assert parse_retry_after(value) is None
+
+
+def succeed(limiter, count, clock):
+    for _ in range(count):
+        clock.now += 1.0
+        assert limiter.try_acquire() == 0
+        limiter.release()
+
+
+def throttle(limiter, clock, retry_after=None):
+    clock.now += 1.0
+    limiter.release(throttled=True, retry_after=retry_after)
+
+
+def test_increase_stops_at_max_concurrency_and_max_rate(clock):
+    limiter = HostLimiter(2, 4, max_rate=5)
+
+    succeed(limiter, 200, clock)
+
+    assert limiter.window == 4
+    assert limiter.rate == 5
+
+
+def test_increase_is_additive(clock):
+    limiter = HostLimiter(4, 8)
+
+    succeed(limiter, 4, clock)
+
+    assert 4.9 < limiter.rate < 5.1
+    assert limiter.window == 8
+
+
+def test_decrease_halves_window_and_rate(clock):
+    limiter = HostLimiter(8, 8)
+
+    throttle(limiter, clock)
+
+    assert limiter.window == 4
+    assert limiter.rate == 4
+
+
+def test_decrease_never_goes_below_one(clock):
+    limiter = HostLimiter(8, 8)
+
+    for _ in range(10):
+        throttle(limiter, clock)
+
+    assert limiter.window == 1
+    assert limiter.rate == 1
+
+
+def test_decrease_once_per_second(clock):
+    limiter = HostLimiter(8, 8)
+
+    limiter.release(throttled=True)
+    clock.now += 0.5
+    limiter.release(throttled=True)
+    assert limiter.window == 4
+    assert limiter.rate == 4
+
+    clock.now += 0.5
+    limiter.release(throttled=True)
+    assert limiter.window == 2
+    assert limiter.rate == 2
+
+
+def test_retry_after_blocks_the_host(clock):
+    limiter = HostLimiter(8, 8)
+
+    throttle(limiter, clock, retry_after=30)
+
+    assert limiter.try_acquire() == 30
+    clock.now += 30
+    assert limiter.try_acquire() == 0
+
+
+def test_window_limits_requests_in_flight(clock):
+    limiter = HostLimiter(0, 2)
+
+    assert limiter.try_acquire() == 0
+    assert limiter.try_acquire() == 0
+    assert limiter.try_acquire() > 0
+    limiter.release()
+    assert limiter.try_acquire() == 0
+
+
+def test_starting_rate_is_capped(clock):
+    assert HostLimiter(20, 8, max_rate=5).rate == 5
+    assert HostLimiter(0, 8, max_rate=5).rate == 5
+    assert HostLimiter(0, 8).rate == 0
+
+
+def test_unlimited_rate_stays_unlimited(clock):
+    limiter = HostLimiter(0, 8)
+
+    succeed(limiter, 10, clock)
+    throttle(limiter, clock)
+
+    assert limiter.rate == 0
+    assert limiter.window == 4
@@ -0,0 +1,268 @@
+import asyncio
+import json
+import time
+from yts_scraper.files import AtomicFile, CHUNK_SIZE
+from yts_scraper.metrics import connection_report, download_kind
+from yts_scraper.ratelimit import RateLimiter, RETRY_STATUSES, parse_retry_after
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+
+class AsyncEngine:
+    """
+    Single event loop fetch engine used by --engine async.
+
+    Page listing and file downloads share one aiohttp connection pool and a
+    semaphore that caps the number of requests in flight. Requests go through
+    the same per-host rate limiter and retry policy as the thread engine.
+    """
+    def __init__(self, concurrency=10, timeout=10, limiter=None, cache=None, metrics=None):
+        if aiohttp is None:
+            raise RuntimeError('The async engine requires aiohttp. Install it with "pip install aiohttp".')
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.limiter = limiter if limiter is not None else RateLimiter(max_concurrency=concurrency)
+        self.cache = cache
+        self.metrics = metrics
+        self.retries = 0
+        self.requests = 0
+        self.connections = 0
+        self._session = None
+        self._semaphore = None
+
+    # Runs the given coroutine function inside an open client session
+    def run(self, main):
+        asyncio.run(self.__main(main))
+
+    async def __main(self, main):
+        connector = aiohttp.TCPConnector(limit=self.concurrency)
+        timeout = aiohttp.ClientTimeout(total=self.timeout)
+        self._semaphore = asyncio.Semaphore(self.concurrency)
+        trace_configs = [self.__connection_counter()]
+        if self.metrics is not None:
+            trace_configs.append(self.__trace_config())
+        async with aiohttp.ClientSession(connector=connector, timeout=timeout, trace_configs=trace_configs) as session:
+            self._session = session
+            try:
+                await main()
+            finally:
+                self._session = None
+
+    # Counts the connections each request opened or took from the pool
+    def __connection_counter(self):
+        async def created(session, context, params):
+            self.requests += 1
+            self.connections += 1
+
+        async def reused(session, context, params):
+            self.requests += 1
+
+        trace_config = aiohttp.TraceConfig()
+        trace_config.on_connection_create_end.append(created)
+        trace_config.on_connection_reuseconn.append(reused)
+        return trace_config
+
+    # Returns (requests, new connections) made through this engine
+    def connection_stats(self):
+        return self.requests, self.connections
+
+    def report(self):
+        return connection_report(self.requests, self.connections, self.retries)
+
+    # Fills the phases dict given as trace_request_ctx with the pool wait, DNS and connect times of a request
+    @staticmethod
+    def __trace_config():
+        def timer(phase, end):
+            async def callback(session, context, params):
+                phases = context.trace_request_ctx
+                if phases is None:
+                    return
+                if end:
+                    phases[phase] = phases.get(phase, 0.0) + time.perf_counter() - phases.pop('_' + phase)
+                else:
+                    phases['_' + phase] = time.perf_counter()
+            return callback
+
+        trace_config = aiohttp.TraceConfig()
+        trace_config.on_connection_queued_start.append(timer('queue', False))
+        trace_config.on_connection_queued_end.append(timer('queue', True))
+        trace_config.on_dns_resolvehost_start.append(timer('dns', False))
+        trace_config.on_dns_resolvehost_end.append(timer('dns', True))
+        trace_config.on_connection_create_start.append(timer('connect', False))
+        trace_config.on_connection_create_end.append(timer('connect', True))
+        return trace_config
+
+    async def fetch_json(self, url, headers=None):
+        if self.cache is None:
+            return await self.fetch(url, json.loads, headers, kind='api')
+        entry = self.cache.get(url)
+        if entry is not None and entry.fresh:
+            if self.metrics is not None:
+                self.metrics.cache(url, 'hit')
+            return json.loads(entry.body)
+        headers = dict(headers or {})
+        if entry is not None:
+            headers.update(entry.validators())
+        status, body, response_headers = await self.__request(url, headers, self.__read_response)
+        if self.metrics is not None:
+            self.metrics.cache(url, 'revalidated' if status == 304 else 'miss')
+        return self.cache.store(url, entry, status, body, response_headers)
+
+    @staticmethod
+    async def __read_response(response):
+        return response.status, await response.read(), response.headers
+
+    async def fetch_bytes(self, url, headers=None):
+        return await self.__request(url, headers, lambda response: response.read())
+
+    # Streams a file straight to disk under a temporary name, renamed into place once complete.
+    # With validate, the body is only written once validate(body) accepts it and fetched again when it
+    # raises ValueError, as in Session.download. Returns validate's result, or the status code without it
+    async def download(self, url, path, headers=None, validate=None):
+        kind = download_kind(path)
+        attempt = 0
+        while True:
+            disk = {'disk': 0.0}
+
+            async def read(response):
+                if validate is not None:
+                    body = await response.read()
+                    try:
+                        result = validate(body)
+                    except ValueError as error:
+                        return error
+                    started = time.perf_counter()
+                    with AtomicFile(path) as target:
+                        target.write(body)
+                    disk['disk'] += time.perf_counter() - started
+                    return result
+                with AtomicFile(path) as target:
+                    async for chunk in response.content.iter_chunked(CHUNK_SIZE):
+                        started = time.perf_counter()
+                        target.write(chunk)
+                        disk['disk'] += time.perf_counter() - started
+                return response.status
+            result = await self.__request(url, headers, read, kind, disk)
+            if not isinstance(result, ValueError):
+                return result
+            await self.__invalid(kind, url, attempt, result)
+            attempt += 1
+
+    # Fetches a small file into memory and returns validate(body), fetching it again when validate rejects it
+    async def fetch(self, url, validate, headers=None, kind='torrent'):
+        async def read(response):
+            body = await response.read()
+            try:
+                return validate(body)
+            except ValueError as error:
+                return error
+        attempt = 0
+        while True:
+            result = await self.__request(url, headers, read, kind)
+            if not isinstance(result, ValueError):
+                return result
+            await self.__invalid(kind, url, attempt, result)
+            attempt += 1
+
+    async def __invalid(self, kind, url, attempt, error):
+        if attempt >= self.limiter.retries:
+            raise error
+        self.retries += 1
+        delay = self.limiter.delay(attempt)
+        if self.metrics is not None:
+            self.metrics.retry(kind, url, 'invalid', delay)
+        await asyncio.sleep(delay)
+
+    # kind labels the request in the metrics, extra holds phases measured by read (the disk time)
+    async def __request(self, url, headers, read, kind='api', extra=None):
+        host = self.limiter.host(url)
+        attempt = 0
+        while True:
+            waited = time.perf_counter()
+            delay = host.try_acquire()
+            while delay:
+                await asyncio.sleep(delay)
+                delay = host.try_acquire()
+            throttled = False
+            retry_after = None
+            reason = None
+            phases = {} if self.metrics is not None else None
+            started = time.perf_counter()
+            try:
+                async with self._semaphore:
+                    started = time.perf_counter()
+                    async with self._session.get(url, headers=headers, trace_request_ctx=phases) as response:
+                        if response.status in RETRY_STATUSES:
+                            throttled = True
+                            reason = response.status
+                            retry_after = parse_retry_after(response.headers.get('Retry-After'))
+                        if not throttled or attempt >= self.limiter.retries:
+                            received = time.perf_counter()
+                            result = await read(response)
+                            self.__record(kind, url, response.status, phases, waited, started, received,
+                                          response.content.total_bytes, attempt, extra)
+                            return result
+                        self.__record(kind, url, response.status, phases, waited, started, None, 0, attempt)
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as error:
+                throttled = True
+                reason = type(error).__name__
+                self.__record(kind, url, None, phases, waited, started, None, 0, attempt, error=reason)
+                if attempt >= self.limiter.retries:
+                    raise
+            finally:
+                host.release(throttled=throttled, retry_after=retry_after)
+            self.retries += 1
+            delay = self.limiter.delay(attempt, retry_after)
+            if self.metrics is not None:
+                self.metrics.retry(kind, url, reason, delay)
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    # Turns the traced timestamps of one attempt into the metrics phases.
+    # received is when the body started to be read, None when it was not
+    def __record(self, kind, url, status, phases, waited, started, received, size, attempt, extra=None, error=None):
+        if self.metrics is None:
+            return
+        now = time.perf_counter()
+        dns = phases.get('dns', 0.0)
+        connect = phases.get('connect', 0.0)
+        pool = phases.get('queue', 0.0)
+        result = {'queue': started - waited + pool, 'dns': dns, 'connect': max(connect - dns, 0.0),
+                  'ttfb': max((received or now) - started - pool - connect, 0.0)}
+        if received is not None:
+            disk = (extra or {}).get('disk', 0.0)
+            result['transfer'] = max(now - received - disk, 0.0)
+            if extra:
+                result['disk'] = disk
+        self.metrics.request(kind, url, status, result, size=size, attempt=attempt, error=error)
+
+    # Awaits func(item) for every item with at most `concurrency` calls running at once.
+    # Returns once every item has been handled, so callers need no polling.
+    # asyncio for the scraper's coroutines, which stay free of the import for thread engine runs
+    def queue(self, maxsize=0):
+        return asyncio.Queue(maxsize=maxsize)
+
+    def spawn(self, coroutine):
+        return asyncio.ensure_future(coroutine)
+
+    def gather(self, *awaitables, return_exceptions=False):
+        return asyncio.gather(*awaitables, return_exceptions=return_exceptions)
+
+    def sleep(self, seconds):
+        return asyncio.sleep(seconds)
+
+    # Runs a blocking call, e.g. a few probes through the requests session, off the event loop
+    def in_thread(self, function):
+        return asyncio.get_event_loop().run_in_executor(None, function)
+
+    async def map(self, func, items):
+        items = iter(items)
+
+        async def worker():
+            for item in items:
+                await func(item)
+
+        await asyncio.gather(*[worker() for _ in range(self.concurrency)])
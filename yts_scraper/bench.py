@@ -0,0 +1,336 @@
+import argparse
+import hashlib
+import json
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+import tabulate
+from yts_scraper.bencode import encode
+
+# Scraper flags of every benchmarked mode
+MODES = {
+    'view': ['-v'],
+    'csv': ['--csv-only'],
+    'download': [],
+    'multiprocess': ['-m'],
+}
+
+GENRES = ['Action', 'Adventure', 'Animation', 'Comedy', 'Crime', 'Documentary', 'Drama', 'Fantasy',
+          'Horror', 'Mystery', 'Romance', 'Sci-Fi', 'Thriller', 'War', 'Western']
+LANGUAGES = ['en', 'en', 'en', 'fr', 'es', 'de', 'ja', 'ko']
+QUALITIES = ['720p', '1080p', '2160p', '3D']
+SORT_KEYS = {
+    'title': lambda movie: movie['title'],
+    'year': lambda movie: movie['year'],
+    'rating': lambda movie: movie['rating'],
+    'date_added': lambda movie: movie['date_uploaded_unix'],
+    'seeds': lambda movie: max(torrent['seeds'] for torrent in movie['torrents']),
+    'peers': lambda movie: max(torrent['peers'] for torrent in movie['torrents']),
+    'download_count': lambda movie: movie['download_count'],
+    'like_count': lambda movie: movie['like_count'],
+}
+
+
+# A small but well-formed torrent whose info-hash is the hash the listing reports
+def make_torrent(name, size, announce):
+    info = {'name': name, 'length': size, 'piece length': 262144,
+            'pieces': hashlib.sha1(name.encode('utf-8')).digest()}
+    body = encode({'announce': announce, 'info': info})
+    return hashlib.sha1(encode(info)).hexdigest().upper(), body
+
+
+class MockCatalog:
+    """
+    Deterministic, generated stand-in for the YTS movie listing.
+    """
+    def __init__(self, movies=1000, seed=0):
+        self.random = random.Random(seed)
+        self.movies = [self.__movie(movie_id) for movie_id in range(movies, 0, -1)]      # newest first
+        self.torrents = {}
+        self.base_url = ''
+        self.lock = threading.Lock()
+        self.queries = {}
+
+    def __movie(self, movie_id):
+        rng = self.random
+        year = rng.randint(1950, 2024)
+        title = 'Movie {}'.format(movie_id)
+        torrents = []
+        for quality in rng.sample(QUALITIES[:3], rng.randint(1, 3)) + (['3D'] if rng.random() < 0.05 else []):
+            for torrent_type in (['bluray', 'web'] if rng.random() < 0.3 else [rng.choice(['bluray', 'web'])]):
+                size = rng.randint(500, 20000) * 1024 * 1024
+                torrents.append({'quality': quality, 'type': torrent_type, 'size_bytes': size,
+                                 'size': '{:.2f} GB'.format(size / 1024 ** 3), 'seeds': rng.randint(0, 500),
+                                 'peers': rng.randint(0, 100), 'date_uploaded_unix': 1300000000 + movie_id * 1000})
+        return {'id': movie_id, 'imdb_code': 'tt{:07d}'.format(movie_id), 'title': title,
+                'title_long': '{} ({})'.format(title, year), 'year': year,
+                'rating': round(rng.uniform(1, 9.5), 1), 'language': rng.choice(LANGUAGES),
+                'genres': rng.sample(GENRES, rng.randint(1, 3)), 'date_uploaded_unix': 1300000000 + movie_id * 1000,
+                'download_count': rng.randint(0, 10 ** 6), 'like_count': rng.randint(0, 10 ** 4),
+                'torrents': torrents}
+
+    # Fills in the URLs and hashes once the server address is known
+    def bind(self, base_url):
+        self.base_url = base_url
+        for movie in self.movies:
+            movie['url'] = '{}/movies/movie-{}'.format(base_url, movie['id'])
+            movie['large_cover_image'] = '{}/assets/images/movies/{}/large-cover.jpg'.format(base_url, movie['id'])
+            for torrent in movie['torrents']:
+                name = '{} [{}] [{}]'.format(movie['title_long'], torrent['quality'], torrent['type'])
+                torrent['hash'], body = make_torrent(name, torrent['size_bytes'], base_url + '/announce')
+                torrent['url'] = '{}/torrent/download/{}'.format(base_url, torrent['hash'])
+                self.torrents[torrent['hash']] = body
+
+    def query(self, params):
+        genre = params.get('genre', 'all').lower()
+        minimum_rating = float(params.get('minimum_rating') or 0)
+        quality = params.get('quality', 'all')
+        text = params.get('query_term', '').lower()
+        sort_by = params.get('sort_by', 'date_added')
+        order_by = params.get('order_by', 'desc')
+        key = (genre, minimum_rating, quality, text, sort_by, order_by)
+        with self.lock:
+            if key not in self.queries:
+                movies = [movie for movie in self.movies
+                          if movie['rating'] >= minimum_rating
+                          and (genre in ('', 'all') or genre in (g.lower() for g in movie['genres']))
+                          and (quality in ('', 'all') or any(t['quality'] == quality for t in movie['torrents']))
+                          and (not text or text in movie['title'].lower() or text == movie['imdb_code'])]
+                movies.sort(key=SORT_KEYS.get(sort_by, SORT_KEYS['date_added']), reverse=order_by == 'desc')
+                self.queries[key] = movies
+            return self.queries[key]
+
+
+class MockServer:
+    """
+    Local HTTP stand-in for the YTS API, torrent and image endpoints.
+
+    Every response is delayed by latency seconds. A share of requests
+    (error_rate) answers 503 and another (throttle_rate) answers 429 with
+    a Retry-After header. A share of torrent requests (corrupt_rate) gets a
+    200 with an HTML page or a truncated .torrent instead. Served requests and their handling times are
+    recorded per endpoint until reset().
+    """
+    def __init__(self, catalog, latency=0.0, error_rate=0.0, throttle_rate=0.0, retry_after=1, corrupt_rate=0.0):
+        self.catalog = catalog
+        self.latency = latency
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.corrupt_rate = corrupt_rate
+        self.retry_after = retry_after
+        self.random = random.Random(1)
+        self.lock = threading.Lock()
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), self.__handler())
+        self.server.daemon_threads = True
+        self.url = 'http://127.0.0.1:{}'.format(self.server.server_address[1])
+        self.thread = None
+        self.reset()
+        catalog.bind(self.url)
+
+    def __enter__(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        self.server.shutdown()
+        self.server.server_close()
+        return False
+
+    def reset(self):
+        with self.lock:
+            self.counts = {'pages': 0, 'torrents': 0, 'images': 0, 'throttled': 0, 'errors': 0, 'corrupt': 0}
+            self.latencies = []
+
+    def record(self, kind, started):
+        with self.lock:
+            self.counts[kind] += 1
+            self.latencies.append(time.perf_counter() - started)
+
+    def __handler(self):
+        mock = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                started = time.perf_counter()
+                if mock.latency:
+                    time.sleep(mock.latency)
+                with mock.lock:
+                    roll = mock.random.random()
+                if roll < mock.throttle_rate:
+                    self.__reply(429, b'', 'text/plain', {'Retry-After': str(mock.retry_after)})
+                    return mock.record('throttled', started)
+                if roll < mock.throttle_rate + mock.error_rate:
+                    self.__reply(503, b'', 'text/plain')
+                    return mock.record('errors', started)
+
+                url = urlparse(self.path)
+                if url.path.endswith('/list_movies.json'):
+                    params = {key: values[0] for key, values in parse_qs(url.query).items()}
+                    limit = min(max(int(params.get('limit') or 20), 1), 50)
+                    page = max(int(params.get('page') or 1), 1)
+                    movies = mock.catalog.query(params)
+                    body = json.dumps({'status': 'ok', 'status_message': 'Query was successful',
+                                       'data': {'movie_count': len(movies), 'limit': limit, 'page_number': page,
+                                                'movies': movies[(page - 1) * limit:page * limit]}}).encode('utf-8')
+                    self.__reply(200, body, 'application/json')
+                    return mock.record('pages', started)
+                if url.path.startswith('/torrent/download/'):
+                    body = mock.catalog.torrents.get(url.path.rsplit('/', 1)[-1])
+                    if body is None:
+                        return self.__reply(404, b'', 'text/plain')
+                    with mock.lock:
+                        corrupt = mock.random.random() < mock.corrupt_rate
+                    if corrupt:
+                        if len(body) % 2:
+                            self.__reply(200, b'<html><body>Too many requests</body></html>', 'text/html')
+                        else:
+                            self.__reply(200, body[:len(body) // 2], 'application/x-bittorrent')
+                        return mock.record('corrupt', started)
+                    self.__reply(200, body, 'application/x-bittorrent')
+                    return mock.record('torrents', started)
+                if url.path.startswith('/assets/images/'):
+                    self.__reply(200, b'\xff\xd8\xff\xe0' + bytes(2048), 'image/jpeg')
+                    return mock.record('images', started)
+                self.__reply(404, b'', 'text/plain')
+
+            def __reply(self, status, body, content_type, headers=None):
+                self.send_response(status)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(body)
+
+        return Handler
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(int(len(values) * fraction), len(values) - 1)]
+
+
+# Lines of a failed run's output shown with the results
+OUTPUT_TAIL = 20
+
+
+# Runs the scraper in a child process so each mode gets its own peak RSS and CPU time. A run that exits
+# non-zero is marked failed and gets no throughput, the end of its output is kept instead
+def run_mode(server, mode, scraper_args):
+    directory = tempfile.mkdtemp(prefix='yts-bench-')
+    command = [sys.executable, '-m', 'yts_scraper.main', '--host', server.url,
+               '--cache-dir', os.path.join(directory, 'cache'), '--no-cache'] + MODES[mode] + scraper_args
+    package_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    environment = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [package_root, os.environ.get('PYTHONPATH')])))
+    server.reset()
+    try:
+        started = time.perf_counter()
+        with open(os.path.join(directory, 'output.log'), 'w+') as output:
+            process = subprocess.Popen(command, cwd=directory, env=environment, stdin=subprocess.DEVNULL,
+                                       stdout=output, stderr=output)
+            _, status, usage = os.wait4(process.pid, 0)
+            elapsed = time.perf_counter() - started
+            exit_status = os.waitstatus_to_exitcode(status)
+            process.returncode = exit_status
+            output.seek(0)
+            tail = output.read().splitlines()[-OUTPUT_TAIL:] if exit_status else []
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+    with server.lock:
+        counts = dict(server.counts)
+        latencies = list(server.latencies)
+    files = counts['torrents'] + counts['images']
+    failed = exit_status != 0
+    return {'mode': mode,
+            'status': 'failed' if failed else 'ok',
+            'seconds': round(elapsed, 3),
+            'pages': counts['pages'],
+            'files': files,
+            'pages_per_second': None if failed else round(counts['pages'] / elapsed, 2),
+            'files_per_second': None if failed else round(files / elapsed, 2),
+            'p50_ms': round(percentile(latencies, 0.50) * 1000, 2),
+            'p99_ms': round(percentile(latencies, 0.99) * 1000, 2),
+            'throttled': counts['throttled'],
+            'errors': counts['errors'],
+            'peak_rss_mb': round(usage.ru_maxrss / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1),
+            'cpu_seconds': round(usage.ru_utime + usage.ru_stime, 3),
+            'exit_status': exit_status,
+            'output': tail}
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog='yts-scraper bench',
+                                     description='Runs the scraper end-to-end against a local mock YTS API and reports throughput')
+    parser.add_argument('--movies', help='Number of movies in the mock catalog. Default is 1000.',
+                        dest='movies', type=int, default=1000)
+    parser.add_argument('--latency', help='Milliseconds added to every mock response. Default is 20.',
+                        dest='latency', type=float, default=20)
+    parser.add_argument('--error-rate', help='Share of requests answered with 503. Default is 0.',
+                        dest='error_rate', type=float, default=0)
+    parser.add_argument('--throttle-rate', help='Share of requests answered with 429 and Retry-After. Default is 0.',
+                        dest='throttle_rate', type=float, default=0)
+    parser.add_argument('--corrupt-rate', help='Share of torrent requests answered with an HTML page or a truncated file. Default is 0.',
+                        dest='corrupt_rate', type=float, default=0)
+    parser.add_argument('--retry-after', help='Retry-After seconds sent with injected 429s. Default is 1.',
+                        dest='retry_after', type=int, default=1)
+    parser.add_argument('--modes', help='Comma separated modes to run: {}. Default is all of them.'.format(', '.join(MODES)),
+                        dest='modes', type=str, default=','.join(MODES))
+    parser.add_argument('--json', help='Append --json to print the results as JSON lines instead of a table.',
+                        dest='json', type=bool, default=False, const=True, nargs='?')
+    parser.add_argument('scraper_args', nargs=argparse.REMAINDER,
+                        help='Extra scraper options given after "--", e.g. "-- -e async -w 20". Defaults to "-q all --rate 0".')
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    modes = [mode.strip() for mode in args.modes.split(',') if mode.strip()]
+    for mode in modes:
+        if mode not in MODES:
+            raise SystemExit('Unknown mode "{}". Available modes are: {}'.format(mode, ', '.join(MODES)))
+    scraper_args = [arg for arg in args.scraper_args if arg != '--'] or ['-q', 'all', '--rate', '0']
+
+    catalog = MockCatalog(args.movies)
+    results = []
+    with MockServer(catalog, latency=args.latency / 1000.0, error_rate=args.error_rate,
+                    throttle_rate=args.throttle_rate, retry_after=args.retry_after,
+                    corrupt_rate=args.corrupt_rate) as server:
+        for mode in modes:
+            result = run_mode(server, mode, scraper_args)
+            results.append(result)
+            if args.json:
+                print(json.dumps(result))
+    if not args.json:
+        headers = ['Mode', 'Status', 'Seconds', 'Pages', 'Files', 'Pages/s', 'Files/s', 'p50 ms', 'p99 ms',
+                   '429', '5xx', 'Peak RSS MB', 'CPU s']
+        rows = [[r['mode'], r['status'], r['seconds'], r['pages'], r['files'], r['pages_per_second'],
+                 r['files_per_second'], r['p50_ms'], r['p99_ms'], r['throttled'], r['errors'], r['peak_rss_mb'],
+                 r['cpu_seconds']]
+                for r in results]
+        print(tabulate.tabulate(rows, headers=headers, tablefmt='orgtbl'))
+    failed = [r for r in results if r['status'] != 'ok']
+    for r in failed:
+        sys.stderr.write('Mode "{}" exited with status {}:\n{}\n'.format(r['mode'], r['exit_status'], '\n'.join(r['output'])))
+    if failed:
+        raise SystemExit(1)
+    return results
+
+
+if __name__ == '__main__':
+    main()
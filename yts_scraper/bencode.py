@@ -0,0 +1,164 @@
+import hashlib
+
+# Longest string or integer a .torrent may hold, far above any real one
+MAX_LENGTH = 64 * 1024 * 1024
+DIGITS = frozenset(b'0123456789')
+
+
+class BencodeError(ValueError):
+    pass
+
+
+class TorrentInfo:
+    """
+    Metadata of a parsed .torrent: info-hash, file list, total size and piece count.
+    """
+    __slots__ = ('info_hash', 'name', 'files', 'total_size', 'piece_length', 'piece_count')
+
+    def __init__(self, info_hash, name, files, total_size, piece_length, piece_count):
+        self.info_hash = info_hash
+        self.name = name
+        self.files = files
+        self.total_size = total_size
+        self.piece_length = piece_length
+        self.piece_count = piece_count
+
+    # Export columns, see yts_scraper.export.METADATA_COLUMNS
+    def record(self):
+        return {'info_hash': self.info_hash,
+                'file_count': len(self.files),
+                'total_size': self.total_size,
+                'piece_count': self.piece_count,
+                'files': list(self.files)}
+
+
+def encode(value):
+    if isinstance(value, int):
+        return b'i%de' % value
+    if isinstance(value, str):
+        value = value.encode('utf-8')
+    if isinstance(value, bytes):
+        return b'%d:%s' % (len(value), value)
+    if isinstance(value, list):
+        return b'l' + b''.join(encode(item) for item in value) + b'e'
+    return b'd' + b''.join(encode(key) + encode(value[key]) for key in sorted(value)) + b'e'
+
+
+# Returns (value, index after it). Strings stay bytes, dictionary keys included
+def _decode(data, i):
+    try:
+        token = data[i]
+    except IndexError:
+        raise BencodeError('Truncated data at byte {}'.format(i))
+    if token == 0x69:                               # i<digits>e
+        end = data.find(b'e', i + 1)
+        if end < 0 or end - i > 32:
+            raise BencodeError('Malformed integer at byte {}'.format(i))
+        try:
+            return int(data[i + 1:end]), end + 1
+        except ValueError:
+            raise BencodeError('Malformed integer at byte {}'.format(i))
+    if token in DIGITS:                             # <length>:<bytes>
+        colon = data.find(b':', i)
+        if colon < 0 or colon - i > 10:
+            raise BencodeError('Malformed string length at byte {}'.format(i))
+        try:
+            length = int(data[i:colon])
+        except ValueError:
+            raise BencodeError('Malformed string length at byte {}'.format(i))
+        end = colon + 1 + length
+        if length > MAX_LENGTH or end > len(data):
+            raise BencodeError('Truncated string at byte {}'.format(i))
+        return data[colon + 1:end], end
+    if token == 0x6c:                               # l<items>e
+        items = []
+        i += 1
+        while data[i:i + 1] != b'e':
+            item, i = _decode(data, i)
+            items.append(item)
+        return items, i + 1
+    if token == 0x64:                               # d<key><value>...e
+        items = {}
+        i += 1
+        while data[i:i + 1] != b'e':
+            key, i = _decode(data, i)
+            if not isinstance(key, bytes):
+                raise BencodeError('Dictionary key is not a string at byte {}'.format(i))
+            items[key], i = _decode(data, i)
+        return items, i + 1
+    raise BencodeError('Unexpected byte {!r} at {}'.format(bytes([token]), i))
+
+
+def decode(data):
+    try:
+        value, end = _decode(data, 0)
+    except RecursionError:
+        raise BencodeError('Nested too deeply')
+    if end != len(data):
+        raise BencodeError('Trailing data after byte {}'.format(end))
+    return value
+
+
+def _text(value):
+    if not isinstance(value, bytes):
+        raise BencodeError('Expected a string, got {}'.format(type(value).__name__))
+    return value.decode('utf-8', 'replace')
+
+
+def parse_torrent(data, expected_hash=None):
+    """
+    Parses a BitTorrent v1 metainfo file and returns its TorrentInfo.
+
+    The info-hash is the SHA-1 of the info dictionary exactly as it appears
+    in data. Raises BencodeError when data is not a well-formed torrent, e.g.
+    an HTML error page or a truncated body, or when its info-hash is not
+    expected_hash.
+    """
+    if data[:1] != b'd':
+        raise BencodeError('Not a torrent: starts with {!r}'.format(bytes(data[:16])))
+    info = None
+    info_span = None
+    i = 1
+    try:
+        while data[i:i + 1] != b'e':                # walks the top level by hand to keep the info span
+            key, i = _decode(data, i)
+            start = i
+            value, i = _decode(data, i)
+            if key == b'info':
+                info, info_span = value, (start, i)
+    except RecursionError:
+        raise BencodeError('Nested too deeply')
+    if i + 1 != len(data):
+        raise BencodeError('Trailing data after byte {}'.format(i + 1))
+    if not isinstance(info, dict):
+        raise BencodeError('Torrent has no info dictionary')
+
+    info_hash = hashlib.sha1(data[info_span[0]:info_span[1]]).hexdigest().upper()
+    if expected_hash and info_hash != expected_hash.upper():
+        raise BencodeError('Info-hash {} does not match {}'.format(info_hash, expected_hash.upper()))
+
+    pieces = info.get(b'pieces')
+    piece_length = info.get(b'piece length')
+    if not isinstance(pieces, bytes) or not pieces or len(pieces) % 20:
+        raise BencodeError('Torrent has no valid piece hashes')
+    if not isinstance(piece_length, int) or piece_length <= 0:
+        raise BencodeError('Torrent has no valid piece length')
+
+    name = _text(info.get(b'name', b''))
+    if b'files' in info:
+        if not isinstance(info[b'files'], list):
+            raise BencodeError('Torrent file list is not a list')
+        files = []
+        total_size = 0
+        for entry in info[b'files']:
+            length = entry.get(b'length') if isinstance(entry, dict) else None
+            if not isinstance(length, int) or length < 0:
+                raise BencodeError('Torrent file entry has no valid length')
+            files.append('/'.join(_text(part) for part in entry.get(b'path') or []))
+            total_size += length
+    else:
+        total_size = info.get(b'length')
+        if not isinstance(total_size, int) or total_size < 0:
+            raise BencodeError('Torrent has no valid length')
+        files = [name]
+    return TorrentInfo(info_hash, name, files, total_size, piece_length, len(pieces) // 20)
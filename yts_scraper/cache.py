@@ -0,0 +1,117 @@
+import json
+import os
+import threading
+import time
+
+DEFAULT_CACHE_DIR = os.path.join(os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache'),
+                                 'yts-scraper')
+
+
+class CacheEntry:
+    __slots__ = ('body', 'etag', 'last_modified', 'fresh')
+
+    def __init__(self, body, etag, last_modified, fresh):
+        self.body = body
+        self.etag = etag
+        self.last_modified = last_modified
+        self.fresh = fresh
+
+    # Headers that let the server answer 304 Not Modified instead of resending the page
+    def validators(self):
+        headers = {}
+        if self.etag:
+            headers['If-None-Match'] = self.etag
+        if self.last_modified:
+            headers['If-Modified-Since'] = self.last_modified
+        return headers
+
+
+class ResponseCache:
+    """
+    Persistent SQLite cache for list_movies.json responses.
+
+    Entries are keyed by the full request url. Fresh entries (younger than
+    ttl seconds) are served without touching the network, stale ones are
+    revalidated with ETag/If-Modified-Since, and the least recently used
+    entries are evicted once the stored bodies exceed max_size bytes.
+    """
+    def __init__(self, path, ttl=3600, max_size=256 * 1024 * 1024):
+        self.path = path
+        self.ttl = ttl
+        self.max_size = max_size
+        self.hits = 0
+        self.revalidated = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(path) or os.path.curdir, exist_ok=True)
+        import sqlite3                              # loaded by the runs that open the store
+        self.db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('''CREATE TABLE IF NOT EXISTS responses (
+                               url TEXT PRIMARY KEY,
+                               body BLOB NOT NULL,
+                               etag TEXT,
+                               last_modified TEXT,
+                               stored REAL NOT NULL,
+                               accessed REAL NOT NULL,
+                               size INTEGER NOT NULL)''')
+        self.db.execute('CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)')
+        self.size = self.db.execute('SELECT COALESCE(SUM(size), 0) FROM responses').fetchone()[0]
+
+    def get(self, url):
+        now = time.time()
+        with self.lock:
+            row = self.db.execute('SELECT body, etag, last_modified, stored FROM responses WHERE url = ?',
+                                  (url,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.db.execute('UPDATE responses SET accessed = ? WHERE url = ?', (now, url))
+            body, etag, last_modified, stored = row
+            fresh = (now - stored) < self.ttl
+            if fresh:
+                self.hits += 1
+        return CacheEntry(bytes(body), etag, last_modified, fresh)
+
+    # Returns the parsed page for a response to a (possibly conditional) request, caching it on success
+    def store(self, url, entry, status, body, headers):
+        if status == 304 and entry is not None:
+            with self.lock:
+                self.db.execute('UPDATE responses SET stored = ? WHERE url = ?', (time.time(), url))
+                self.revalidated += 1
+            return json.loads(entry.body)
+        if entry is not None:
+            with self.lock:
+                self.misses += 1                # stale and changed (or the server ignored the validators)
+        data = json.loads(body)
+        if status == 200 and data.get('status') == 'ok':
+            self.put(url, body, headers.get('ETag'), headers.get('Last-Modified'))
+        return data
+
+    def put(self, url, body, etag=None, last_modified=None):
+        now = time.time()
+        with self.lock:
+            old = self.db.execute('SELECT size FROM responses WHERE url = ?', (url,)).fetchone()
+            self.db.execute('INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?)',
+                            (url, bytes(body), etag, last_modified, now, now, len(body)))
+            self.size += len(body) - (old[0] if old else 0)
+            if self.size > self.max_size:
+                self.__evict()
+
+    # Drops least recently used entries until the cache is back under 90% of its budget
+    def __evict(self):
+        target = self.max_size * 0.9
+        rows = self.db.execute('SELECT url, size FROM responses ORDER BY accessed').fetchall()
+        for url, size in rows:
+            if self.size <= target:
+                break
+            self.db.execute('DELETE FROM responses WHERE url = ?', (url,))
+            self.size -= size
+
+    def report(self):
+        return 'Cache: {} hits, {} revalidated, {} misses'.format(self.hits, self.revalidated, self.misses)
+
+    def close(self):
+        with self.lock:
+            self.db.close()
@@ -0,0 +1,155 @@
+import json
+import os
+import threading
+from yts_scraper.cache import DEFAULT_CACHE_DIR
+from yts_scraper.models import Movie, Torrent
+
+DEFAULT_CATALOG = os.path.join(DEFAULT_CACHE_DIR, 'catalog.sqlite')
+
+# --sort-by values and the column each one orders by
+SORT_COLUMNS = {
+    'title': 'm.title',
+    'year': 'm.year',
+    'rating': 'm.rating',
+    'date_added': 'm.date_uploaded_unix',
+    'peers': 'MAX(t.peers)',
+    'seeds': 'MAX(t.seeds)',
+    'download_count': 'm.download_count',
+    'like_count': 'm.like_count',
+}
+
+MOVIE_COLUMNS = ('id', 'url', 'imdb_code', 'title', 'title_long', 'year', 'rating', 'language',
+                 'large_cover_image', 'date_uploaded_unix', 'download_count', 'like_count')
+TORRENT_COLUMNS = ('hash', 'url', 'quality', 'type', 'size', 'size_bytes', 'seeds', 'peers', 'date_uploaded_unix')
+
+
+class Catalog:
+    """
+    Local SQLite mirror of the YTS movie and torrent listings.
+
+    Filled by "yts-scraper sync-catalog" and queried with --catalog, which
+    answers the usual filter flags from indexed tables instead of paging
+    through the live API. Query results are Movie records, like listed pages.
+    """
+    def __init__(self, path=DEFAULT_CATALOG):
+        self.path = path
+        self.lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(path) or os.path.curdir, exist_ok=True)
+        import sqlite3                              # loaded by the runs that open the store
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.executescript('''
+            CREATE TABLE IF NOT EXISTS movies (
+                id INTEGER PRIMARY KEY,
+                url TEXT,
+                imdb_code TEXT,
+                title TEXT,
+                title_long TEXT,
+                year INTEGER,
+                rating REAL,
+                language TEXT,
+                large_cover_image TEXT,
+                date_uploaded_unix INTEGER,
+                download_count INTEGER,
+                like_count INTEGER,
+                genres TEXT);
+            CREATE TABLE IF NOT EXISTS genres (
+                movie_id INTEGER NOT NULL,
+                genre TEXT NOT NULL,
+                PRIMARY KEY (genre, movie_id)) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS torrents (
+                hash TEXT PRIMARY KEY,
+                movie_id INTEGER NOT NULL,
+                url TEXT,
+                quality TEXT,
+                type TEXT,
+                size TEXT,
+                size_bytes INTEGER,
+                seeds INTEGER,
+                peers INTEGER,
+                date_uploaded_unix INTEGER);
+            CREATE INDEX IF NOT EXISTS movies_year ON movies (year);
+            CREATE INDEX IF NOT EXISTS movies_rating ON movies (rating);
+            CREATE INDEX IF NOT EXISTS movies_date_added ON movies (date_uploaded_unix);
+            CREATE INDEX IF NOT EXISTS genres_movie ON genres (movie_id);
+            CREATE INDEX IF NOT EXISTS torrents_movie ON torrents (movie_id);
+            CREATE INDEX IF NOT EXISTS torrents_quality ON torrents (quality, movie_id);
+            CREATE INDEX IF NOT EXISTS torrents_type ON torrents (type, movie_id);
+        ''')
+        self.db.commit()
+
+    # Inserts or refreshes a page of Movie records
+    def upsert(self, movies):
+        with self.lock:
+            for movie in movies:
+                self.db.execute('INSERT OR REPLACE INTO movies VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                                tuple(getattr(movie, column) for column in MOVIE_COLUMNS) + (json.dumps(movie.genres),))
+                self.db.execute('DELETE FROM genres WHERE movie_id = ?', (movie.id,))
+                self.db.executemany('INSERT OR IGNORE INTO genres VALUES (?, ?)',
+                                    [(movie.id, genre.lower()) for genre in movie.genres])
+                self.db.execute('DELETE FROM torrents WHERE movie_id = ?', (movie.id,))
+                self.db.executemany('INSERT OR REPLACE INTO torrents VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                                    [(torrent.hash, movie.id) + tuple(getattr(torrent, column) for column in TORRENT_COLUMNS[1:])
+                                     for torrent in movie.torrents])
+            self.db.commit()
+
+    def has_movies(self, movie_ids):
+        if not movie_ids:
+            return False
+        with self.lock:
+            count = self.db.execute('SELECT COUNT(*) FROM movies WHERE id IN ({})'.format(','.join('?' * len(movie_ids))),
+                                    list(movie_ids)).fetchone()[0]
+        return count == len(set(movie_ids))
+
+    def count(self):
+        with self.lock:
+            return self.db.execute('SELECT COUNT(*) FROM movies').fetchone()[0]
+
+    # Yields Movie records matching the filter flags, each with only its matching torrents
+    def query(self, genre='all', minimum_rating=0, quality='all', format='all', year_limit=0, text='',
+              sort_by='date_added', order_by='desc', offset=0):
+        where = ['m.year >= ?', 'm.rating >= ?']
+        params = [int(year_limit or 0), float(minimum_rating or 0)]
+        if genre and genre != 'all':
+            where.append('m.id IN (SELECT movie_id FROM genres WHERE genre = ?)')
+            params.append(genre.lower())
+        if quality and quality != 'all':
+            where.append('t.quality = ?')
+            params.append(quality)
+        if format and format != 'all':
+            where.append('t.type = ?')
+            params.append(format)
+        if text:
+            where.append('(m.title LIKE ? OR m.imdb_code = ?)')
+            params.extend(['%' + text + '%', text])
+
+        sql = '''SELECT m.id FROM movies m JOIN torrents t ON t.movie_id = m.id
+                 WHERE {} GROUP BY m.id ORDER BY {} {}, m.id {} LIMIT -1 OFFSET ?'''.format(
+            ' AND '.join(where), SORT_COLUMNS.get(sort_by, 'm.date_uploaded_unix'),
+            'DESC' if order_by == 'desc' else 'ASC', 'DESC' if order_by == 'desc' else 'ASC')
+        with self.lock:
+            movie_ids = [row[0] for row in self.db.execute(sql, params + [int(offset)])]
+
+        torrent_where = ['movie_id = ?']
+        torrent_params = []
+        if quality and quality != 'all':
+            torrent_where.append('quality = ?')
+            torrent_params.append(quality)
+        if format and format != 'all':
+            torrent_where.append('type = ?')
+            torrent_params.append(format)
+        torrent_sql = 'SELECT {} FROM torrents WHERE {}'.format(', '.join(TORRENT_COLUMNS), ' AND '.join(torrent_where))
+        movie_sql = 'SELECT {}, genres FROM movies WHERE id = ?'.format(', '.join(MOVIE_COLUMNS))
+
+        for movie_id in movie_ids:
+            with self.lock:
+                row = self.db.execute(movie_sql, (movie_id,)).fetchone()
+                torrents = self.db.execute(torrent_sql, [movie_id] + torrent_params).fetchall()
+            fields = dict(zip(MOVIE_COLUMNS, row[:-1]))
+            yield Movie(genres=json.loads(row[-1] or '[]'),
+                        torrents=[Torrent(*torrent) for torrent in torrents], **fields)
+
+    def close(self):
+        with self.lock:
+            self.db.close()
@@ -0,0 +1,89 @@
+import hashlib
+import json
+import os
+import threading
+
+
+class Checkpoint:
+    """
+    Append-only journal of the pages and torrents a run has completed.
+
+    Each record is a single JSON line written and flushed as soon as the
+    work is done, so a crash or Ctrl-C never loses more than the item in
+    progress and a torn last line is simply ignored. The journal is keyed
+    by the run's parameters; --resume replays it and skips completed work.
+    It is removed once a run finishes.
+    """
+    def __init__(self, directory, params, resume=False):
+        key = hashlib.sha1(json.dumps(params, sort_keys=True).encode('utf-8')).hexdigest()[:16]
+        self.path = os.path.join(directory, key + '.jsonl')
+        self.pages = set()
+        self.hashes = set()
+        self.number_of_pages = None
+        self.resumed = resume and os.path.isfile(self.path)
+        self.lock = threading.Lock()
+
+        os.makedirs(directory, exist_ok=True)
+        if self.resumed:
+            self.__load()
+            mode = 'a'
+        else:
+            mode = 'w'
+        self.file = open(self.path, mode)
+        if mode == 'w':
+            self.__append({'params': params})
+
+    def __load(self):
+        with open(self.path) as journal:
+            for line in journal:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue                        # torn write from an interrupted run
+                if 'page' in record:
+                    self.pages.add(record['page'])
+                elif 'torrent' in record:
+                    self.hashes.add(record['torrent'])
+                elif 'pages' in record:
+                    self.number_of_pages = record['pages']
+
+    def __append(self, record):
+        with self.lock:
+            if self.file.closed:                    # work reported after the run ended is not journaled
+                return
+            self.file.write(json.dumps(record) + '\n')
+            self.file.flush()
+
+    def set_number_of_pages(self, number_of_pages):
+        if number_of_pages != self.number_of_pages:
+            self.number_of_pages = number_of_pages
+            self.__append({'pages': number_of_pages})
+
+    def page_done(self, page):
+        self.pages.add(page)
+        self.__append({'page': page})
+
+    def torrent_done(self, torrent_hash):
+        self.hashes.add(torrent_hash)
+        self.__append({'torrent': torrent_hash})
+
+    def is_page_done(self, page):
+        return page in self.pages
+
+    # Torrent predicate for the run's filter
+    def is_pending(self, torrent):
+        return torrent.hash not in self.hashes
+
+    def report(self):
+        return 'Resuming: {} pages and {} torrents already done'.format(len(self.pages), len(self.hashes))
+
+    def close(self):
+        with self.lock:
+            if not self.file.closed:
+                self.file.close()
+
+    # Called after a complete run, nothing is left to resume
+    def finish(self):
+        self.close()
+        if os.path.isfile(self.path):
+            os.remove(self.path)
@@ -0,0 +1,240 @@
+import csv
+import json
+import os
+import tempfile
+import threading
+
+# (record field, CSV header) for every exported column
+COLUMNS = [
+    ('yts_id', 'YTS ID'),
+    ('imdb_id', 'IMDb ID'),
+    ('title', 'Movie Title'),
+    ('year', 'Year'),
+    ('language', 'Language'),
+    ('rating', 'Rating'),
+    ('quality', 'Quality'),
+    ('format', 'Format'),
+    ('yts_url', 'YTS URL'),
+    ('imdb_url', 'IMDb URL'),
+    ('torrent_url', 'Torrent URL'),
+]
+
+# Added by --torrent-metadata, read from each fetched .torrent
+METADATA_COLUMNS = [
+    ('info_hash', 'Info Hash'),
+    ('file_count', 'Files'),
+    ('total_size', 'Total Size'),
+    ('piece_count', 'Pieces'),
+    ('files', 'File List'),
+]
+
+# Added by --magnet
+MAGNET_COLUMNS = [
+    ('magnet', 'Magnet'),
+]
+
+EXTENSIONS = {'csv': 'csv', 'jsonl': 'jsonl', 'parquet': 'parquet', 'magnet': 'magnet'}
+DEFAULT_EXPORT_NAME = 'YTS-Scraper'
+
+
+class ExportSink:
+    """
+    Buffered, thread-safe writer for exported torrent records.
+
+    Rows are collected in memory and handed to the underlying file in
+    batches, so a run keeps a single file open instead of reopening it for
+    every torrent. close() flushes whatever is left. Callbacks given to
+    when_flushed run once every row written before them is on disk, which
+    is when a --resume journal may count those rows as done.
+    """
+    # False when batches only become readable once the file is closed
+    durable_batches = True
+
+    def __init__(self, path, columns=COLUMNS, batch_size=500):
+        self.path = path
+        self.columns = columns
+        self.batch_size = batch_size
+        self.rows = []
+        self.flushed = []
+        self.written = 0
+        self.closed = False
+        self.lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or os.path.curdir, exist_ok=True)
+
+    def write(self, record):
+        with self.lock:
+            self.rows.append(record)
+            if len(self.rows) >= self.batch_size:
+                self.__flush()
+
+    def when_flushed(self, callback):
+        with self.lock:
+            if self.rows or self.closed:
+                self.flushed.append(callback)
+                return
+        callback()
+
+    def flush(self):
+        with self.lock:
+            self.__flush()
+
+    def __flush(self):
+        if self.closed:                             # rows of workers still running when the run was stopped
+            return
+        if self.rows:
+            self._write_batch(self.rows)
+            self._sync()
+            self.written += len(self.rows)
+            self.rows = []
+        if self.durable_batches:
+            self.__done()
+
+    def __done(self):
+        callbacks, self.flushed = self.flushed, []
+        for callback in callbacks:
+            callback()
+
+    def close(self):
+        with self.lock:
+            if self.closed:
+                return
+            self.__flush()
+            self._close()
+            self.closed = True
+            self.__done()
+
+    def _write_batch(self, rows):
+        raise NotImplementedError
+
+    # Makes the batch durable before the rows are reported as flushed
+    def _sync(self):
+        pass
+
+    def _close(self):
+        pass
+
+
+class CsvSink(ExportSink):
+    def __init__(self, path, columns=COLUMNS, batch_size=500):
+        super().__init__(path, columns, batch_size)
+        exists = os.path.isfile(path) and os.path.getsize(path) > 0
+        self.file = open(path, mode='a', newline='', buffering=1024 * 1024)
+        self.writer = csv.writer(self.file, delimiter=',', lineterminator='\n', quotechar='"', quoting=csv.QUOTE_ALL)
+        if not exists:
+            self.writer.writerow([header for _, header in columns])
+
+    def _write_batch(self, rows):
+        fields = [field for field, _ in self.columns]
+        self.writer.writerows([[self.__cell(row.get(field)) for field in fields] for row in rows])
+
+    # Lists such as the file list of a torrent go in one cell, separated by "|"
+    @staticmethod
+    def __cell(value):
+        if isinstance(value, list):
+            return '|'.join(str(item) for item in value)
+        return value
+
+    def _sync(self):
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    def _close(self):
+        self.file.close()
+
+
+class JsonlSink(ExportSink):
+    def __init__(self, path, columns=COLUMNS, batch_size=500):
+        super().__init__(path, columns, batch_size)
+        self.file = open(path, mode='a', buffering=1024 * 1024)
+
+    def _write_batch(self, rows):
+        fields = [field for field, _ in self.columns]
+        self.file.write(''.join(json.dumps({field: row.get(field) for field in fields}) + '\n' for row in rows))
+
+    def _sync(self):
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    def _close(self):
+        self.file.close()
+
+
+class ParquetSink(ExportSink):
+    """
+    Writes one parquet row group per batch.
+
+    A parquet file cannot be appended to, so the rows of an existing export
+    are copied into a new file under a temporary name first, and the new
+    file replaces the old one when the sink is closed. Like CSV and JSONL,
+    the export then grows across runs, including --resume ones. An
+    interrupted run leaves the old file untouched.
+    """
+    durable_batches = False
+
+    def __init__(self, path, columns=COLUMNS, batch_size=5000):
+        super().__init__(path, columns, batch_size)
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            raise RuntimeError('Parquet export requires pyarrow. Install it with "pip install pyarrow".')
+        self.pyarrow = pyarrow
+        self.parquet = pyarrow.parquet
+        self.writer = None
+        self.temp_path = None
+
+    def __open(self, data):
+        existing = None
+        if os.path.isfile(self.path) and os.path.getsize(self.path) > 0:
+            existing = self.parquet.ParquetFile(self.path)
+            if existing.schema_arrow.names != list(data):
+                raise RuntimeError('{} holds other columns than this run exports. Use another --export-path.'.format(self.path))
+            schema = existing.schema_arrow
+        else:
+            schema = self.pyarrow.table(data).schema
+        fd, self.temp_path = tempfile.mkstemp(dir=os.path.dirname(self.path) or os.path.curdir, prefix='.', suffix='.part')
+        os.close(fd)
+        self.writer = self.parquet.ParquetWriter(self.temp_path, schema)
+        if existing is not None:
+            for row_group in range(existing.num_row_groups):
+                self.writer.write_table(existing.read_row_group(row_group))
+
+    def _write_batch(self, rows):
+        fields = [field for field, _ in self.columns]
+        data = {field: [row.get(field) for row in rows] for field in fields}
+        if self.writer is None:
+            self.__open(data)
+        self.writer.write_table(self.pyarrow.table(data, schema=self.writer.schema))
+
+    def _close(self):
+        if self.writer is not None:
+            self.writer.close()
+            os.replace(self.temp_path, self.path)
+
+
+class MagnetSink(ExportSink):
+    """
+    Plain list of magnet links, one per line, as written by --magnet list.
+    """
+    def __init__(self, path, columns=COLUMNS, batch_size=500):
+        super().__init__(path, columns, batch_size)
+        self.file = open(path, mode='a', buffering=1024 * 1024)
+
+    def _write_batch(self, rows):
+        self.file.write(''.join(row['magnet'] + '\n' for row in rows if row.get('magnet')))
+
+    def _sync(self):
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    def _close(self):
+        self.file.close()
+
+
+SINKS = {'csv': CsvSink, 'jsonl': JsonlSink, 'parquet': ParquetSink, 'magnet': MagnetSink}
+
+
+def open_sink(export_format='csv', path=None, columns=COLUMNS):
+    if path is None:
+        path = os.path.join(os.path.curdir, '{}.{}'.format(DEFAULT_EXPORT_NAME, EXTENSIONS[export_format]))
+    return SINKS[export_format](path, columns)
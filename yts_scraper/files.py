@@ -0,0 +1,90 @@
+import os
+import shutil
+import stat
+import tempfile
+
+CHUNK_SIZE = 64 * 1024
+
+# Linux ioctl that makes dst share src's blocks on copy-on-write file systems (btrfs, xfs)
+FICLONE = 0x40049409
+
+
+# Read once: os.umask can only be read by setting it, which is not safe once worker threads run
+def _read_umask():
+    mask = os.umask(0)
+    os.umask(mask)
+    return mask
+
+
+UMASK = _read_umask()
+
+
+class AtomicFile:
+    """
+    Binary file written under a temporary name and renamed into place on success.
+
+    Readers never see a partially written .torrent or poster; on error the
+    temporary file is removed and the target is left untouched. The file gets
+    the mode of the target it replaces, or the umask's default for new files,
+    not the 0600 of the temporary file.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.file = None
+        self.temp_path = None
+
+    def __enter__(self):
+        directory = os.path.dirname(self.path) or os.path.curdir
+        fd, self.temp_path = tempfile.mkstemp(dir=directory, prefix='.', suffix='.part')
+        self.file = os.fdopen(fd, 'wb')
+        return self.file
+
+    def __exit__(self, exc_type, exc, traceback):
+        self.file.close()
+        if exc_type is None:
+            try:
+                mode = stat.S_IMODE(os.stat(self.path).st_mode)
+            except OSError:
+                mode = 0o666 & ~UMASK
+            os.chmod(self.temp_path, mode)
+            os.replace(self.temp_path, self.path)
+        else:
+            os.unlink(self.temp_path)
+        return False
+
+
+def write_chunks(chunks, path):
+    with AtomicFile(path) as target:
+        for chunk in chunks:
+            target.write(chunk)
+
+
+# Makes target an extra copy of source: a hardlink when possible, else a reflink, else a plain copy
+def clone(source, target):
+    directory = os.path.dirname(target) or os.path.curdir
+    fd, temp_path = tempfile.mkstemp(dir=directory, prefix='.', suffix='.part')     # a name no other clone uses
+    os.close(fd)
+    try:
+        try:
+            os.unlink(temp_path)
+            os.link(source, temp_path)
+        except OSError:
+            _copy(source, temp_path)
+        os.replace(temp_path, target)
+        if os.path.lexists(temp_path):          # rename is a no-op when target already links to source
+            os.unlink(temp_path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.unlink(temp_path)
+        raise
+
+
+def _copy(source, target):
+    with open(source, 'rb') as src, open(target, 'wb') as dst:
+        try:
+            import fcntl
+            fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+            return
+        except (ImportError, OSError):
+            pass
+        shutil.copyfileobj(src, dst, CHUNK_SIZE)
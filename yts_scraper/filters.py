@@ -0,0 +1,103 @@
+class MovieFilter:
+    """
+    Composable, single-pass filter for listed movies and their torrents.
+
+    Movie predicates take a Movie, torrent predicates take a Torrent; both
+    return True to keep it. apply() builds new lists and new Movie records,
+    so the page it was given is never mutated and pages can be filtered
+    concurrently. Movies left without torrents are dropped.
+    """
+    def __init__(self, movie_predicates=None, torrent_predicates=None):
+        self.movie_predicates = list(movie_predicates or [])
+        self.torrent_predicates = list(torrent_predicates or [])
+
+    def movie(self, predicate):
+        self.movie_predicates.append(predicate)
+        return self
+
+    def torrent(self, predicate):
+        self.torrent_predicates.append(predicate)
+        return self
+
+    def apply(self, movies):
+        movie_predicates = self.movie_predicates
+        torrent_predicates = self.torrent_predicates
+        kept = []
+        for movie in movies:
+            if not all(predicate(movie) for predicate in movie_predicates):
+                continue
+            if not torrent_predicates:
+                if movie.torrents:
+                    kept.append(movie)
+                continue
+            torrents = [torrent for torrent in movie.torrents
+                        if all(predicate(torrent) for predicate in torrent_predicates)]
+            if not torrents:
+                continue
+            if len(torrents) == len(movie.torrents):
+                kept.append(movie)
+            else:
+                kept.append(movie.with_torrents(torrents))
+        return kept
+
+
+def min_year(year):
+    return lambda movie: movie.year >= year
+
+
+# Same genre and rating semantics as the API's genre and minimum_rating parameters
+def genre(name):
+    name = name.lower()
+    return lambda movie: any(movie_genre.lower() == name for movie_genre in movie.genres)
+
+
+def min_rating(value):
+    value = float(value)
+    return lambda movie: movie.rating >= value
+
+
+def language(code):
+    return lambda movie: movie.language == code
+
+
+def quality(value):
+    return lambda torrent: torrent.quality == value
+
+
+def torrent_type(value):
+    return lambda torrent: torrent.type == value
+
+
+def min_seeds(count):
+    return lambda torrent: (torrent.seeds or 0) >= count
+
+
+# Bounds are in bytes, None leaves that side open
+def size_range(minimum=None, maximum=None):
+    def predicate(torrent):
+        size = torrent.size_bytes or 0
+        if minimum is not None and size < minimum:
+            return False
+        if maximum is not None and size > maximum:
+            return False
+        return True
+    return predicate
+
+
+# Builds the filter for the command-line flags of a run
+def build_filter(year_limit=0, format='all', quality_value='all', language_code=None,
+                 seeds=0, min_size=None, max_size=None):
+    movie_filter = MovieFilter()
+    if year_limit:
+        movie_filter.movie(min_year(year_limit))
+    if language_code:
+        movie_filter.movie(language(language_code))
+    if format != 'all':
+        movie_filter.torrent(torrent_type(format))
+    if quality_value != 'all':
+        movie_filter.torrent(quality(quality_value))
+    if seeds:
+        movie_filter.torrent(min_seeds(seeds))
+    if min_size is not None or max_size is not None:
+        movie_filter.torrent(size_range(min_size, max_size))
+    return movie_filter
@@ -0,0 +1,147 @@
+import json
+import math
+import os
+from collections import namedtuple
+from itertools import combinations
+from yts_scraper.filters import build_filter, genre, min_rating
+from yts_scraper.layout import Layout
+
+# Options a job may set. Those it leaves out are taken from the command line
+JOB_OPTIONS = ('genre', 'rating', 'quality', 'format', 'year_limit', 'text', 'language', 'min_seeds',
+               'min_size', 'max_size', 'categorize_by', 'background', 'imdb_id')
+
+# The list_movies.json parameters a job narrows the listing with. Jobs only share a query with equal text,
+# since the API matches query_term against more than the listed fields
+Query = namedtuple('Query', ('genre', 'minimum_rating', 'quality', 'text'))
+
+
+class Job:
+    """
+    One filter spec of a --jobs file with its own output folder.
+
+    The listing may come from a query broader than the job's own, so the
+    job's genre and rating are checked again on every movie next to its
+    other predicates (quality is a torrent predicate in any case).
+    """
+    def __init__(self, name, options, directory, extension='.torrent'):
+        self.name = name
+        self.options = options
+        self.directory = directory
+        self.quality = '3D' if (options['quality'] == '3d') else options['quality']
+        self.query = Query(options['genre'], str(options['rating']), self.quality, options['text'])
+        self.filter = build_filter(year_limit=options['year_limit'], format=options['format'],
+                                   quality_value=self.quality, language_code=options['language'],
+                                   seeds=options['min_seeds'],
+                                   min_size=options['min_size'] * 1024 * 1024 if options['min_size'] else None,
+                                   max_size=options['max_size'] * 1024 * 1024 if options['max_size'] else None)
+        if self.query.genre != 'all':
+            self.filter.movie(genre(self.query.genre))
+        if int(self.query.minimum_rating):
+            self.filter.movie(min_rating(self.query.minimum_rating))
+        self.layout = Layout(directory, options['categorize_by'], options['background'], options['imdb_id'], extension)
+
+
+# Reads a YAML (or JSON) list of jobs, either at the top level or under "jobs". Each job is a mapping of
+# JOB_OPTIONS plus an optional "name" and "output" folder; defaults holds the command-line values
+def load_jobs(path, defaults, directory, extension='.torrent'):
+    with open(path) as jobs_file:
+        if path.endswith('.json'):
+            spec = json.load(jobs_file)
+        else:
+            try:
+                import yaml
+            except ImportError:
+                raise RuntimeError('--jobs requires PyYAML for YAML files. Install it with "pip install pyyaml", '
+                                   'or give the jobs as a .json file.')
+            spec = yaml.safe_load(jobs_file)
+    if isinstance(spec, dict):
+        spec = spec.get('jobs')
+    if not isinstance(spec, list) or not spec:
+        raise RuntimeError('{} holds no jobs. Expected a list of filter specs.'.format(path))
+
+    jobs = []
+    names = set()
+    for number, entry in enumerate(spec, 1):
+        entry = dict(entry or {})
+        name = str(entry.pop('name', 'job-{}'.format(number)))
+        output = str(entry.pop('output', name))
+        unknown = set(entry) - set(JOB_OPTIONS)
+        if unknown:
+            raise RuntimeError('Unknown option(s) {} in job "{}".'.format(', '.join(sorted(unknown)), name))
+        if name in names:
+            raise RuntimeError('Job name "{}" is used twice.'.format(name))
+        names.add(name)
+        options = dict(defaults, **entry)
+        for option in ('genre', 'quality', 'format', 'categorize_by'):
+            options[option] = str(options[option]).lower()
+        options['text'] = str(options['text'] or '').lower()
+        options['year_limit'] = int(options['year_limit'] or 0)
+        options['min_seeds'] = int(options['min_seeds'] or 0)
+        jobs.append(Job(name, options, os.path.join(directory, output), extension))
+    return jobs
+
+
+def covers(query, other):
+    return ((query.genre == 'all' or query.genre == other.genre) and
+            int(query.minimum_rating) <= int(other.minimum_rating) and
+            (query.quality == 'all' or query.quality == other.quality) and query.text == other.text)
+
+
+# Narrowest query whose listing holds both
+def merge(query, other):
+    return Query(query.genre if query.genre == other.genre else 'all',
+                 str(min(int(query.minimum_rating), int(other.minimum_rating))),
+                 query.quality if query.quality == other.quality else 'all', query.text)
+
+
+def without_covered(queries):
+    kept = []
+    for query in queries:
+        if any(other != query and covers(other, query) for other in queries):
+            continue
+        if query not in kept:
+            kept.append(query)
+    return kept
+
+
+def plan_queries(jobs, movie_count, limit=50):
+    """
+    Picks the list_movies.json queries that list every job with the fewest pages.
+
+    Starts from one query per distinct job query, drops queries another one
+    already lists and then keeps merging the pair that saves the most pages,
+    e.g. down to one unfiltered walk when the jobs overlap heavily.
+    movie_count(query) returns the number of movies a query lists and is
+    called once per candidate. Returns [(query, [jobs], pages)], every job
+    routed from exactly one query.
+    """
+    counts = {}
+
+    def pages(query):
+        if query not in counts:
+            counts[query] = movie_count(query)
+        return int(math.ceil(counts[query] / float(limit)))
+
+    queries = without_covered([job.query for job in jobs])
+    while len(queries) > 1:
+        best = None
+        for query, other in combinations(queries, 2):
+            if query.text != other.text:
+                continue
+            merged = merge(query, other)
+            saving = sum(pages(covered) for covered in queries if covers(merged, covered)) - pages(merged)
+            if saving >= 0 and (best is None or saving > best[0]):
+                best = (saving, merged)
+        if best is None:
+            break
+        merged = best[1]
+        queries = [merged] + [query for query in queries if not covers(merged, query)]
+
+    plan = [(query, []) for query in queries]
+    for job in jobs:
+        for query, routed in plan:
+            if covers(query, job.query):
+                routed.append(job)
+                break
+    return [(query, routed, pages(query)) for query, routed in plan]
+
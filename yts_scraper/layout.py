@@ -0,0 +1,102 @@
+import math
+import os
+import threading
+
+# Folder levels each --categorize-by value adds under the output directory
+CATEGORY_DEPTH = {'none': 0, 'rating': 1, 'genre': 1, 'rating-genre': 2, 'genre-rating': 2}
+
+
+class Layout:
+    """
+    Plans where the .torrent (or .magnet) files of a run are written.
+
+    The output directory is scanned once, on first use, for existing
+    files with that extension and for directories, no deeper than the
+    layout itself nests them. After that every existence check is a
+    set lookup and every directory is created at most once, however many
+    torrents, genres and threads share it.
+    """
+    def __init__(self, directory, categorize='none', poster=False, imdb_id=False, extension='.torrent'):
+        self.directory = directory
+        self.extension = extension
+        self.categorize = categorize
+        self.poster = poster
+        self.imdb_id = imdb_id
+        self.lock = threading.Lock()
+        self.existing = None
+        self.directories = set()
+
+    # Category folders, then a movie folder with -b; anything deeper (e.g. a client's data) is not ours
+    def __scan(self):
+        depth = CATEGORY_DEPTH.get(self.categorize, 0) + (1 if self.poster else 0)
+        base = os.path.normpath(self.directory)
+        existing = set()
+        for root, directories, files in os.walk(base):
+            level = root[len(base):].count(os.sep) if root != base else 0
+            if level >= depth:
+                directories[:] = []
+            self.directories.add(os.path.normpath(root))
+            for name in files:
+                if name.endswith(self.extension):
+                    existing.add(os.path.normpath(os.path.join(root, name)))
+        self.existing = existing
+
+    def __directory(self, movie, genre):
+        directory = self.directory
+        if self.categorize == 'rating':
+            directory += '/' + str(math.trunc(movie.rating)) + '+'
+        elif self.categorize == 'genre':
+            directory += '/' + str(genre)
+        elif self.categorize == 'rating-genre':
+            directory += '/' + str(math.trunc(movie.rating)) + '+/' + genre
+        elif self.categorize == 'genre-rating':
+            directory += '/' + str(genre) + '/' + str(math.trunc(movie.rating)) + '+'
+        if self.poster:
+            directory += '/' + movie.filename
+        return directory
+
+    def __filename(self, movie, torrent):
+        if self.imdb_id:
+            filename = '{} {} {} - {}'.format(movie.filename, torrent.type.title(), torrent.quality, movie.imdb_code)
+        else:
+            filename = '{} {} {}'.format(movie.filename, torrent.type.title(), torrent.quality)
+        return filename + ' (' + torrent.hash + ')'
+
+    # Returns [(torrent, [(path, exists, poster)])] with one path, without extension, per genre folder the
+    # torrent belongs in, and whether a poster goes next to it. Directories of paths that do not exist yet
+    # are created.
+    def plan(self, movie):
+        if self.categorize in ('genre', 'rating-genre', 'genre-rating'):
+            genres = movie.genres if movie.genres else ['None']
+        else:
+            genres = [None]
+        plan = []
+        with self.lock:
+            if self.existing is None:
+                self.__scan()
+            for torrent in movie.torrents:
+                paths = []
+                for genre in genres:
+                    directory = self.__directory(movie, genre)
+                    path = os.path.join(directory, self.__filename(movie, torrent))
+                    exists = os.path.normpath(path + self.extension) in self.existing
+                    if not exists:
+                        self.__make_directory(directory)
+                    paths.append((path, exists, self.poster))
+                plan.append((torrent, paths))
+        return plan
+
+    def __make_directory(self, directory):
+        key = os.path.normpath(directory)
+        if key in self.directories:
+            return
+        os.makedirs(directory, exist_ok=True)
+        while key and key not in self.directories:  # parents exist now as well
+            self.directories.add(key)
+            key = os.path.dirname(key)
+
+    # Records a file written during the run
+    def add(self, path):
+        with self.lock:
+            if self.existing is not None:
+                self.existing.add(os.path.normpath(path))
@@ -0,0 +1,35 @@
+import os
+from urllib.parse import quote, quote_plus
+
+# Trackers recommended by the YTS API documentation for building magnet links
+DEFAULT_TRACKERS = [
+    'udp://open.demonii.com:1337/announce',
+    'udp://tracker.openbittorrent.com:80',
+    'udp://tracker.coppersurfer.tk:6969',
+    'udp://glotorrents.pw:6969/announce',
+    'udp://tracker.opentrackr.org:1337/announce',
+    'udp://torrent.gresille.org:80/announce',
+    'udp://p4p.arenabg.com:1337',
+    'udp://tracker.leechers-paradise.org:6969',
+]
+
+
+# --trackers takes a file with one tracker per line or a comma separated list
+def load_trackers(value=None):
+    if not value:
+        return list(DEFAULT_TRACKERS)
+    if os.path.isfile(value):
+        with open(value) as trackers_file:
+            lines = [line.strip() for line in trackers_file]
+        return [line for line in lines if line and not line.startswith('#')]
+    return [tracker.strip() for tracker in value.split(',') if tracker.strip()]
+
+
+# Display name the way YTS names its own magnet links
+def display_name(movie, torrent):
+    return '{} [{}] [{}]'.format(movie.title_long or movie.title, torrent.quality, torrent.type)
+
+
+def magnet_uri(info_hash, name, trackers=()):
+    uri = 'magnet:?xt=urn:btih:{}&dn={}'.format(info_hash, quote_plus(name))
+    return uri + ''.join('&tr=' + quote(tracker, safe='') for tracker in trackers)
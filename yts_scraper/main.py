@@ -1,13 +1,35 @@
 import argparse
+import sys
 import traceback
-from yts_scraper.scraper import Scraper
+from yts_scraper.cache import DEFAULT_CACHE_DIR
+from yts_scraper.catalog import DEFAULT_CATALOG
+from yts_scraper.watch import parse_interval
 
+# Subcommands given as the first argument, e.g. "yts-scraper sync-catalog"
+COMMANDS = {
+    'sync-catalog': 'Mirrors every YTS movie and torrent into the local catalog used by --catalog',
+    'bench': 'Runs the scraper against a local mock YTS API and reports throughput',
+    'coordinate': 'Splits a run into page ranges for "yts-scraper work" processes and merges their results',
+    'work': 'Downloads page ranges handed out by a "yts-scraper coordinate" process',
+    'watch': 'Polls the newest YTS releases every --interval and downloads the new ones, keeping connections and the index warm',
+}
+
+
+# argparse type of --listen, e.g. "8700" or "0.0.0.0:8700". Returns (host, port), the host is None for
+# a bare port and the shard server then binds the loopback interface
+def parse_listen(value):
+    host, _, port = value.rpartition(':')
+    if not port.isdigit() or int(port) > 65535:
+        raise argparse.ArgumentTypeError('invalid address "{}", use e.g. 8700 or 0.0.0.0:8700'.format(value))
+    return host or None, int(port)
 
-def main():
-    desc = 'A command-line tool to for downloading .torrent files from YTS'
 
+def build_parser(command=None):
+    desc = COMMANDS.get(command, 'A command-line tool to for downloading .torrent files from YTS')
+    prog = 'yts-scraper {}'.format(command) if command else None
 
-    parser = argparse.ArgumentParser(description=desc)
+
+    parser = argparse.ArgumentParser(prog=prog, description=desc)
     parser.add_argument('-o', '--output',
                         help='Output Directory',
                         dest='output',
@@ -117,6 +139,34 @@ def main():
                         const='0',
                         nargs='?')
 
+    parser.add_argument('--language',
+                        help='Only downloads movies in the given language code, e.g. "en".',
+                        dest='language',
+                        type=str.lower,
+                        required=False,
+                        default=None)
+
+    parser.add_argument('--min-seeds',
+                        help='Only downloads torrents with at least this many seeds.',
+                        dest='min_seeds',
+                        type=int,
+                        required=False,
+                        default=0)
+
+    parser.add_argument('--min-size',
+                        help='Only downloads torrents of at least this many megabytes.',
+                        dest='min_size',
+                        type=int,
+                        required=False,
+                        default=None)
+
+    parser.add_argument('--max-size',
+                        help='Only downloads torrents of at most this many megabytes.',
+                        dest='max_size',
+                        type=int,
+                        required=False,
+                        default=None)
+
     parser.add_argument('-b', '--background',
                         help='''Append -b to download movie posters.
                                 This will pack .torrent file and the image together in a folder.
@@ -139,8 +189,8 @@ def main():
 
     parser.add_argument('-m', '--multiprocess',
                         help='''Append -m to download using multiprocessor.
-                                This option makes the process significantly faster
-                                but is prone to raising flags and causing server to deny requests.
+                                This option makes the process significantly faster.
+                                Requests are throttled per host, see --rate.
                              ''',
                         dest='multiprocess',
                         type=bool,
@@ -159,6 +209,60 @@ def main():
                         const=True,
                         nargs='?')
 
+    parser.add_argument('--export-format',
+                        help='''File format used by --csv-only.
+                                Valid arguments are: "csv", "jsonl", "parquet". "parquet" requires pyarrow.
+                             ''',
+                        dest='export_format',
+                        type=str.lower,
+                        required=False,
+                        choices=['csv', 'jsonl', 'parquet'],
+                        default='csv')
+
+    parser.add_argument('--export-path',
+                        help='''Output file used by --csv-only.
+                                Defaults to "YTS-Scraper.<format>" in the current folder.
+                             ''',
+                        dest='export_path',
+                        type=str,
+                        required=False,
+                        default=None)
+
+    parser.add_argument('--torrent-metadata',
+                        help='''Append --torrent-metadata to fetch and check every torrent of a --csv-only run
+                                and add its info-hash, file count, total size, piece count and file list
+                                to the export.
+                             ''',
+                        dest='torrent_metadata',
+                        type=bool,
+                        required=False,
+                        default=False,
+                        const=True,
+                        nargs='?')
+
+    parser.add_argument('--magnet',
+                        help='''Builds magnet links from the listed hashes instead of downloading .torrent files.
+                                Valid arguments are: "files" (a .magnet file in place of each .torrent),
+                                "list" (every link in one file, see --export-path).
+                                With --csv-only, adds a magnet column to the export.
+                             ''',
+                        dest='magnet',
+                        type=str.lower,
+                        required=False,
+                        choices=['files', 'list'],
+                        default=None,
+                        const='files',
+                        nargs='?')
+
+    parser.add_argument('--trackers',
+                        help='''Trackers added to the magnet links: a comma separated list or a file with one
+                                tracker per line. Defaults to the trackers recommended by YTS.
+                             ''',
+                        dest='trackers',
+                        type=str,
+                        required=False,
+                        default=None)
+
     parser.add_argument('-p', '--page',
                         help='Enter an integer to skip ahead number of pages',
                         dest='page',
@@ -179,17 +283,292 @@ def main():
                         const=True,
                         nargs='?')
 
+    parser.add_argument('--incremental',
+                        help='''Append --incremental to skip torrents handled by earlier runs.
+                                Known torrents are skipped before any request is made and,
+                                when sorting by "latest", paging stops at the first fully known page.
+                             ''',
+                        dest='incremental',
+                        type=bool,
+                        required=False,
+                        default=False,
+                        const=True,
+                        nargs='?')
+
+    parser.add_argument('--index',
+                        help='''Path of the --incremental index.
+                                Defaults to ".yts-scraper-index.sqlite" in the output directory.
+                             ''',
+                        dest='index',
+                        type=str,
+                        required=False,
+                        default=None)
+
+    parser.add_argument('--resume',
+                        help='''Append --resume to continue an interrupted run with the same parameters.
+                                Completed pages and torrents are read from the run's checkpoint journal
+                                in the cache directory and skipped.
+                             ''',
+                        dest='resume',
+                        type=bool,
+                        required=False,
+                        default=False,
+                        const=True,
+                        nargs='?')
+
+    parser.add_argument('-w', '--workers',
+                        help='''Number of worker threads used with -m.
+                                The HTTP connection pool is sized to match.
+                             ''',
+                        dest='workers',
+                        type=int,
+                        required=False,
+                        default=10)
+
+    parser.add_argument('--queue-size',
+                        help='''Maximum number of listed movies waiting to be downloaded.
+                                Listing pauses while the queue is full.
+                             ''',
+                        dest='queue_size',
+                        type=int,
+                        required=False,
+                        default=100)
+
+    parser.add_argument('-e', '--engine',
+                        help='''Fetch engine. Valid arguments are: "thread", "async".
+                                "async" runs listing and downloads on a single event loop
+                                with --workers requests in flight. Requires aiohttp.
+                             ''',
+                        dest='engine',
+                        type=str.lower,
+                        required=False,
+                        choices=['thread', 'async'],
+                        default='thread')
+
+    parser.add_argument('--rate',
+                        help='''Requests per second each host (API, torrents, images) starts at.
+                                The rate slowly rises while the server keeps up and is halved whenever
+                                it throttles. 0 disables the limit, or starts at --max-rate when it is set.
+                             ''',
+                        dest='rate',
+                        type=float,
+                        required=False,
+                        default=10)
+
+    parser.add_argument('--max-rate',
+                        help='Requests per second the rate of a host never rises above. Default is no cap.',
+                        dest='max_rate',
+                        type=float,
+                        required=False,
+                        default=None)
+
+    parser.add_argument('--retries',
+                        help='Number of times a throttled or failed request is retried.',
+                        dest='retries',
+                        type=int,
+                        required=False,
+                        default=5)
+
+    parser.add_argument('--cache-dir',
+                        help='''Directory of the on-disk cache of API list pages.
+                                Defaults to ~/.cache/yts-scraper.
+                             ''',
+                        dest='cache_dir',
+                        type=str,
+                        required=False,
+                        default=DEFAULT_CACHE_DIR)
+
+    parser.add_argument('--cache-ttl',
+                        help='''Seconds a cached API page is served without asking the server.
+                                Older pages are revalidated with ETag/If-Modified-Since.
+                             ''',
+                        dest='cache_ttl',
+                        type=int,
+                        required=False,
+                        default=3600)
+
+    parser.add_argument('--cache-size',
+                        help='Maximum size of the API page cache in megabytes.',
+                        dest='cache_size',
+                        type=int,
+                        required=False,
+                        default=256)
+
+    parser.add_argument('--no-cache',
+                        help='Append --no-cache to always fetch API pages from the server.',
+                        dest='no_cache',
+                        type=bool,
+                        required=False,
+                        default=False,
+                        const=True,
+                        nargs='?')
+
+    parser.add_argument('--catalog',
+                        help='''Answers the filter flags from the local catalog built by
+                                "yts-scraper sync-catalog" instead of paging through the API.
+                                Optionally takes the catalog path (default ~/.cache/yts-scraper/catalog.sqlite).
+                             ''',
+                        dest='catalog',
+                        type=str,
+                        required=False,
+                        default=None,
+                        const=DEFAULT_CATALOG,
+                        nargs='?')
+
+    parser.add_argument('--jobs',
+                        help='''YAML (or JSON) file with a list of filter specs to run in one go.
+                                Overlapping specs share their API queries, every listed movie goes to
+                                each job it matches and every torrent is fetched once.
+                             ''',
+                        dest='jobs',
+                        type=str,
+                        required=False,
+                        default=None)
+
+    parser.add_argument('--coordinator',
+                        help='''Shard queue of a coordinate/work run: a file path shared by local processes,
+                                or the http://host:port a coordinator serves with --listen.
+                             ''',
+                        dest='coordinator',
+                        type=str,
+                        required=False,
+                        default=None)
+
+    parser.add_argument('--listen',
+                        help='''Port, or address:port, on which the coordinator serves its shard queue to workers.
+                                A bare port only accepts workers on this machine, use e.g. 0.0.0.0:8700 for others.
+                             ''',
+                        dest='listen',
+                        type=parse_listen,
+                        required=False,
+                        default=None)
+
+    parser.add_argument('--token',
+                        help='''Shared secret between a coordinator serving --listen and its workers.
+                                Defaults to the YTS_SCRAPER_TOKEN environment variable; without either,
+                                the coordinator generates one and prints it.
+                             ''',
+                        dest='token',
+                        type=str,
+                        required=False,
+                        default=None)
+
+    parser.add_argument('--shard-size',
+                        help='Number of pages the coordinator hands out at once. Default is 10.',
+                        dest='shard_size',
+                        type=int,
+                        required=False,
+                        default=10)
+
+    parser.add_argument('--lease-timeout',
+                        help='''Seconds after which the shard of a worker that stopped responding
+                                goes to another worker. Default is 600.
+                             ''',
+                        dest='lease_timeout',
+                        type=int,
+                        required=False,
+                        default=600)
+
+    parser.add_argument('--stats',
+                        help='''Append --stats to print request latencies, transferred bytes, retries,
+                                cache hits, skipped files, queue depth and where the run spent its time
+                                when it ends.
+                             ''',
+                        dest='stats',
+                        type=bool,
+                        required=False,
+                        default=False,
+                        const=True,
+                        nargs='?')
+
+    parser.add_argument('--trace',
+                        help='Appends one JSON line per request, retry, cache lookup, page and skipped file to this file.',
+                        dest='trace',
+                        type=str,
+                        required=False,
+                        default=None)
+
+    parser.add_argument('--metrics-file',
+                        help='Writes the run metrics to this file in the Prometheus text format when the run ends.',
+                        dest='metrics_file',
+                        type=str,
+                        required=False,
+                        default=None)
+
+    parser.add_argument('--interval',
+                        help='''Time between two polls of "yts-scraper watch", e.g. "30s", "5m" or "1h".
+                                Default is "5m".
+                             ''',
+                        dest='interval',
+                        type=parse_interval,
+                        required=False,
+                        default='5m')
+
+    parser.add_argument('--backfill',
+                        help='''Append --backfill to have the first poll of "yts-scraper watch" download the whole listing
+                                when there is no index yet. By default it only marks the newest releases as known.
+                             ''',
+                        dest='backfill',
+                        type=bool,
+                        required=False,
+                        default=False,
+                        const=True,
+                        nargs='?')
+
+    parser.add_argument('--metrics-port',
+                        help='''Serves the live run metrics in the Prometheus text format on http://127.0.0.1:PORT/metrics.
+                                "yts-scraper watch" also reports its health and progress as JSON on /health.
+                             ''',
+                        dest='metrics_port',
+                        type=int,
+                        required=False,
+                        default=None)
+
+    parser.add_argument('--host',
+                        help='''API host to scrape. Defaults to "yts.mx".
+                                A full base url such as "http://localhost:8000" is also accepted.
+                             ''',
+                        dest='host',
+                        type=str,
+                        required=False,
+                        default='yts.mx')
+
+    return parser
+
+
+def main():
+    argv = sys.argv[1:]
+    command = argv[0] if argv and argv[0] in COMMANDS else None
+    if command:
+        argv = argv[1:]
+    if command == 'bench':                  # has its own options, see yts_scraper/bench.py
+        from yts_scraper import bench
+        bench.main(argv)
+        return
+    parser = build_parser(command)
 
     try:
-        args = parser.parse_args()
+        args = parser.parse_args(argv)
+        args.command = command
+        from yts_scraper.scraper import Scraper     # deferred so --help does not load the HTTP stack
         scraper = Scraper(args)
-        scraper.download()
+        if command == 'sync-catalog':
+            scraper.sync_catalog()
+        elif command == 'coordinate':
+            scraper.coordinate()
+        elif command == 'work':
+            scraper.work()
+        elif command == 'watch':
+            scraper.watch()
+        else:
+            scraper.download()
 
     except KeyboardInterrupt:
         print('\nKeypress Detected. Exiting...\n')
+        sys.exit(130)
     except Exception:
         traceback.print_exc()
-    exit(0)
+        sys.exit(1)
 
 if __name__ == '__main__':
     main()
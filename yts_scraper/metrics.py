@@ -0,0 +1,247 @@
+import json
+import os
+import threading
+import time
+from yts_scraper.files import AtomicFile
+
+PREFIX = 'yts_scraper_'
+
+# Request phases, in the order they happen. dns is only measured apart from connect by the async engine
+PHASES = ('queue', 'dns', 'connect', 'ttfb', 'transfer', 'disk')
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(int(len(values) * fraction), len(values) - 1)]
+
+
+# Kind of a downloaded file for the per-kind breakdown; API pages are "api"
+def download_kind(path):
+    return 'torrent' if path.endswith('.torrent') else 'poster'
+
+
+# Connection reuse line printed by both HTTP engines at the end of a run
+def connection_report(requests_made, connections, retries):
+    reused = max(requests_made - connections, 0)
+    rate = (100.0 * reused / requests_made) if requests_made else 0.0
+    return 'HTTP: {} requests over {} connections ({} reused, {:.1f}%), {} retries'.format(
+        requests_made, connections, reused, rate, retries)
+
+
+class Metrics:
+    """
+    Counters, gauges, timings and trace events of a scraper run.
+
+    Shared by the HTTP engines and the Scraper, and safe to use from any
+    worker thread. Timings are kept in full, so the p50/p99 of the summary
+    and the Prometheus output are exact. When a trace path is given every
+    request, retry, cache lookup, page and skipped file is also written to
+    it as one JSON line.
+    """
+    def __init__(self, trace_path=None):
+        self.started = time.time()
+        self.cpu_started = time.process_time()
+        self.counters = {}
+        self.gauges = {}
+        self.timings = {}
+        self.lock = threading.Lock()
+        self.server = None
+        self.health = None                          # callable returning the /health record, set by watch
+        self.trace = None
+        if trace_path:
+            os.makedirs(os.path.dirname(trace_path) or os.path.curdir, exist_ok=True)
+            self.trace = open(trace_path, 'a', buffering=1024 * 1024)
+
+    @staticmethod
+    def __key(name, labels):
+        return name, tuple(sorted(labels.items()))
+
+    def inc(self, name, value=1, **labels):
+        key = self.__key(name, labels)
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    # Keeps the last value and, with peak, also the highest one seen under name + '_max'
+    def gauge(self, name, value, peak=False, **labels):
+        key = self.__key(name, labels)
+        with self.lock:
+            self.gauges[key] = value
+            if peak:
+                peak_key = self.__key(name + '_max', labels)
+                self.gauges[peak_key] = max(self.gauges.get(peak_key, value), value)
+
+    def observe(self, name, seconds, **labels):
+        key = self.__key(name, labels)
+        with self.lock:
+            self.timings.setdefault(key, []).append(seconds)
+
+    def event(self, event, **fields):
+        if self.trace is None:
+            return
+        fields['ts'] = round(time.time(), 6)
+        fields['event'] = event
+        line = json.dumps(fields) + '\n'
+        with self.lock:
+            if not self.trace.closed:
+                self.trace.write(line)
+
+    # Records one HTTP attempt. phases maps a PHASES name to seconds
+    def request(self, kind, url, status, phases, size=0, attempt=0, error=None):
+        self.inc('requests', kind=kind, status=str(status or error))
+        if size:
+            self.inc('bytes', size, kind=kind)
+        for phase, seconds in phases.items():
+            if seconds is not None:
+                self.observe('request_seconds', seconds, kind=kind, phase=phase)
+        self.observe('request_seconds', sum(seconds for seconds in phases.values() if seconds), kind=kind, phase='total')
+        self.event('request', kind=kind, url=url, status=status, attempt=attempt, bytes=size, error=error,
+                   **{phase: round(seconds, 6) for phase, seconds in phases.items() if seconds is not None})
+
+    def retry(self, kind, url, reason, delay):
+        self.inc('retries', kind=kind, reason=str(reason))
+        self.event('retry', kind=kind, url=url, reason=reason, delay=round(delay, 3))
+
+    def cache(self, url, result):
+        self.inc('cache', result=result)
+        self.event('cache', url=url, result=result)
+
+    # Sum of the timings of name whose labels include the given ones
+    def total(self, name, **labels):
+        wanted = set(labels.items())
+        with self.lock:
+            return sum(sum(values) for (key, key_labels), values in self.timings.items()
+                       if key == name and wanted <= set(key_labels))
+
+    def count(self, name, **labels):
+        wanted = set(labels.items())
+        with self.lock:
+            return sum(value for (key, key_labels), value in self.counters.items()
+                       if key == name and wanted <= set(key_labels))
+
+    def prometheus(self):
+        self.gauge('cpu_seconds', time.process_time() - self.cpu_started)
+        self.gauge('uptime_seconds', time.time() - self.started)
+        lines = []
+        with self.lock:
+            counters = sorted(self.counters.items())
+            gauges = sorted(self.gauges.items())
+            timings = sorted((key, list(values)) for key, values in self.timings.items())
+
+        def series(name, labels, value, extra=()):
+            labels = list(labels) + list(extra)
+            text = ','.join('{}="{}"'.format(label, str(label_value).replace('"', '\\"')) for label, label_value in labels)
+            return '{}{}{} {}'.format(PREFIX, name, '{' + text + '}' if text else '', value)
+
+        typed = set()
+        for (name, labels), value in counters:
+            if name not in typed:
+                lines.append('# TYPE {}{}_total counter'.format(PREFIX, name))
+                typed.add(name)
+            lines.append(series(name + '_total', labels, value))
+        for (name, labels), value in gauges:
+            if name not in typed:
+                lines.append('# TYPE {}{} gauge'.format(PREFIX, name))
+                typed.add(name)
+            lines.append(series(name, labels, round(value, 6)))
+        for (name, labels), values in timings:
+            if name not in typed:
+                lines.append('# TYPE {}{} summary'.format(PREFIX, name))
+                typed.add(name)
+            for quantile in (0.5, 0.9, 0.99):
+                lines.append(series(name, labels, round(percentile(values, quantile), 6), [('quantile', quantile)]))
+            lines.append(series(name + '_sum', labels, round(sum(values), 6)))
+            lines.append(series(name + '_count', labels, len(values)))
+        return '\n'.join(lines) + '\n'
+
+    def write_prometheus(self, path):
+        os.makedirs(os.path.dirname(path) or os.path.curdir, exist_ok=True)
+        with AtomicFile(path) as target:
+            target.write(self.prometheus().encode('utf-8'))
+
+    # Serves the Prometheus text format on http://host:port/metrics from a daemon thread.
+    # When a health callable is set, /health answers with its JSON record, 503 while it is failing
+    def serve(self, port, host='127.0.0.1'):
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer    # only for --metrics-port
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                if self.path.split('?')[0] == '/health' and metrics.health is not None:
+                    record = metrics.health()
+                    body = json.dumps(record).encode('utf-8')
+                    self.send_response(200 if record.get('status') == 'ok' else 503)
+                    self.send_header('Content-Type', 'application/json')
+                    self.send_header('Content-Length', str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+                    return
+                if self.path.split('?')[0] not in ('/metrics', '/'):
+                    self.send_error(404)
+                    return
+                body = metrics.prometheus().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return 'http://{}:{}/metrics'.format(host, self.server.server_address[1])
+
+    # End-of-run report: per-kind latency and volume, then where the run spent its time
+    def summary(self):
+        wall = time.time() - self.started
+        cpu = time.process_time() - self.cpu_started
+        lines = ['Metrics:']
+        for kind in ('api', 'torrent', 'poster'):
+            requests_made = self.count('requests', kind=kind)
+            if not requests_made:
+                continue
+            with self.lock:
+                totals = list(self.timings.get(self.__key('request_seconds', {'kind': kind, 'phase': 'total'}), []))
+            lines.append('  {:<8}{:>7} requests  p50 {:>8.1f} ms  p99 {:>8.1f} ms  {:>9.1f} KB  {} retries'.format(
+                kind, requests_made, percentile(totals, 0.5) * 1000, percentile(totals, 0.99) * 1000,
+                self.count('bytes', kind=kind) / 1024.0, self.count('retries', kind=kind)))
+
+        phases = []
+        for phase in PHASES:
+            seconds = self.total('request_seconds', phase=phase)
+            if seconds:
+                phases.append('{} {:.2f}s'.format(phase, seconds))
+        if phases:
+            lines.append('  Request phases: ' + ', '.join(phases))
+
+        # Busy seconds summed over every worker, so they can add up to more than the wall time.
+        # Time queued behind the rate limiter or the connection pool counts as throttle
+        throttle = self.total('request_seconds', phase='queue')
+        disk = self.total('request_seconds', phase='disk')
+        api = self.total('request_seconds', kind='api', phase='total') - self.total('request_seconds', kind='api', phase='queue')
+        busy = {'api': api,
+                'cdn': self.total('request_seconds', phase='total') - api - throttle - disk,
+                'throttle': throttle,
+                'disk': disk,
+                'cpu': cpu}
+        lines.append('  Busy time: {} in {:.2f}s wall. Mostly waiting on: {}'.format(
+            ', '.join('{} {:.2f}s'.format(name, seconds) for name, seconds in busy.items()), wall,
+            max(busy, key=busy.get)))
+
+        with self.lock:
+            queue_peak = self.gauges.get(self.__key('queue_depth_max', {}), 0)
+        lines.append('  Skipped files: {}. Invalid files: {}. Peak download queue depth: {}'.format(
+            self.count('files_skipped'), self.count('files_invalid'), queue_peak))
+        return '\n'.join(lines)
+
+    def close(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+        with self.lock:
+            if self.trace is not None and not self.trace.closed:
+                self.trace.close()
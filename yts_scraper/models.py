@@ -0,0 +1,83 @@
+import sys
+
+# Characters that cannot appear in file names on common file systems
+FILENAME_TABLE = {ord(character): None for character in "'/\\:*?<>|"}
+
+
+def _intern(value):
+    return sys.intern(value) if isinstance(value, str) else value
+
+
+class Torrent:
+    """
+    One torrent of a movie, holding only the fields the scraper uses.
+
+    Repeated values such as quality and type are interned so thousands of
+    records share a handful of strings.
+    """
+    __slots__ = ('hash', 'url', 'quality', 'type', 'size', 'size_bytes', 'seeds', 'peers', 'date_uploaded_unix')
+
+    def __init__(self, hash, url, quality, type, size=None, size_bytes=None, seeds=None, peers=None,
+                 date_uploaded_unix=None):
+        self.hash = hash
+        self.url = url
+        self.quality = _intern(quality)
+        self.type = _intern(type)
+        self.size = size
+        self.size_bytes = size_bytes
+        self.seeds = seeds
+        self.peers = peers
+        self.date_uploaded_unix = date_uploaded_unix
+
+    @classmethod
+    def from_api(cls, data):
+        return cls(data.get('hash'), data.get('url'), data.get('quality'), data.get('type'), data.get('size'),
+                   data.get('size_bytes'), data.get('seeds'), data.get('peers'), data.get('date_uploaded_unix'))
+
+
+class Movie:
+    """
+    A listed movie, parsed from the API payload which is dropped right away.
+
+    Descriptions, cast and the unused image urls are never kept.
+    """
+    __slots__ = ('id', 'url', 'imdb_code', 'title', 'title_long', 'year', 'rating', 'language', 'genres',
+                 'large_cover_image', 'date_uploaded_unix', 'download_count', 'like_count', 'torrents')
+
+    def __init__(self, id, url, imdb_code, title, title_long, year, rating, language, genres, large_cover_image,
+                 date_uploaded_unix=None, download_count=None, like_count=None, torrents=()):
+        self.id = id
+        self.url = url
+        self.imdb_code = imdb_code
+        self.title = title
+        self.title_long = title_long
+        self.year = year or 0
+        self.rating = rating or 0
+        self.language = _intern(language)
+        self.genres = tuple(_intern(genre) for genre in genres or ())
+        self.large_cover_image = large_cover_image
+        self.date_uploaded_unix = date_uploaded_unix
+        self.download_count = download_count
+        self.like_count = like_count
+        self.torrents = tuple(torrents)
+
+    @classmethod
+    def from_api(cls, data):
+        return cls(data.get('id'), data.get('url'), data.get('imdb_code'), data.get('title'),
+                   data.get('title_long'), data.get('year'), data.get('rating'), data.get('language'),
+                   data.get('genres'), data.get('large_cover_image'), data.get('date_uploaded_unix'),
+                   data.get('download_count'), data.get('like_count'),
+                   [Torrent.from_api(torrent) for torrent in data.get('torrents') or []])
+
+    # Same movie with a different set of torrents; the original is left untouched
+    def with_torrents(self, torrents):
+        movie = Movie.__new__(Movie)
+        for field in Movie.__slots__:
+            setattr(movie, field, getattr(self, field))
+        movie.torrents = tuple(torrents)
+        return movie
+
+    # Long title stripped of characters that are not allowed in file names
+    @property
+    def filename(self):
+        return (self.title_long or '').translate(FILENAME_TABLE)
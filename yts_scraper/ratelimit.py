@@ -0,0 +1,130 @@
+import random
+import threading
+import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlsplit
+
+# Responses that mean "slow down" rather than "this request is wrong"
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+
+class HostLimiter:
+    """
+    Token bucket and AIMD concurrency window for a single host.
+
+    Every successful response widens the window by roughly one slot per
+    window's worth of requests and raises the request rate the same way,
+    so the rate keeps probing upward from its starting value until the
+    server pushes back or max_rate (None for no cap) is reached. A
+    throttled response halves both the window and the request rate, at
+    most once per second so that a burst of rejected in-flight requests
+    counts as a single congestion event. Thread-safe; callers sleep for the delay that
+    try_acquire returns, so the same object serves the thread and async engines.
+    """
+    def __init__(self, rate, max_concurrency, max_rate=None):
+        self.max_rate = float(max_rate) if max_rate else None
+        self.rate = min(float(rate) or self.max_rate, self.max_rate) if self.max_rate else float(rate)
+        self.max_concurrency = max_concurrency
+        self.window = float(max_concurrency)
+        self.in_flight = 0
+        self.tokens = max(self.rate, 1.0)
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self.last_decrease = 0.0
+        self.lock = threading.Lock()
+
+    # Returns 0 when a request may start, otherwise the seconds to wait before asking again
+    def try_acquire(self):
+        with self.lock:
+            now = time.monotonic()
+            if now < self.blocked_until:
+                return self.blocked_until - now
+            if self.in_flight >= int(self.window):
+                return 0.05
+            if self.rate:
+                burst = max(self.rate, 1.0)
+                self.tokens = min(burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens < 1.0:
+                    return (1.0 - self.tokens) / self.rate
+                self.tokens -= 1.0
+            self.in_flight += 1
+            return 0
+
+    def acquire(self):
+        delay = self.try_acquire()
+        while delay:
+            time.sleep(delay)
+            delay = self.try_acquire()
+
+    def release(self, throttled=False, retry_after=None):
+        with self.lock:
+            self.in_flight = max(self.in_flight - 1, 0)
+            now = time.monotonic()
+            if throttled:
+                if retry_after:
+                    self.blocked_until = max(self.blocked_until, now + retry_after)
+                if now - self.last_decrease < 1.0:
+                    return
+                self.last_decrease = now
+                self.window = max(self.window / 2, 1.0)
+                if self.rate:
+                    self.rate = max(self.rate / 2, 1.0)
+            else:
+                self.window = min(self.window + 1.0 / self.window, float(self.max_concurrency))
+                if self.rate:
+                    self.rate = self.rate + 1.0 / self.rate
+                    if self.max_rate is not None:
+                        self.rate = min(self.rate, self.max_rate)
+
+
+class RateLimiter:
+    """
+    Per-host limiters shared by all workers.
+
+    The API, the torrent CDN and the image host each get their own budget,
+    created on first use. rate is where each host starts, max_rate the
+    ceiling it may climb to (None for no cap).
+    """
+    def __init__(self, rate=10, max_concurrency=10, retries=5, backoff=0.5, max_backoff=60, max_rate=None):
+        self.rate = rate
+        self.max_rate = max_rate
+        self.max_concurrency = max_concurrency
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.hosts = {}
+        self.lock = threading.Lock()
+
+    def host(self, url):
+        netloc = urlsplit(url).netloc
+        with self.lock:
+            limiter = self.hosts.get(netloc)
+            if limiter is None:
+                limiter = HostLimiter(self.rate, self.max_concurrency, self.max_rate)
+                self.hosts[netloc] = limiter
+            return limiter
+
+    # Exponential backoff with full jitter, unless the server told us how long to wait
+    def delay(self, attempt, retry_after=None):
+        if retry_after is not None:
+            return min(retry_after, self.max_backoff)
+        return random.uniform(0, min(self.max_backoff, self.backoff * (2 ** attempt)))
+
+
+# Parses a Retry-After header given either as seconds or as an HTTP date
+def parse_retry_after(value):
+    if not value:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        when = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if when.tzinfo is None:
+        when = when.replace(tzinfo=timezone.utc)
+    return max((when - datetime.now(timezone.utc)).total_seconds(), 0.0)
@@ -1,16 +1,48 @@
 from operator import truediv
 import os
+import queue
+import threading
+import time
 import sys
-import math
 import json
-import csv
-import requests
-from tqdm import tqdm
-from fake_useragent import UserAgent
+import socket
 from multiprocessing.dummy import Pool as ThreadPool
-import tabulate
+from yts_scraper.session import Session
+from yts_scraper.ratelimit import RateLimiter
+from yts_scraper.cache import ResponseCache
+from yts_scraper.state import SeenIndex, INDEX_FILENAME
+from yts_scraper.catalog import Catalog, DEFAULT_CATALOG
+from yts_scraper.filters import build_filter
+from yts_scraper.models import Movie
+from yts_scraper.export import open_sink, COLUMNS, METADATA_COLUMNS, MAGNET_COLUMNS
+from yts_scraper.bencode import BencodeError, parse_torrent
+from yts_scraper.magnet import display_name, load_trackers, magnet_uri
+from yts_scraper.files import clone, write_chunks
+from yts_scraper.layout import Layout
+from yts_scraper.jobs import JOB_OPTIONS, load_jobs, plan_queries
+from yts_scraper.checkpoint import Checkpoint
+from yts_scraper.metrics import Metrics
+from yts_scraper.useragents import random_user_agent
+from yts_scraper.watch import WatchStatus
 
-tabulate.PRESERVE_WHITESPACE = True
+# Seconds a worker waits before asking again while every remaining shard is leased by another worker
+SHARD_POLL_INTERVAL = 5
+
+# Newest pages whose movies a watch without an index takes as already there, so a few
+# pages of releases can push the listing down between polls before a walk runs past them
+SEED_PAGES = 3
+
+
+# tabulate is only loaded by runs that print a table
+def tabulate_rows(*args, **kwargs):
+    import tabulate
+    tabulate.PRESERVE_WHITESPACE = True
+    return tabulate.tabulate(*args, **kwargs)
+
+
+# Names the cause of a failed request in logs, e.g. "ConnectTimeout: ..." or "JSONDecodeError: ..."
+def describe(error):
+    return '{}: {}'.format(type(error).__name__, error) if str(error) else type(error).__name__
 
 class Scraper:
     """
@@ -20,6 +52,51 @@ class Scraper:
     """
     # Constructor
     def __init__(self, args):
+        # coordinate splits the run into page ranges, work takes them and adopts the coordinator's options
+        self.shards = None
+        self.shard = None
+        self.shard_rows = []
+        self.shard_skipped = 0
+        self.last_page = None
+        self.coordinating = args.command == 'coordinate'
+        self.worker_id = '{}-{}'.format(socket.gethostname(), os.getpid())
+        self.lease_timeout = args.lease_timeout
+        self.shard_size = args.shard_size if (args.shard_size >= 1) else 1
+        self.listen = args.listen
+        self.token = None
+        self.run_pages = None
+        if args.command in ('coordinate', 'work'):
+            from yts_scraper.shards import open_shards, ShardQueue, TOKEN_ENV   # sqlite3 and http.server
+            self.token = args.token or os.environ.get(TOKEN_ENV)
+            if not args.coordinator:
+                raise RuntimeError('"yts-scraper {}" requires --coordinator'.format(args.command))
+            if self.coordinating:
+                if args.output:                 # each worker writes to its own -o
+                    raise RuntimeError('"yts-scraper coordinate" downloads nothing itself, pass -o to each '
+                                       '"yts-scraper work" instead. The merged export goes to --export-path.')
+                self.shards = ShardQueue(args.coordinator)
+            else:
+                self.shards = open_shards(args.coordinator, self.token)
+                info = self.shards.info()
+                if info is None:
+                    raise RuntimeError('No run is set up at {}. Start "yts-scraper coordinate" first.'.format(args.coordinator))
+                vars(args).update(info['params'])
+                self.run_pages = info['number_of_pages']
+
+        # Magnet links are built from the listed hashes, so no torrent is fetched. --magnet list is a
+        # --csv-only run whose export is a plain list of links
+        if args.magnet == 'list':
+            args.csv_only = True
+            args.export_format = 'magnet'
+        args.trackers = ','.join(load_trackers(args.trackers))      # workers elsewhere get the list, not the file
+        self.magnet = args.magnet
+        self.trackers = args.trackers.split(',') if args.trackers else []
+        self.extension = '.magnet' if self.magnet else '.torrent'
+        self.run_params = None
+        if self.coordinating:
+            from yts_scraper.shards import RUN_PARAMS
+            self.run_params = {name: getattr(args, name) for name in RUN_PARAMS}
+
         self.output = args.output
         self.genre = args.genre
         self.minimum_rating = args.rating
@@ -35,26 +112,80 @@ class Scraper:
         self.view = args.view
         self.text = args.text
         self.format = args.format
+        self.workers = args.workers if (args.workers >= 1) else 1
+        self.engine = args.engine
+        self.limiter = RateLimiter(rate=args.rate, max_concurrency=self.workers, retries=args.retries,
+                                   max_rate=args.max_rate)
+        # watch polls for new releases, so its cached pages are always revalidated
+        self.watching = args.command == 'watch'
+        self.cache = None
+        if not args.no_cache:
+            self.cache = ResponseCache(os.path.join(args.cache_dir, 'responses.sqlite'),
+                                       ttl=0 if self.watching else args.cache_ttl,
+                                       max_size=args.cache_size * 1024 * 1024)
+        # Request timings, retries, cache lookups and queue depth, reported when the run ends
+        self.metrics = Metrics(trace_path=args.trace)
+        self.stats = args.stats
+        self.metrics_file = args.metrics_file
+        if args.metrics_port is not None:
+            print('Serving metrics on {}'.format(self.metrics.serve(args.metrics_port)))
+        self.session = Session(host=args.host, workers=self.workers, limiter=self.limiter, cache=self.cache,
+                               metrics=self.metrics)
+        self.aio = None
+        self.queue = None
+        self.queue_size = args.queue_size if (args.queue_size >= 1) else 1
+        self.worker_error = None
+        self.lock = threading.Lock()
 
         self.url = None
+        self.probe_url = None
         self.existing_file_counter = None
         self.skip_exit_condition = None
         self.pbar = None
         self.movies = []
         self.torrentNumber = 1
         self.numberOfPages = 0
+        self.movie_count = 0
         self.table = [["#","Name","Year","Format","Quality","Size","Hash"]]
 
-        self.data = []
         self.checkedPage = 0
         self.numberOfTorrents = 0
         self.knowHowManyPages = False
-        
-        self.numberOfTries = 0
+
+        # sync-catalog mirrors the whole listing and writes no files
+        self.sync = args.command == 'sync-catalog'
+        self.incremental = args.incremental
+        self.catalog = None
+        if self.sync or args.catalog:
+            self.catalog = Catalog(args.catalog or DEFAULT_CATALOG)
+
+        # watch keeps downloading into one layout, new releases are found by walking the newest pages
+        self.watch_status = None
+        if self.watching:
+            if args.view or args.csv_only or args.catalog or args.jobs or args.resume:
+                raise RuntimeError('"yts-scraper watch" cannot be combined with --view-only, --csv-only, --catalog, '
+                                   '--jobs or --resume')
+            self.watch_status = WatchStatus(args.interval)
+            self.backfill = args.backfill
+            self.metrics.health = self.__health
+
+        # --jobs runs several filter specs over a shared listing, each into its own folder under --output
+        self.jobs = None
+        self.routes = None
+        self.routed = {}
+        self.fetched = {}
+        if args.jobs:
+            if args.command or args.view or args.csv_only or args.catalog or args.incremental or args.resume:
+                raise RuntimeError('--jobs cannot be combined with commands, --view-only, --csv-only, --catalog, '
+                                   '--incremental or --resume')
+            self.jobs = load_jobs(args.jobs, {option: getattr(args, option) for option in JOB_OPTIONS},
+                                  os.path.join(os.path.curdir, self.output) if self.output else os.path.curdir,
+                                  self.extension)
 
         # Set output directory
+        self.directory = os.path.curdir
 
-        if args.view == False:
+        if args.view == False and not self.sync and not self.coordinating and self.jobs is None:
 
             if args.output:
                 if not args.csv_only:
@@ -70,23 +201,257 @@ class Scraper:
                     self.directory = os.path.curdir
 
         # Args for downloading in reverse chronological order
-        if args.sort_by == 'latest':
+        if args.sort_by == 'latest' or self.watching:
             self.sort_by = 'date_added'
             self.order_by = 'desc'
         else:
             self.order_by = 'asc'
 
+        # The catalog keeps every movie, filters are applied when it is queried
+        if self.sync:
+            self.genre = 'all'
+            self.minimum_rating = '0'
+            self.quality = 'all'
+            self.format = 'all'
+            self.year_limit = 0
+            self.text = ''
+            self.sort_by = 'date_added'
+            self.order_by = 'desc'
+
         # YTS API has a limit of 50 entries
         self.limit = 50
 
+        # Index of torrents and movies handled by earlier --incremental runs
+        self.index = None
+        self.stop_page = None
+        if (args.incremental or self.watching) and not self.sync:
+            query = '|'.join(str(value) for value in (self.genre, self.minimum_rating, self.quality,
+                                                      self.format, self.year_limit, self.text))
+            self.index = SeenIndex(args.index or os.path.join(self.directory, INDEX_FILENAME), query)
+
+        # Rows of --csv-only runs go through one buffered writer that is flushed when the run ends
+        self.export = None
+        self.export_format = args.export_format
+        self.export_path = args.export_path
+        self.torrent_metadata = args.torrent_metadata
+        self.export_columns = COLUMNS + METADATA_COLUMNS if self.torrent_metadata else COLUMNS
+        if self.magnet:
+            self.export_columns = self.export_columns + MAGNET_COLUMNS
+        if self.csv_only and not self.sync and self.shards is None:     # workers report their rows to the coordinator
+            self.export = open_sink(args.export_format, args.export_path, self.export_columns)
+
+        # Target paths of downloads, planned against one scan of the output directory
+        self.layout = None
+        if self.view == False and self.csv_only == False and self.jobs is None:
+            self.layout = Layout(self.directory, self.categorize, self.poster, self.imdb_id, self.extension)
+
+        # Predicates every listed movie and torrent must pass, known torrents are checked last
+        self.filter = build_filter(year_limit=self.year_limit, format=self.format, quality_value=self.quality,
+                                   language_code=args.language, seeds=args.min_seeds,
+                                   min_size=args.min_size * 1024 * 1024 if args.min_size else None,
+                                   max_size=args.max_size * 1024 * 1024 if args.max_size else None)
+        if self.index is not None:
+            self.filter.torrent(self.index.is_new)
+
+        # Journal of completed pages and torrents, replayed by --resume
+        self.checkpoint = None
+        self.page_pending = {}
+        self.skipped_pages = 0
+        if self.view == False and self.shards is None and self.jobs is None and not self.watching:     # shard leases and the watch index already make those runs resumable
+            params = {'command': args.command, 'genre': self.genre, 'rating': self.minimum_rating,
+                      'quality': self.quality, 'format': self.format, 'year': self.year_limit,
+                      'text': self.text, 'sort': [self.sort_by, self.order_by], 'page': self.page_arg,
+                      'categorize': self.categorize, 'directory': os.path.abspath(self.directory),
+                      'poster': self.poster, 'imdb_id': self.imdb_id, 'csv_only': self.csv_only,
+                      'export': [args.export_format, args.export_path], 'host': args.host,
+                      'catalog': args.catalog, 'language': args.language, 'seeds': args.min_seeds,
+                      'size': [args.min_size, args.max_size]}
+            self.checkpoint = Checkpoint(os.path.join(args.cache_dir, 'checkpoints'), params, resume=args.resume)
+            if self.checkpoint.resumed:
+                print(self.checkpoint.report())
+                if self.checkpoint.number_of_pages is not None:
+                    self.numberOfPages = self.checkpoint.number_of_pages
+                    self.knowHowManyPages = True
+            elif args.resume:
+                print('No checkpoint found for these parameters. Starting from the beginning.')
+            self.filter.torrent(self.checkpoint.is_pending)
+
+        # Workers take the page count from the coordinator instead of probing it
+        if self.run_pages is not None:
+            self.numberOfPages = self.run_pages
+            self.knowHowManyPages = True
+
+    # Listing feeds a bounded queue that download workers drain while later pages are still being fetched
     def __initialize_download(self):
+        self.__prepare_download()
+        self.queue = queue.Queue(maxsize=self.queue_size)
+        consumers = [threading.Thread(target=self.__download_worker, daemon=True)
+                     for _ in range(self.workers if self.multiprocess else 1)]
+        for consumer in consumers:
+            consumer.start()
+        if self.catalog is not None:
+            for movie in self.__query_catalog():
+                self.__enqueue((None, movie, self.__plan(movie)))
+        elif self.jobs is not None:
+            self.__list_jobs()
+        else:
+            self.__filterMoviesAndObtainTorrents()
+        for consumer in consumers:
+            self.__enqueue(None)                    # one sentinel per worker
+        for consumer in consumers:
+            consumer.join()
+        if self.worker_error is not None:
+            raise self.worker_error
+        self.__finish_download()
+
+    async def __initialize_download_async(self):
+        self.__prepare_download()
+        self.queue = self.aio.queue(maxsize=self.queue_size)
+        consumers = [self.aio.spawn(self.__download_worker_async()) for _ in range(self.workers)]
+        try:
+            if self.catalog is not None:
+                for movie in self.__query_catalog():
+                    await self.queue.put((None, movie, self.__plan(movie)))
+            elif self.jobs is not None:
+                await self.__list_jobs_async()
+            else:
+                await self.__filterMoviesAndObtainTorrentsAsync()
+            for consumer in consumers:
+                await self.queue.put(None)
+            await self.aio.gather(*consumers)
+        finally:
+            for consumer in consumers:
+                consumer.cancel()
+        if self.worker_error is not None:
+            raise self.worker_error
+        self.__finish_download()
+
+    def __download_worker(self):
+        while True:
+            item = self.queue.get()
+            try:
+                if item is None:
+                    return
+                if self.worker_error is not None:       # keep draining so the producer never blocks
+                    continue
+                page, movie, plan = item
+                try:
+                    self.__downloadMovie(movie, plan)
+                    self.__movie_done(page)
+                except BaseException as error:          # includes sys.exit from the existing files prompt
+                    self.worker_error = error
+            finally:
+                self.queue.task_done()                  # lets queue.join() wait for a shard's downloads
+
+    async def __download_worker_async(self):
+        while True:
+            item = await self.queue.get()
+            try:
+                if item is None:
+                    return
+                if self.worker_error is not None:       # keep draining so the producer never blocks
+                    continue
+                page, movie, plan = item
+                try:
+                    await self.__downloadMovieAsync(movie, plan)
+                    self.__movie_done(page)
+                except (Exception, SystemExit) as error:     # cancellation still ends the task
+                    self.worker_error = error
+            finally:
+                self.queue.task_done()
+
+    # Hands a (page, movie, plan) item to the download workers, blocking while the queue is full
+    def __enqueue(self, item):
+        self.queue.put(item)
+        self.metrics.gauge('queue_depth', self.queue.qsize(), peak=True)
+
+    # Target paths of a movie's torrents, worked out before the movie is queued
+    def __plan(self, movie):
+        if self.routes is not None:
+            return self.__plan_routed(movie)
+        if self.layout is None:
+            return None
+        return self.layout.plan(movie)
+
+    # Every torrent gets the paths of all the jobs that want it, so it is fetched once for all of them
+    def __plan_routed(self, movie):
+        with self.lock:
+            wanted = self.routed.get(movie.id)
+        plan = []
+        for torrent in movie.torrents:
+            paths = []
+            for job in wanted[torrent.hash]:
+                for _, planned in job.layout.plan(movie.with_torrents([torrent])):
+                    paths.extend(planned)
+            plan.append((torrent, paths))
+        return plan
+
+    def __page_listed(self, page, movies, started):
+        seconds = time.perf_counter() - started
+        self.metrics.observe('page_seconds', seconds)
+        self.metrics.event('page', page=page, movies=len(movies), seconds=round(seconds, 6))
+        self.__track_page(page, movies)
+
+    # Counts the movies of a page still to be handled, so a page is journaled only once all of them are
+    def __track_page(self, page, movies):
+        if self.checkpoint is None:
+            return
+        if not movies:
+            self.__journal(self.checkpoint.page_done, page)
+            return
+        with self.lock:
+            self.page_pending[page] = len(movies)
+
+    def __movie_done(self, page):
+        if self.checkpoint is None or page is None:
+            return
+        with self.lock:
+            self.page_pending[page] -= 1
+            done = self.page_pending[page] == 0
+            if done:
+                del self.page_pending[page]
+        if done:
+            self.__journal(self.checkpoint.page_done, page)
+
+    # Rows in the export buffer are lost if the run is killed, so their work is journaled once they are on disk
+    def __journal(self, done, value):
+        if self.export is not None:
+            self.export.when_flushed(lambda: done(value))
+        else:
+            done(value)
+
+    # The journal is dropped after a complete run, or kept for --resume when pages had to be skipped
+    def __finish_checkpoint(self):
+        if self.checkpoint is None:
+            return
+        if self.export is not None:                 # rows are journaled as they reach the file
+            self.export.close()
+        if self.skipped_pages:
+            print('{} pages could not be fetched. Run again with --resume to retry them.'.format(str(self.skipped_pages)))
+            self.checkpoint.close()
+        else:
+            self.checkpoint.finish()
+
+    def __log(self, message):
+        if self.pbar is not None:
+            self.pbar.write(message)
+        else:
+            print(message)
+
+    # Prints the run parameters and opens the progress bar
+    def __prepare_download(self):
         # Used for exit/continue prompt that's triggered after 10 existing files
         self.existing_file_counter = 0
         self.skip_exit_condition = False
 
-        if self.view == False and self.csv_only == False:
+        if self.jobs is not None:
+            print('\nInitializing download of {} jobs:\n'.format(len(self.jobs)))
+            for job in self.jobs:
+                print('{}:\t{}'.format(job.name, job.directory))
+            print('\nDownload starting...\n')
+        elif self.view == False and self.csv_only == False:
             print('\nInitializing download with these parameters:\n')
-            print('Directory:\t{}\nQuality:\t{}\nMovie Genre:\t{}\nMinimum Rating:\t{}\nCategorization:\t{}\nMinimum Year:\t{}\nStarting page:\t{}\nMovie posters:\t{}\nAppend IMDb ID:\t{}\nMultiprocess:\t{}\n'
+            print('Directory:\t{}\nQuality:\t{}\nMovie Genre:\t{}\nMinimum Rating:\t{}\nCategorization:\t{}\nMinimum Year:\t{}\nStarting page:\t{}\nMovie posters:\t{}\nAppend IMDb ID:\t{}\nMultiprocess:\t{}\nEngine:\t\t{}\n'
                   .format(
                       self.directory,
                       self.quality,
@@ -97,169 +462,243 @@ class Scraper:
                       self.page_arg,
                       str(self.poster),
                       str(self.imdb_id),
-                      str(self.multiprocess)
+                      str(self.multiprocess),
+                      self.engine
                       )
                  )
+            print('Download starting...\n')
 
-        movies = []
-        
-        for data_item in self.data:
-            if data_item.get('movies') != None:
-                movies = movies + data_item.get('movies')
-
-        if len(movies) == 0:
-            print('Could not find any movies with given parameters')
-            sys.exit(0)
-        else:
-            if self.view == True:
-                print('Displaying results...')
-            if self.view == False and self.csv_only == False:
-                print('Download starting...\n')
-
-        # Create progress bar
+        # Create progress bar. Its total grows as listed pages are filtered
         if self.view == False and self.csv_only == False:
+            from tqdm import tqdm                   # only runs that download draw a progress bar
 
             self.pbar = tqdm(
-                total=self.numberOfTorrents,
+                total=0,
                 position=1,
                 leave=True,
                 desc='Downloading',
                 unit='Files'
                 )
-            self.pbar.write(tabulate.tabulate(tabular_data=[],headers=['#'.ljust(len(str(self.numberOfTorrents))-2), 'Movie name'.ljust(40), 'Year'.ljust(5), 'Format'.ljust(5), 'Quality'.ljust(5),'Size'.ljust(8),'Hash'.ljust(38)], tablefmt='orgtbl'))
-        if self.multiprocess:
-            pool = ThreadPool(10)
-            pool.map(self.__downloadMovie, movies)
-        else:
-            for movie in movies:
-                self.__downloadMovie(movie)
+            self.pbar.write(tabulate_rows(tabular_data=[],headers=['#'.ljust(3), 'Movie name'.ljust(40), 'Year'.ljust(5), 'Format'.ljust(5), 'Quality'.ljust(5),'Size'.ljust(8),'Hash'.ljust(38)], tablefmt='orgtbl'))
+
+    def __finish_download(self):
         print()                               # emtpy line to remove a double progress line
+        self.__finish_checkpoint()
+
+        if self.torrentNumber == 1:
+            if self.pbar is not None:
+                self.pbar.close()
+            if self.index is not None:
+                print('No new torrents since the last run')
+            else:
+                print('Could not find any movies with given parameters')
+            sys.exit(0)
 
         if self.view:
-            print(tabulate.tabulate(self.table, headers='firstrow', tablefmt='fancy_grid') + '\n')        
+            print('Displaying results...')
+            print(tabulate_rows(self.table, headers='firstrow', tablefmt='fancy_grid') + '\n')        
 
         if self.view == False and self.csv_only == False:
             self.pbar.close()
             print('\nDownload finished.')
     
-    def __downloadMovie(self,movie):
-        movie_id = str(movie.get('id'))
-        movie_rating = movie.get('rating')
-        movie_genres = movie.get('genres') if movie.get('genres') else ['None']
-        movie_name_short = movie.get('title')
-        imdb_id = movie.get('imdb_code')
-        year = movie.get('year')
-        language = movie.get('language')
-        yts_url = movie.get('url')
-        movie_name = movie.get('title_long').translate({ord(i):None for i in "'/\:*?<>|"})
-        movie_torrents = movie.get('torrents')
-        for movie_torrent in movie_torrents:
-            movie_quality = movie_torrent.get('quality')
-            movie_size = movie_torrent.get('size')
-            movie_type = movie_torrent.get('type').title()
-            torrent_hash = movie_torrent.get('hash')
-            torrent_url = movie_torrent.get('url')
-            if self.view:
-                self.table.append([str(self.torrentNumber),movie_name_short[:42],year,movie_type,movie_quality,movie_size,torrent_hash])
-            if self.csv_only:
-                self.__log_csv(movie_id, imdb_id, movie_name_short, year, language, movie_rating, movie_quality, yts_url, torrent_url, movie_type)
-            if self.view == False and self.csv_only == False:
-                bin_content_img = (requests.get(movie.get('large_cover_image'))).content if self.poster else None
-                bin_content_tor = (requests.get(torrent_url)).content
-                is_download_successful = False
-                if self.categorize == "genre" or self.categorize == "rating-genre" or self.categorize == "genre-rating":
-                    for genre in movie_genres:
-                        path = self.__build_path(movie_name, movie_rating, movie_quality, genre, imdb_id, torrent_hash, movie_type)
-                        is_download_successful = self.__download_file(bin_content_tor, bin_content_img, path, movie_name, movie_id) 
+    # Torrent files are parsed before they are written, see __validator
+    def __downloadMovie(self,movie,plan):
+        listed = movie
+        written = {}
+        if self.view == False and self.csv_only == False:
+            assets, torrents = self.__plan_downloads(movie, plan)
+            written = dict.fromkeys(torrents)
+            for url, targets, torrent in assets:
+                try:
+                    info = self.session.download(url, targets[0], validate=self.__validator(torrent))
+                except BencodeError as error:
+                    movie = self.__invalid_torrent(movie, torrent, error)
+                    del written[torrent]
+                    continue
+                self.__link_copies(targets)
+                if torrent is not None:
+                    written[torrent] = info
+            self.__remember(written, assets)
+        elif self.csv_only and self.torrent_metadata:
+            for torrent in movie.torrents:
+                try:
+                    written[torrent] = self.session.fetch(torrent.url, self.__validator(torrent))
+                except BencodeError as error:
+                    movie = self.__invalid_torrent(movie, torrent, error)
+        self.__saveMovie(movie, written, complete=len(movie.torrents) == len(listed.torrents))
+
+    async def __downloadMovieAsync(self,movie,plan):
+        listed = movie
+        written = {}
+        if self.view == False and self.csv_only == False:
+            assets, torrents = self.__plan_downloads(movie, plan)
+            written = dict.fromkeys(torrents)
+            results = await self.aio.gather(*[self.aio.download(url, targets[0], validate=self.__validator(torrent))
+                                             for url, targets, torrent in assets], return_exceptions=True)
+            for (url, targets, torrent), result in zip(assets, results):
+                if isinstance(result, BencodeError):
+                    movie = self.__invalid_torrent(movie, torrent, result)
+                    del written[torrent]
+                    continue
+                if isinstance(result, BaseException):
+                    raise result
+                self.__link_copies(targets)
+                if torrent is not None:
+                    written[torrent] = result
+            self.__remember(written, assets)
+        elif self.csv_only and self.torrent_metadata:
+            results = await self.aio.gather(*[self.aio.fetch(torrent.url, self.__validator(torrent))
+                                             for torrent in movie.torrents], return_exceptions=True)
+            for torrent, result in zip(movie.torrents, results):
+                if isinstance(result, BencodeError):
+                    movie = self.__invalid_torrent(movie, torrent, result)
+                elif isinstance(result, BaseException):
+                    raise result
                 else:
-                    path = self.__build_path(movie_name, movie_rating, movie_quality, None, imdb_id, torrent_hash, movie_type)
-                    is_download_successful = self.__download_file(bin_content_tor, bin_content_img, path, movie_name, movie_id)
-                if is_download_successful:
-                    self.pbar.write(tabulate.tabulate(tabular_data=[[str(self.torrentNumber).ljust(max(len(str(self.numberOfTorrents))-3,3)), movie_name_short.ljust(42)[:42], str(year).ljust(7), movie_type.ljust(8), movie_quality.ljust(9),movie_size.ljust(10),torrent_hash.ljust(40)[:40]]], tablefmt='orgtbl'))
-                    self.pbar.update()
-            self.torrentNumber += 1
+                    written[torrent] = result
+        self.__saveMovie(movie, written, complete=len(movie.torrents) == len(listed.torrents))
 
-    # Creates a file path for each download
-    def __build_path(self, movie_name, rating, quality, movie_genre, imdb_id, torrent_hash, movie_type):
-        if self.csv_only:
-            return
+    def __magnet(self,movie,torrent):
+        return magnet_uri(torrent.hash, display_name(movie, torrent), self.trackers)
 
-        directory = self.directory
-        if self.categorize == 'none':
-            pass
-        if self.categorize == 'rating':
-            directory += '/' + str(math.trunc(rating)) + '+'
-        elif self.categorize == 'genre':
-            directory += '/' + str(movie_genre)
-        elif self.categorize == 'rating-genre':
-            directory += '/' + str(math.trunc(rating)) + '+/' + movie_genre
-        elif self.categorize == 'genre-rating':
-            directory += '/' + str(movie_genre) + '/' + str(math.trunc(rating)) + '+'
-
-        if self.poster:
-            directory += '/' + movie_name
-
-        os.makedirs(directory, exist_ok=True)
-
-        if self.imdb_id:
-            filename = '{} {} {} - {}'.format(movie_name, movie_type.title(), quality, imdb_id)
-        else:
-            filename = '{} {} {}'.format(movie_name, movie_type.title(), quality)
+    # A .torrent must parse and carry the info-hash the API listed; error pages and truncated bodies are
+    # fetched again. Returns None for posters
+    def __validator(self,torrent):
+        if torrent is None:
+            return None
+        return lambda body: parse_torrent(body, torrent.hash)
 
-        filename = filename + ' (' + torrent_hash + ')'
+    # A torrent that stayed invalid after every retry is left out of the movie, so it is neither reported
+    # nor journaled, and the movie is not marked as seen: a resumed or incremental run tries it again
+    def __invalid_torrent(self,movie,torrent,error):
+        self.__log('{}: Invalid torrent file ({}). Skipping...'.format(movie.filename, error))
+        self.metrics.inc('files_invalid')
+        self.metrics.event('invalid', url=torrent.url, error=str(error))
+        return movie.with_torrents([other for other in movie.torrents if other is not torrent])
 
-        path = os.path.join(directory, filename)
-        return path
+    # Lists every remote file of a movie once, with all the paths it has to appear at. A torrent already
+    # saved at one of its paths, or by an earlier --jobs query, is copied from there instead of fetched.
+    # Returns ([(url, [paths], torrent or None for the poster)], torrents that will be written)
+    def __plan_downloads(self,movie,plan):
+        movie_name = movie.filename
+        assets = []
+        posters = []
+        torrents = []
+        for torrent, planned in plan:
+            paths = []
+            source = self.fetched.get(torrent.hash)
+            for path, exists, poster in planned:
+                if self.__file_exists(path, exists, movie_name):
+                    source = source or path + self.extension
+                else:
+                    paths.append(path)
+                    if poster:                      # the -b of the run, or the background option of the job
+                        posters.append(path + '.jpg')
+            if paths:
+                torrents.append(torrent)
+                targets = [path + self.extension for path in paths]
+                if source is not None:
+                    self.__link_copies([source] + targets)
+                elif self.magnet:
+                    write_chunks([self.__magnet(movie, torrent).encode('utf-8') + b'\n'], targets[0])
+                    self.__link_copies(targets)
+                else:
+                    assets.append((torrent.url, targets, torrent))
+        if posters:
+            assets.append((movie.large_cover_image, posters, None))      # one fetch, linked next to every torrent
+        return assets, torrents
 
-    # Write binary content to .torrent file
-    def __download_file(self, bin_content_tor, bin_content_img, path, movie_name, movie_id):
-        if self.csv_only:
-            return
-        if self.view:
+    # The first target holds the downloaded file, the others become hardlinks (or reflinks/copies) of it
+    def __link_copies(self,targets):
+        for target in targets[1:]:
+            clone(targets[0], target)
+        if self.layout is not None:
+            for target in targets:
+                self.layout.add(target)
+
+    # Torrents written for the jobs of one query are copied, not fetched again, for the jobs of later ones
+    def __remember(self,written,assets):
+        if self.routes is None:
             return
+        with self.lock:
+            for url, targets, torrent in assets:
+                if torrent in written:
+                    self.fetched[torrent.hash] = targets[0]
+
+    # Displays, logs or reports a movie. In download mode only the given (just written) torrents are reported.
+    # downloaded maps those torrents to their parsed metadata, None for copies of files already on disk.
+    # A movie counts as seen by --incremental only once none of its listed torrents was dropped
+    def __saveMovie(self,movie,downloaded,complete=True):
+        movie_id = str(movie.id)
+        movie_rating = movie.rating
+        movie_name_short = movie.title
+        imdb_id = movie.imdb_code
+        year = movie.year
+        language = movie.language
+        yts_url = movie.url
+        for movie_torrent in movie.torrents:
+            movie_quality = movie_torrent.quality
+            movie_size = movie_torrent.size
+            movie_type = movie_torrent.type.title()
+            torrent_hash = movie_torrent.hash
+            torrent_url = movie_torrent.url
+            with self.lock:                         # download workers report movies concurrently
+                number = self.torrentNumber
+                self.torrentNumber += 1
+            if self.view:
+                self.table.append([str(number),movie_name_short[:42],year,movie_type,movie_quality,movie_size,torrent_hash])
+            if self.csv_only or (self.shard is not None and movie_torrent in downloaded):
+                self.__log_csv(movie_id, imdb_id, movie_name_short, year, language, movie_rating, movie_quality, yts_url, torrent_url, movie_type, downloaded.get(movie_torrent),
+                               self.__magnet(movie, movie_torrent) if self.magnet else None)
+            if self.view == False and self.csv_only == False:
+                if movie_torrent in downloaded:
+                    self.pbar.write(tabulate_rows(tabular_data=[[str(number).ljust(max(len(str(self.numberOfTorrents))-3,3)), movie_name_short.ljust(42)[:42], str(year).ljust(7), movie_type.ljust(8), movie_quality.ljust(9),movie_size.ljust(10),torrent_hash.ljust(40)[:40]]], tablefmt='orgtbl'))
+                    self.pbar.update()
+            if self.index is not None and self.view == False:
+                self.index.add_torrent(torrent_hash, movie.id)
+            if self.checkpoint is not None:
+                self.__journal(self.checkpoint.torrent_done, torrent_hash)
+        if self.index is not None and self.view == False and complete:
+            self.index.add_movies([movie.id])
 
-        if self.existing_file_counter > 10 and not self.skip_exit_condition:
+    # Skips a torrent the layout found already saved at path, asking to continue after many in a row
+    def __file_exists(self, path, exists, movie_name):
+        if self.existing_file_counter > 10 and not self.skip_exit_condition and self.index is None:
             self.__prompt_existing_files()
 
-        if os.path.isfile(path):
+        if exists:
             self.pbar.write('{}: File already exists. Skipping...'.format(movie_name))
-            print('file already exists')
+            self.metrics.inc('files_skipped')
+            self.metrics.event('skip', path=path + self.extension)
             self.existing_file_counter += 1
-            return False
-
-        with open(path + '.torrent', 'wb') as torrent:
-            torrent.write(bin_content_tor)
-        if self.poster:
-            with open(path + '.jpg', 'wb') as torrent:
-                torrent.write(bin_content_img)
+            return True
 
         self.existing_file_counter = 0
-        return True
+        return False
 
-    def __log_csv(self, id, imdb_id, name, year, language, rating, quality, yts_url, torrent_url, type):
-        print("Saved movie {} in csv...".format(name))
-        path = os.path.join(os.path.curdir, 'YTS-Scraper.csv')
-        csv_exists = os.path.isfile(path)
-
-        with open(path, mode='a') as csv_file:
-            headers = ['YTS ID', 'IMDb ID', 'Movie Title', 'Year', 'Language', 'Rating', 'Quality', 'Format', 'YTS URL', 'IMDb URL', 'Torrent URL']
-            writer = csv.DictWriter(csv_file, delimiter=',', lineterminator='\n', quotechar='"', quoting=csv.QUOTE_ALL, fieldnames=headers)
-
-            if not csv_exists:
-                writer.writeheader()
-
-            writer.writerow({'YTS ID': id,
-                             'IMDb ID': imdb_id,
-                             'Movie Title': name,
-                             'Year': year,
-                             'Language': language,
-                             'Rating': rating,
-                             'Quality': quality,
-                             'Format': type,
-                             'YTS URL': yts_url,
-                             'IMDb URL': 'https://www.imdb.com/title/' + imdb_id,
-                             'Torrent URL': torrent_url
-                            })
+    # Writes the row to the export, or keeps it for the coordinator when working on a shard
+    def __log_csv(self, id, imdb_id, name, year, language, rating, quality, yts_url, torrent_url, type, metadata=None, magnet=None):
+        record = {'yts_id': id,
+                  'imdb_id': imdb_id,
+                  'title': name,
+                  'year': year,
+                  'language': language,
+                  'rating': rating,
+                  'quality': quality,
+                  'format': type,
+                  'yts_url': yts_url,
+                  'imdb_url': 'https://www.imdb.com/title/' + imdb_id,
+                  'torrent_url': torrent_url
+                  }
+        if metadata is not None:
+            record.update(metadata.record())
+        if magnet is not None:
+            record['magnet'] = magnet
+        if self.export is not None:
+            self.export.write(record)
+        if self.shard is not None:
+            self.shard_rows.append(record)
 
     # Is triggered when the script hits 10 consecutive existing files
     def __prompt_existing_files(self):
@@ -277,106 +716,660 @@ class Scraper:
             self.pbar.write('Invalid input. Enter "Y" or "N".')
 
     def download(self):
+        self.__run(self.__initialize_download, self.__initialize_download_async)
+
+    # Mirrors every listed movie into the local catalog without downloading anything
+    def sync_catalog(self):
+        print('Syncing catalog to {}'.format(self.catalog.path))
+        self.__run(self.__sync_catalog, self.__sync_catalog_async)
+
+    def __sync_catalog(self):
         self.__filterMoviesAndObtainTorrents()
-        self.__initialize_download()
+        self.__finish_checkpoint()
+        print('Catalog holds {} movies.'.format(self.catalog.count()))
+
+    async def __sync_catalog_async(self):
+        await self.__filterMoviesAndObtainTorrentsAsync()
+        self.__finish_checkpoint()
+        print('Catalog holds {} movies.'.format(self.catalog.count()))
+
+    # Polls the newest pages every --interval until stopped by Ctrl-C or SIGTERM. Connections, the index
+    # and the output layout stay loaded between polls, and each poll stops at the first page of known movies
+    def watch(self):
+        import signal
+        self.watch_stop = threading.Event()
+        signal.signal(signal.SIGTERM, lambda signum, frame: self.watch_stop.set())
+        print('Watching for new releases every {} seconds'.format(str(self.watch_status.interval)))
+        self.__run(self.__watch, self.__watch_async)
+
+    def __watch(self):
+        self.__prepare_download()
+        self.queue = queue.Queue(maxsize=self.queue_size)
+        consumers = [threading.Thread(target=self.__download_worker, daemon=True)
+                     for _ in range(self.workers if self.multiprocess else 1)]
+        for consumer in consumers:
+            consumer.start()
+        try:
+            while self.worker_error is None and not self.watch_stop.is_set():
+                started = self.__start_poll()
+                error = None
+                try:
+                    if self.index.movies:
+                        self.__poll_pages()
+                    elif self.backfill:
+                        self.__filterMoviesAndObtainTorrents()
+                    else:
+                        self.__seed_index()
+                except Exception as failure:
+                    error = failure
+                self.queue.join()
+                self.__finish_poll(started, error)
+                self.watch_stop.wait(self.watch_status.interval)
+        finally:
+            for consumer in consumers:
+                self.__enqueue(None)
+            for consumer in consumers:
+                consumer.join()
+        if self.worker_error is not None:
+            raise self.worker_error
+        self.pbar.close()
+
+    async def __watch_async(self):
+        self.__prepare_download()
+        self.queue = self.aio.queue(maxsize=self.queue_size)
+        consumers = [self.aio.spawn(self.__download_worker_async()) for _ in range(self.workers)]
+        try:
+            while self.worker_error is None and not self.watch_stop.is_set():
+                started = self.__start_poll()
+                error = None
+                try:
+                    if self.index.movies:
+                        await self.__poll_pages_async()
+                    elif self.backfill:
+                        await self.__filterMoviesAndObtainTorrentsAsync()
+                    else:
+                        await self.aio.in_thread(self.__seed_index)   # a few blocking requests
+                except Exception as failure:
+                    error = failure
+                await self.queue.join()
+                self.__finish_poll(started, error)
+                deadline = time.time() + self.watch_status.interval
+                while not self.watch_stop.is_set() and time.time() < deadline:
+                    await self.aio.sleep(min(1.0, deadline - time.time()))
+            for consumer in consumers:
+                await self.queue.put(None)
+            await self.aio.gather(*consumers)
+        finally:
+            for consumer in consumers:
+                consumer.cancel()
+        if self.worker_error is not None:
+            raise self.worker_error
+        self.pbar.close()
+
+    # Once the index knows the catalog, new releases fit on a page or two: pages are listed one
+    # at a time from the newest, so the walk ends on the first known page without fetching past it
+    def __poll_pages(self):
+        self.__build_url()
+        self.__probe()
+        self.checkedPage = 1
+        page = 1
+        while self.stop_page is None and page <= self.numberOfPages:
+            self.__obtainData(page)
+            page += 1
+
+    async def __poll_pages_async(self):
+        self.__build_url()
+        await self.__probe_async()
+        self.checkedPage = 1
+        page = 1
+        while self.stop_page is None and page <= self.numberOfPages:
+            await self.__obtainDataAsync(page)
+            page += 1
+
+    # Without an index the first poll only records the newest releases as known, torrents included,
+    # and downloads nothing; --backfill walks and downloads the whole listing instead
+    def __seed_index(self):
+        self.__build_url()
+        movie_count = 0
+        for page in range(1, SEED_PAGES + 1):
+            page_response = self.session.get_json(self.url + str(page), verify=True, headers=self.__headers())
+            movies = [Movie.from_api(movie) for movie in page_response.get('data').get('movies') or []]
+            for movie in movies:
+                for torrent in movie.torrents:
+                    self.index.add_torrent(torrent.hash, movie.id)
+            self.index.add_movies([movie.id for movie in movies])
+            movie_count += len(movies)
+            if len(movies) < self.limit:
+                break
+        self.__log('No index yet: marked the {} newest movies as known without downloading them. '
+                   'Only later releases are downloaded, use --backfill to download the whole listing.'.format(str(movie_count)))
+
+    # Every poll probes the page count again and walks from the newest page.
+    # Returns the request and torrent counts the poll's own are measured from
+    def __start_poll(self):
+        self.knowHowManyPages = False
+        self.stop_page = None
+        self.watch_status.poll_started()
+        return self.metrics.count('requests'), self.torrentNumber
+
+    def __finish_poll(self, started, error):
+        requests_made = self.metrics.count('requests') - started[0]
+        torrents = self.torrentNumber - started[1]
+        self.watch_status.poll_finished(requests_made, torrents, error)
+        if error is not None:
+            self.__log('Poll failed: {}. Trying again in {} seconds.'.format(error, str(self.watch_status.interval)))
+        else:
+            self.__log('Poll {} done: {} new torrents in {} requests. Next poll at {}.'.format(
+                str(self.watch_status.polls), str(torrents), str(requests_made),
+                time.strftime('%H:%M:%S', time.localtime(self.watch_status.next_poll))))
+
+    # /health record of the metrics server
+    def __health(self):
+        return self.watch_status.record(queue_depth=self.queue.qsize() if self.queue is not None else 0,
+                                        known_torrents=len(self.index.hashes))
+
+    # Splits the run into shards of pages, waits for the workers and merges their rows into one export
+    def coordinate(self):
+        self.__run(self.__coordinate, None)
+
+    def __coordinate(self):
+        from yts_scraper.shards import ShardServer, TOKEN_ENV
+        self.__build_url()
+        self.__probe()
+        if self.shards.setup(self.run_params, self.numberOfPages, self.__first_page(), self.shard_size):
+            print('Split {} pages into shards of {} pages at {}'.format(str(self.numberOfPages), str(self.shard_size), self.shards.path))
+        else:
+            print('Continuing the run at {}'.format(self.shards.path))
+        server = None
+        if self.listen is not None:
+            server = ShardServer(self.shards, self.listen[1], host=self.listen[0], token=self.token)
+            print('Start workers with: {}={} yts-scraper work --coordinator {}'.format(TOKEN_ENV, server.token, server.url))
+        else:
+            print('Start workers with: yts-scraper work --coordinator {}'.format(self.shards.path))
+        try:
+            last_status = None
+            while not self.shards.finished():
+                status = self.shards.status()
+                if status != last_status:
+                    print('Shards: {done} done, {leased} leased, {pending} pending, {failed} failed'.format(**status))
+                    last_status = status
+                time.sleep(2)
+        finally:
+            if server is not None:
+                server.close()
+        status = self.shards.status()
+        print('Shards: {done} done, {failed} failed'.format(**status))
+        self.export = open_sink(self.export_format, self.export_path, self.export_columns)
+        for row in self.shards.rows():
+            self.export.write(row)
+
+    # Leases shards from the coordinator until none are left, downloading each one like a normal run
+    def work(self):
+        from yts_scraper.shards import CoordinatorGone
+        try:
+            self.__run(self.__work, self.__work_async)
+        except CoordinatorGone as error:             # it closes its server once the last shard is done
+            print('Coordinator gone, exiting: {}'.format(error))
 
+    def __work(self):
+        self.__prepare_download()
+        self.queue = queue.Queue(maxsize=self.queue_size)
+        consumers = [threading.Thread(target=self.__download_worker, daemon=True)
+                     for _ in range(self.workers if self.multiprocess else 1)]
+        for consumer in consumers:
+            consumer.start()
+        stop = self.__start_heartbeat()
+        while self.worker_error is None and self.__lease_shard():
+            self.__filterMoviesAndObtainTorrents()
+            self.queue.join()                       # the shard is reported once its downloads are done
+            self.__finish_shard()
+        stop.set()
+        for consumer in consumers:
+            self.__enqueue(None)
+        for consumer in consumers:
+            consumer.join()
+        if self.worker_error is not None:
+            raise self.worker_error
+        self.__finish_download()
+
+    async def __work_async(self):
+        self.__prepare_download()
+        self.queue = self.aio.queue(maxsize=self.queue_size)
+        consumers = [self.aio.spawn(self.__download_worker_async()) for _ in range(self.workers)]
+        stop = self.__start_heartbeat()
+        try:
+            while self.worker_error is None:
+                shard = self.__lease_shard(wait=False)
+                if shard is None:
+                    if self.shards.finished():
+                        break
+                    await self.aio.sleep(SHARD_POLL_INTERVAL)
+                    continue
+                await self.__filterMoviesAndObtainTorrentsAsync()
+                await self.queue.join()
+                self.__finish_shard()
+            for consumer in consumers:
+                await self.queue.put(None)
+            await self.aio.gather(*consumers)
+        finally:
+            stop.set()
+            for consumer in consumers:
+                consumer.cancel()
+        if self.worker_error is not None:
+            raise self.worker_error
+        self.__finish_download()
+
+    # Takes the next shard and points the listing at its pages. Returns None once every shard is done;
+    # with wait, polls while other workers still hold leases that may expire
+    def __lease_shard(self, wait=True):
+        while True:
+            shard = self.shards.lease(self.worker_id, self.lease_timeout)
+            if shard is not None:
+                self.shard = shard
+                self.shard_rows = []
+                self.shard_skipped = self.skipped_pages
+                self.page_arg = shard['first']
+                self.last_page = shard['last']
+                self.__log('Working on pages {} to {}'.format(str(shard['first']), str(shard['last'])))
+                return shard
+            if not wait or self.shards.finished():
+                return None
+            time.sleep(SHARD_POLL_INTERVAL)
+
+    # A shard with pages that could not be fetched is handed back for another attempt
+    def __finish_shard(self):
+        shard = self.shard
+        self.shard = None
+        if self.worker_error is not None or self.skipped_pages > self.shard_skipped:
+            self.shards.release(shard['id'], self.worker_id)
+            self.__log('Handing pages {} to {} back to the coordinator'.format(str(shard['first']), str(shard['last'])))
+            return
+        self.shards.complete(shard['id'], self.worker_id, self.shard_rows)
+
+    # Renews the current shard's lease in the background; set the returned event to stop
+    def __start_heartbeat(self):
+        stop = threading.Event()
+
+        def heartbeat():
+            while not stop.wait(self.lease_timeout / 3.0):
+                shard = self.shard
+                if shard is not None:
+                    try:
+                        self.shards.renew(shard['id'], self.worker_id, self.lease_timeout)
+                    except Exception:
+                        pass                        # the next beat tries again before the lease runs out
+        threading.Thread(target=heartbeat, daemon=True).start()
+        return stop
+
+    # Runs the given step with the selected engine and releases every shared resource afterwards.
+    # SIGTERM unwinds like Ctrl-C, so the export is flushed before the journal is closed
+    def __run(self, step, step_async):
+        if not self.watching:                       # watch stops on SIGTERM once its poll is done
+            import signal
+            signal.signal(signal.SIGTERM, self.__terminate)
+        try:
+            if self.engine == 'async' and step_async is not None:
+                from yts_scraper.aio import AsyncEngine     # aiohttp is only loaded for the async engine
+                self.aio = AsyncEngine(concurrency=self.workers, timeout=self.session.timeout,
+                                       limiter=self.limiter, cache=self.cache, metrics=self.metrics)
+                self.aio.run(step_async)
+            else:
+                step()
+        finally:
+            for engine in (self.session, self.aio):
+                if engine is not None and engine.connection_stats()[0]:
+                    print(engine.report())
+            self.session.close()
+            if self.cache is not None and (self.cache.hits or self.cache.revalidated or self.cache.misses):
+                print(self.cache.report())
+                self.cache.close()
+            if self.index is not None:
+                print(self.index.report())
+                self.index.close()
+            if self.catalog is not None:
+                self.catalog.close()
+            if self.shards is not None:
+                self.shards.close()
+            if self.export is not None:             # before the journal, which records the rows it flushes
+                self.export.close()
+                print('Saved {} rows to {}'.format(self.export.written, self.export.path))
+            if self.checkpoint is not None:
+                self.checkpoint.close()
+            if self.stats:
+                print(self.metrics.summary())
+            if self.metrics_file:
+                self.metrics.write_prometheus(self.metrics_file)
+            self.metrics.close()
+
+    def __terminate(self, signum, frame):
+        raise SystemExit(128 + signum)
+
+    # The page count comes from a one-movie probe, then every page is listed concurrently
     def __filterMoviesAndObtainTorrents(self):
-        print('Obtaining torrents...')
-        self.url = '''https://yts.mx/api/v2/list_movies.json?genre={genre}&minimum_rating={minimum_rating}&sort_by={sort_by}&query_term={text}&order_by={order_by}&limit={limit}&page='''.format(
+        self.__log('Obtaining torrents...')
+        self.__build_url()
+        self.__probe()
+        i = self.__first_page()
+        self.checkedPage = i
+        if self.multiprocess == True:
+            pool = ThreadPool(self.workers)
+            pool.map(self.__obtainData, range(i,self.__last_page()+1), chunksize=1)    # blocks until every page has been handled
+            pool.close()
+            pool.join()
+        else:
+            for n in range(i,self.__last_page()+1):
+                self.__obtainData(n)
+
+    async def __filterMoviesAndObtainTorrentsAsync(self):
+        self.__log('Obtaining torrents...')
+        self.__build_url()
+        await self.__probe_async()
+        i = await self.aio.in_thread(self.__first_page)     # a few blocking probes
+        self.checkedPage = i
+        await self.aio.map(self.__obtainDataAsync, range(i,self.__last_page()+1))
+
+    def __probe(self):
+        attempt = 0
+        while self.knowHowManyPages == False:
+            try:
+                self.__set_number_of_pages(self.session.get_json(self.probe_url, verify=True, headers=self.__headers()))
+            except Exception as error:
+                self.__probe_failed(attempt, error)
+                time.sleep(self.limiter.delay(attempt))
+                attempt += 1
+        self.__set_number_of_pages(None)
+
+    async def __probe_async(self):
+        attempt = 0
+        while self.knowHowManyPages == False:
+            try:
+                self.__set_number_of_pages(await self.aio.fetch_json(self.probe_url, headers=self.__headers()))
+            except Exception as error:
+                self.__probe_failed(attempt, error)
+                await self.aio.sleep(self.limiter.delay(attempt))
+                attempt += 1
+        self.__set_number_of_pages(None)
+
+    # Sorted by year, the movies older than --year-limit fill the first pages. A binary search over
+    # one-movie probes finds the first page holding a movie from that year, and listing starts there.
+    # Workers list the pages of their shard, which the coordinator already planned this way
+    def __first_page(self):
+        if (self.sort_by != 'year' or self.order_by != 'asc' or not self.year_limit
+                or self.jobs is not None or self.shard is not None):
+            return self.page_arg
+        low, high = 0, self.movie_count or self.numberOfPages * self.limit   # a resumed run only knows the pages
+        try:
+            while low < high:
+                middle = (low + high) // 2
+                if self.__year_at(middle) < self.year_limit:
+                    low = middle + 1
+                else:
+                    high = middle
+        except Exception as error:
+            self.__log('Could not find the first page from {}, listing every page: {}'.format(str(self.year_limit), describe(error)))
+            return self.page_arg
+        first = max(self.page_arg, low // self.limit + 1)
+        if first > self.page_arg:
+            self.__log('Pages {} to {} only hold movies older than {}. Skipping them.'.format(
+                str(self.page_arg), str(first - 1), str(self.year_limit)))
+        self.__log('Listing {} of {} pages.'.format(str(max(0, self.__last_page() - first + 1)), str(self.numberOfPages)))
+        return first
+
+    # Year of the movie at a position of the listing; past the end counts as new enough
+    def __year_at(self,index):
+        response = self.session.get_json(self.probe_url[:-1] + str(index + 1), verify=True, headers=self.__headers())
+        movies = response.get('data').get('movies') or []
+        return int(movies[0].get('year') or 0) if movies else self.year_limit
+
+    # Lists every planned query once; a query's downloads finish before the next one is listed
+    def __list_jobs(self):
+        for query, jobs, pages in self.__plan_jobs():
+            self.__use_query(query, jobs, pages)
+            self.__filterMoviesAndObtainTorrents()
+            self.queue.join()
+
+    async def __list_jobs_async(self):
+        plan = await self.aio.in_thread(self.__plan_jobs)     # a few blocking probes
+        for query, jobs, pages in plan:
+            self.__use_query(query, jobs, pages)
+            await self.__filterMoviesAndObtainTorrentsAsync()
+            await self.queue.join()
+
+    # Probes the candidate queries for their movie counts and picks the cheapest set covering every job
+    def __plan_jobs(self):
+        def movie_count(query):
+            self.__use_query(query, [], 0)
+            self.knowHowManyPages = False
+            self.__build_url()
+            self.__probe()
+            return self.movie_count
+        plan = plan_queries(self.jobs, movie_count, limit=self.limit)
+        self.__log('Listing {} pages in {} queries for {} jobs:'.format(
+            sum(pages for _, _, pages in plan), len(plan), len(self.jobs)))
+        for query, jobs, pages in plan:
+            self.__log('  genre={} minimum_rating={} quality={} query_term="{}": {} pages for {}'.format(
+                query.genre, query.minimum_rating, query.quality, query.text, pages, ', '.join(job.name for job in jobs)))
+        return plan
+
+    def __use_query(self, query, jobs, pages):
+        self.genre = query.genre
+        self.minimum_rating = query.minimum_rating
+        self.quality = query.quality
+        self.text = query.text
+        self.routes = jobs
+        with self.lock:
+            self.routed = {}
+        self.numberOfPages = pages
+        self.knowHowManyPages = True
+
+    # Keeps the torrents at least one job of the query wants and notes which jobs want each of them
+    def __route(self,movies):
+        kept = []
+        for movie in movies:
+            wanted = {}
+            for job in self.routes:
+                for routed in job.filter.apply([movie]):
+                    for torrent in routed.torrents:
+                        wanted.setdefault(torrent.hash, []).append(job)
+            if not wanted:
+                continue
+            torrents = [torrent for torrent in movie.torrents if torrent.hash in wanted]
+            if len(torrents) < len(movie.torrents):
+                movie = movie.with_torrents(torrents)
+            with self.lock:
+                self.routed[movie.id] = wanted
+            kept.append(movie)
+        return kept
+
+    # Workers stop at the end of their shard
+    def __last_page(self):
+        if self.last_page is not None:
+            return min(self.last_page, self.numberOfPages)
+        return self.numberOfPages
+
+    # Reads the page count from a probe response; called with None once it is known, to journal it
+    def __set_number_of_pages(self,probe_response):
+        if probe_response is not None:
+            movie_count = int(probe_response.get('data').get('movie_count'))
+            self.movie_count = movie_count
+            self.numberOfPages = int(movie_count / self.limit)
+            if (movie_count % self.limit > 0):
+                self.numberOfPages = self.numberOfPages + 1
+            self.knowHowManyPages = True
+        elif self.checkpoint is not None:
+            self.checkpoint.set_number_of_pages(self.numberOfPages)
+
+    # Gives up after a bounded number of failed probes, there is nothing to list without a page count
+    def __probe_failed(self,attempt,error):
+        self.metrics.event('probe_error', url=self.probe_url, attempt=attempt, error=describe(error))
+        if attempt >= self.limiter.retries and self.watching:     # the next poll tries again
+            raise RuntimeError('could not reach YTS ({})'.format(describe(error)))
+        if attempt >= self.limiter.retries:
+            self.__log('Number of tries exceded ({}). Exiting.'.format(describe(error)))
+            sys.exit(1)
+        self.__log('First connection failed ({}). Trying again...'.format(describe(error)))
+
+    # Answers the filter flags from the local catalog instead of the live API
+    def __query_catalog(self):
+        self.__log('Querying catalog {}...'.format(self.catalog.path))
+        movies = self.catalog.query(genre=self.genre, minimum_rating=self.minimum_rating, quality=self.quality,
+                                    format=self.format, year_limit=self.year_limit, text=self.text,
+                                    sort_by=self.sort_by, order_by=self.order_by,
+                                    offset=(self.page_arg - 1) * self.limit)
+        for movie in movies:
+            filtered = self.filter.apply([movie])          # language, seeds, size and known torrents
+            if not filtered:
+                continue
+            movie = filtered[0]
+            self.numberOfTorrents = self.numberOfTorrents + len(movie.torrents)
+            if self.pbar is not None:
+                self.pbar.total = self.numberOfTorrents
+                self.pbar.refresh()
+            yield movie
+
+    # Quality is pushed down to the API as well, so the page count only covers movies
+    # that have a torrent of that quality. The torrent filter still applies to each movie
+    def __build_url(self):
+        self.url = '''{api_url}list_movies.json?genre={genre}&minimum_rating={minimum_rating}{quality}&sort_by={sort_by}&query_term={text}&order_by={order_by}&limit={limit}&page='''.format(
+            api_url=self.session.api_url,
             genre=self.genre,
             minimum_rating=self.minimum_rating,
+            quality='' if self.quality == 'all' else '&quality=' + self.quality,
             sort_by=self.sort_by,
             text=self.text,
             order_by=self.order_by,
             limit=self.limit
         )
-        i = self.page_arg
-        self.checkedPage = i
-        self.__obtainData(i)
-        if self.knowHowManyPages == False:          # never set, must have been an error
-            self.__filterMoviesAndObtainTorrents()
-            return
-        if self.multiprocess == True:
-            indexes = [n for n in range(i+1,self.numberOfPages+1)]
-            pool = ThreadPool(10)
-            pool.map(self.__obtainData, indexes)
-            while (self.checkedPage <= self.numberOfPages):
-                pass
-        else:
-            for n in range(i+1,self.numberOfPages+1):
-                self.__obtainData(n)
-        return
+        self.probe_url = self.url.replace('&limit={}&'.format(self.limit), '&limit=1&') + '1'
+
+    def __headers(self):
+        return {'User-Agent': random_user_agent()}
 
     def __obtainData(self,page):
+        if self.stop_page is not None and page > self.stop_page:
+            return
+        if self.__page_is_done(page):
+            return
         url = '{}{}'.format(self.url, str(page))
         try:
-            user_agent = UserAgent()
-            headers = {'User-Agent': user_agent.random}
-        except:
-            print('Error occurred during fake user agent generation.')
+            page_response = self.session.get_json(url, verify=True, headers=self.__headers())
+        except Exception as error:
+            self.__page_failed(page, error)
+            return
+        started = time.perf_counter()
+        movies = self.__store_page(page, page_response)
+        self.__page_listed(page, movies, started)
+        for movie in movies:
+            self.__enqueue((page, movie, self.__plan(movie)))
+
+    async def __obtainDataAsync(self,page):
+        if self.stop_page is not None and page > self.stop_page:
+            return
+        if self.__page_is_done(page):
+            return
+        url = '{}{}'.format(self.url, str(page))
         try:
-            page_response = requests.get(url, timeout=10, verify=True, headers=headers).json()
+            page_response = await self.aio.fetch_json(url, headers=self.__headers())
         except Exception as error:
-            if self.knowHowManyPages == False:                              # this was never set
-                if self.numberOfTries > 10:
-                    print('Number of tries exceded. Exiting.')
-                    sys.exit(0)
-                else:
-                    print('First connection failed. Trying again from start...')
-                    self.numberOfTries += 1
-                return
-            else:
-                print('There was an error connecting to yts. Skipping page. (Page {} of {})'.format(str(self.checkedPage),str(self.numberOfPages)))
-                self.checkedPage = self.checkedPage + 1
-                return
-        self.data.append(page_response.get('data'))
-        if self.knowHowManyPages == False:                                 # set how many times we'll do this process
-            movie_count = int(self.data[0].get('movie_count'))
-            self.numberOfPages = int(movie_count / self.limit)
-            if (movie_count % self.limit > 0):
-                self.numberOfPages = self.numberOfPages + 1
-            self.knowHowManyPages = True
-        if page > self.numberOfPages:
+            self.__page_failed(page, error)
             return
-        self.__filterMoviesByCriteria(page)
-        self.checkedPage = self.checkedPage + 1
-    
-    def __filterMoviesByCriteria(self,page):
-        movies = self.data[-1].get('movies')                                # Cleans up the last thing added to the data
-        j = 0
-        while(j<len(movies)):
-            movie = movies[j]
-            if (movie.get('year')<self.year_limit):
-                movies.remove(movie)
-                j = j - 1
-            if self.format != "all" and movie in movies:                    # remove all that's not the quality specified
-                torrents = movie.get('torrents')
-                x = 0
-                while (x < len(torrents)):
-                    torrent = torrents[x]
-                    if (torrent.get('type') != self.format):
-                        torrents.remove(torrent)
-                        x = x - 1
-                    x = x + 1
-                if len(torrents) == 0:
-                    movies.remove(movie)
-                    j = j - 1
-            if self.quality != "all" and movie in movies:       # remove all that's not the format specified  
-                torrents = movie.get('torrents')
-                x = 0
-                while (x < len(torrents)):
-                    torrent = torrents[x]
-                    if (torrent.get('quality') != self.quality):
-                        torrents.remove(torrent)
-                        x = x - 1
-                    x = x + 1
-                if len(torrents) == 0:
-                    movies.remove(movie)
-                    j = j - 1
-            j = j + 1
+        started = time.perf_counter()
+        movies = self.__store_page(page, page_response)
+        self.__page_listed(page, movies, started)
         for movie in movies:
-            self.numberOfTorrents =self.numberOfTorrents + len(movie.get('torrents'))
-        if (self.checkedPage < self.numberOfPages):
-            print('Obtained {} torrents so far... (Page {} of {})'.format(str(self.numberOfTorrents),str(page),str(self.numberOfPages)))
+            await self.queue.put((page, movie, self.__plan(movie)))
+            self.metrics.gauge('queue_depth', self.queue.qsize(), peak=True)
+
+    # Pages journaled by an interrupted run are not fetched again
+    def __page_is_done(self,page):
+        if self.checkpoint is None or not self.checkpoint.is_page_done(page):
+            return False
+        with self.lock:
+            self.checkedPage = self.checkedPage + 1
+        return True
+
+    # The session has already retried the page, so it is skipped here and left for --resume
+    def __page_failed(self,page,error):
+        self.metrics.event('page_error', page=page, error=describe(error))
+        self.__log('There was an error connecting to yts ({}). Skipping page. (Page {} of {})'.format(describe(error),str(page),str(self.numberOfPages)))
+        with self.lock:
+            self.checkedPage = self.checkedPage + 1
+            self.skipped_pages = self.skipped_pages + 1
+        return False
+
+    # Filters a listed page and returns the movies that are left to download
+    def __store_page(self,page,page_response):
+        data = page_response.get('data')
+        if page > self.numberOfPages:
+            return []
+        movies = [Movie.from_api(movie) for movie in data.get('movies') or []]      # raw payload is dropped here
+        movie_ids = [movie.id for movie in movies]
+        if self.sync:
+            return self.__sync_page(page, movies, movie_ids)
+        if self.index is not None:
+            if self.__is_known_page(page, movie_ids):
+                return []
+        movies = self.__filterMoviesByCriteria(page, movies)
+        if self.index is not None:                  # movies left out by the filters count as seen right away
+            kept = set(movie.id for movie in movies)
+            self.index.add_movies([movie_id for movie_id in movie_ids if movie_id not in kept])
+        with self.lock:
+            self.checkedPage = self.checkedPage + 1
+        return movies
+
+    def __sync_page(self,page,movies,movie_ids):
+        if self.incremental and self.catalog.has_movies(movie_ids):
+            with self.lock:
+                if self.stop_page is None or page < self.stop_page:
+                    self.stop_page = page
+            self.__log('Page {} is already in the catalog. Stopping here.'.format(str(page)))
+            return []
+        self.catalog.upsert(movies)
+        with self.lock:
+            self.checkedPage = self.checkedPage + 1
+        self.__log('Synced {} movies. (Page {} of {})'.format(str(len(movies)), str(page), str(self.numberOfPages)))
+        return []
+
+    # Keeps only the torrents no other shard has claimed, so each torrent is downloaded by one worker
+    def __claim(self,movies):
+        claimed = set(self.shards.claim(self.shard['id'], [torrent.hash for movie in movies for torrent in movie.torrents]))
+        kept = []
+        for movie in movies:
+            torrents = [torrent for torrent in movie.torrents if torrent.hash in claimed]
+            if len(torrents) == len(movie.torrents):
+                kept.append(movie)
+            elif torrents:
+                kept.append(movie.with_torrents(torrents))
+        return kept
+
+    # A newest-first walk stops at the first page made only of movies seen by earlier runs
+    def __is_known_page(self,page,movie_ids):
+        if not movie_ids or self.sort_by != 'date_added' or self.order_by != 'desc':
+            return False
+        if not all(self.index.has_movie(movie_id) for movie_id in movie_ids):
+            return False
+        with self.lock:
+            if self.stop_page is None or page < self.stop_page:
+                self.stop_page = page
+        self.__log('Page {} is already known. Stopping here.'.format(str(page)))
+        return True
+
+    # Filters a page with the run's predicates and returns a new list, leaving the page untouched
+    def __filterMoviesByCriteria(self,page,movies):
+        if self.routes is not None:
+            movies = self.__route(movies)
         else:
-            print('Obtained {} torrents. (Page {} of {})'.format(str(self.numberOfTorrents),str(page),str(self.numberOfPages)))
\ No newline at end of file
+            movies = self.filter.apply(movies)
+        if self.shard is not None:
+            movies = self.__claim(movies)
+        with self.lock:
+            for movie in movies:
+                self.numberOfTorrents =self.numberOfTorrents + len(movie.torrents)
+            if self.pbar is not None:
+                self.pbar.total = self.numberOfTorrents
+                self.pbar.refresh()
+            if (self.checkedPage < self.numberOfPages):
+                self.__log('Obtained {} torrents so far... (Page {} of {})'.format(str(self.numberOfTorrents),str(page),str(self.numberOfPages)))
+            else:
+                self.__log('Obtained {} torrents. (Page {} of {})'.format(str(self.numberOfTorrents),str(page),str(self.numberOfPages)))
+        return movies
\ No newline at end of file
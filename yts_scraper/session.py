@@ -0,0 +1,241 @@
+import json
+import threading
+import time
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from yts_scraper.files import write_chunks, CHUNK_SIZE
+from yts_scraper.metrics import connection_report, download_kind
+from yts_scraper.ratelimit import RateLimiter, RETRY_STATUSES, parse_retry_after
+
+DEFAULT_HOST = 'yts.mx'
+
+# Seconds the current thread spent opening connections (DNS, TCP and TLS) during its last request,
+# and how many it opened
+_connect_time = threading.local()
+
+
+class _TimedHTTPConnection(HTTPConnection):
+    def connect(self):
+        started = time.perf_counter()
+        try:
+            super().connect()
+        finally:
+            _connect_time.seconds = getattr(_connect_time, 'seconds', 0.0) + time.perf_counter() - started
+            _connect_time.connections = getattr(_connect_time, 'connections', 0) + 1
+
+
+class _TimedHTTPSConnection(HTTPSConnection):
+    def connect(self):
+        started = time.perf_counter()
+        try:
+            super().connect()
+        finally:
+            _connect_time.seconds = getattr(_connect_time, 'seconds', 0.0) + time.perf_counter() - started
+            _connect_time.connections = getattr(_connect_time, 'connections', 0) + 1
+
+
+class _TimedHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = _TimedHTTPConnection
+
+
+class _TimedHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = _TimedHTTPSConnection
+
+
+class Session:
+    """
+    Pooled keep-alive HTTP session.
+
+    A single instance is owned by the Scraper and shared by every worker
+    thread, so API pages, .torrent files and posters reuse open connections
+    instead of paying a TCP+TLS handshake per request. Requests go through
+    the per-host rate limiter and are retried on throttling or network errors.
+    """
+    def __init__(self, host=DEFAULT_HOST, workers=10, timeout=10, limiter=None, cache=None, metrics=None):
+        self.host = host
+        self.timeout = timeout
+        self.cache = cache
+        self.metrics = metrics
+        self.limiter = limiter if limiter is not None else RateLimiter(max_concurrency=workers)
+        self.retries = 0
+        self.requests = 0
+        self.connections = 0
+        self.lock = threading.Lock()
+
+        # Accept either a bare host name or a full base url (e.g. a local mirror)
+        if '://' in host:
+            self.base_url = host.rstrip('/')
+        else:
+            self.base_url = 'https://' + host
+        self.api_url = self.base_url + '/api/v2/'
+
+        # One pool per host (API, torrent CDN, image host), each sized so that
+        # every worker can hold a connection without opening extra ones
+        self.adapter = HTTPAdapter(pool_connections=4, pool_maxsize=workers, pool_block=True)
+        self._session = requests.Session()
+        self._session.mount('https://', self.adapter)
+        self._session.mount('http://', self.adapter)
+        # pools whose connections report how long connecting took and how many were opened
+        self.adapter.poolmanager.pool_classes_by_scheme = {'http': _TimedHTTPConnectionPool,
+                                                           'https': _TimedHTTPSConnectionPool}
+
+    # Returns the last response once it is not throttled or retries run out.
+    # kind labels the request in the metrics: "api", "torrent" or "poster"
+    def get(self, url, kind='api', **kwargs):
+        kwargs.setdefault('timeout', self.timeout)
+        host = self.limiter.host(url)
+        attempt = 0
+        while True:
+            waited = time.perf_counter()
+            host.acquire()
+            started = time.perf_counter()
+            _connect_time.seconds = 0.0
+            _connect_time.connections = 0
+            throttled = False
+            retry_after = None
+            try:                                    # the slot is handed back whatever the request raises
+                response = self._session.get(url, **kwargs)
+                if response.status_code in RETRY_STATUSES:
+                    throttled = True
+                    retry_after = parse_retry_after(response.headers.get('Retry-After'))
+            except (requests.ConnectionError, requests.Timeout) as error:
+                throttled = True
+                self.__record(kind, url, None, waited, started, attempt, error=error)
+                if attempt >= self.limiter.retries:
+                    raise
+                reason = type(error).__name__
+            else:
+                self.__record(kind, url, response, waited, started, attempt, kwargs.get('stream', False))
+                if not throttled or attempt >= self.limiter.retries:
+                    return response
+                response.close()
+                reason = response.status_code
+            finally:
+                host.release(throttled=throttled, retry_after=retry_after)
+                with self.lock:
+                    self.requests += 1
+                    self.connections += _connect_time.connections
+            self.retries += 1
+            delay = self.limiter.delay(attempt, retry_after)
+            if self.metrics is not None:
+                self.metrics.retry(kind, url, reason, delay)
+            time.sleep(delay)
+            attempt += 1
+
+    # Streamed responses keep their phases on the response and are recorded by download() once written
+    def __record(self, kind, url, response, waited, started, attempt, stream=False, error=None):
+        if self.metrics is None:
+            return
+        connect = _connect_time.seconds
+        phases = {'queue': started - waited, 'connect': connect}
+        if response is None:
+            phases['ttfb'] = time.perf_counter() - started - connect
+            self.metrics.request(kind, url, None, phases, attempt=attempt, error=type(error).__name__)
+            return
+        headers = response.elapsed.total_seconds()
+        phases['ttfb'] = max(headers - connect, 0.0)
+        if stream and response.status_code not in RETRY_STATUSES:
+            response.phases = (phases, attempt)
+            return
+        phases['transfer'] = max(time.perf_counter() - started - headers, 0.0)
+        self.metrics.request(kind, url, response.status_code, phases, size=len(response.content), attempt=attempt)
+
+    # Fetches an API page, served from or revalidated against the response cache when one is set
+    def get_json(self, url, headers=None, **kwargs):
+        if self.cache is None:
+            return self.fetch(url, json.loads, kind='api', headers=headers, **kwargs)
+        entry = self.cache.get(url)
+        if entry is not None and entry.fresh:
+            if self.metrics is not None:
+                self.metrics.cache(url, 'hit')
+            return json.loads(entry.body)
+        headers = dict(headers or {})
+        if entry is not None:
+            headers.update(entry.validators())
+        response = self.get(url, headers=headers, **kwargs)
+        if self.metrics is not None:
+            self.metrics.cache(url, 'revalidated' if response.status_code == 304 else 'miss')
+        return self.cache.store(url, entry, response.status_code, response.content, response.headers)
+
+    # Streams a file straight to disk under a temporary name, renamed into place once complete.
+    # With validate, the body is read into memory and only written once validate(body) accepts it;
+    # a body it rejects with ValueError (an error page, a truncated transfer) is fetched again.
+    # Returns validate's result, or the status code without it
+    def download(self, url, path, validate=None, **kwargs):
+        kind = download_kind(path)
+        attempt = 0
+        while True:
+            with self.get(url, kind=kind, stream=True, **kwargs) as response:
+                phases, tries = getattr(response, 'phases', ({}, 0))
+                phases['transfer'] = 0.0
+                size = [0]
+                chunks = self.__timed_chunks(response.iter_content(CHUNK_SIZE), phases, size)
+                started = time.perf_counter()
+                checking = 0.0
+                if validate is None:
+                    write_chunks(chunks, path)
+                    result = response.status_code
+                else:
+                    body = b''.join(chunks)
+                    checked = time.perf_counter()
+                    try:
+                        result = validate(body)
+                    except ValueError as error:
+                        result = error
+                    checking = time.perf_counter() - checked
+                    if not isinstance(result, ValueError):
+                        write_chunks([body], path)
+                phases['disk'] = max(time.perf_counter() - started - phases['transfer'] - checking, 0.0)
+            if self.metrics is not None and hasattr(response, 'phases'):
+                self.metrics.request(kind, url, response.status_code, phases, size=size[0], attempt=tries)
+            if not isinstance(result, ValueError):
+                return result
+            self.__invalid(kind, url, attempt, result)
+            attempt += 1
+
+    # Fetches a small file into memory and returns validate(body), fetching it again when validate rejects it
+    def fetch(self, url, validate, kind='torrent', **kwargs):
+        attempt = 0
+        while True:
+            body = self.get(url, kind=kind, **kwargs).content
+            try:
+                return validate(body)
+            except ValueError as error:
+                self.__invalid(kind, url, attempt, error)
+            attempt += 1
+
+    # Backs off before another attempt at a rejected body, or raises the rejection once retries run out
+    def __invalid(self, kind, url, attempt, error):
+        if attempt >= self.limiter.retries:
+            raise error
+        self.retries += 1
+        delay = self.limiter.delay(attempt)
+        if self.metrics is not None:
+            self.metrics.retry(kind, url, 'invalid', delay)
+        time.sleep(delay)
+
+    # Yields the chunks, adding the time spent waiting on the network to phases['transfer']
+    @staticmethod
+    def __timed_chunks(chunks, phases, size):
+        chunks = iter(chunks)
+        while True:
+            started = time.perf_counter()
+            chunk = next(chunks, None)
+            phases['transfer'] += time.perf_counter() - started
+            if chunk is None:
+                return
+            size[0] += len(chunk)
+            yield chunk
+
+    # Returns (requests, new connections) made through this session
+    def connection_stats(self):
+        with self.lock:
+            return self.requests, self.connections
+
+    def report(self):
+        return connection_report(*self.connection_stats(), self.retries)
+
+    def close(self):
+        self._session.close()
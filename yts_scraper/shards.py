@@ -0,0 +1,334 @@
+import hmac
+import json
+import os
+import secrets
+import socket
+import sqlite3
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# A shard that failed this many times is given up on
+MAX_ATTEMPTS = 5
+
+# Options the coordinator decides for every worker: what is fetched and how files are laid out
+RUN_PARAMS = ('genre', 'rating', 'quality', 'format', 'year_limit', 'text', 'sort_by', 'language', 'min_seeds',
+              'min_size', 'max_size', 'categorize_by', 'background', 'imdb_id', 'csv_only', 'torrent_metadata',
+              'magnet', 'trackers')
+
+# --listen given as a bare port only accepts workers on this machine
+DEFAULT_LISTEN_HOST = '127.0.0.1'
+
+# Shared secret a ShardServer expects on every request, and where workers look for it without --token
+TOKEN_HEADER = 'X-Shard-Token'
+TOKEN_ENV = 'YTS_SCRAPER_TOKEN'
+
+
+class ShardQueue:
+    """
+    SQLite queue of page ranges shared by a coordinator and its workers.
+
+    The coordinator stores the run's filter parameters and page count and
+    splits the pages into shards. Workers lease a shard, list and download
+    its pages, claim each torrent before downloading it so that no torrent
+    is fetched by two workers, and report the shard back with its exported
+    rows. A lease that is not renewed in time expires and the shard goes to
+    the next worker. Local processes can share the file directly; workers on
+    other machines go through ShardServer.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(path) or os.path.curdir, exist_ok=True)
+        self.db = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=30)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.executescript('''
+            CREATE TABLE IF NOT EXISTS run (
+                id INTEGER PRIMARY KEY CHECK (id = 1),
+                params TEXT NOT NULL,
+                number_of_pages INTEGER NOT NULL);
+            CREATE TABLE IF NOT EXISTS shards (
+                id INTEGER PRIMARY KEY,
+                first_page INTEGER NOT NULL,
+                last_page INTEGER NOT NULL,
+                state TEXT NOT NULL DEFAULT 'pending',
+                worker TEXT,
+                leased_until REAL,
+                attempts INTEGER NOT NULL DEFAULT 0);
+            CREATE TABLE IF NOT EXISTS claims (
+                hash TEXT PRIMARY KEY,
+                shard_id INTEGER NOT NULL);
+            CREATE TABLE IF NOT EXISTS rows (
+                shard_id INTEGER NOT NULL,
+                row TEXT NOT NULL);
+            CREATE INDEX IF NOT EXISTS shards_state ON shards (state, leased_until);
+            CREATE INDEX IF NOT EXISTS rows_shard ON rows (shard_id);
+        ''')
+
+    # Creates the shards of a new run, or checks that an existing queue holds the same run
+    def setup(self, params, number_of_pages, first_page=1, shard_size=10):
+        with self.lock:
+            row = self.db.execute('SELECT params FROM run').fetchone()
+            if row is not None:
+                if json.loads(row[0]) != params:
+                    raise RuntimeError('{} holds a run with other parameters. Use another --coordinator path.'.format(self.path))
+                return False
+            self.db.execute('BEGIN IMMEDIATE')
+            self.db.execute('INSERT INTO run VALUES (1, ?, ?)', (json.dumps(params), number_of_pages))
+            self.db.executemany('INSERT INTO shards (first_page, last_page) VALUES (?, ?)',
+                                [(first, min(first + shard_size - 1, number_of_pages))
+                                 for first in range(first_page, number_of_pages + 1, shard_size)])
+            self.db.execute('COMMIT')
+            return True
+
+    def info(self):
+        with self.lock:
+            row = self.db.execute('SELECT params, number_of_pages FROM run').fetchone()
+        if row is None:
+            return None
+        return {'params': json.loads(row[0]), 'number_of_pages': row[1]}
+
+    # Returns the next pending or expired shard as {'id', 'first', 'last'}, or None
+    def lease(self, worker, lease_timeout=600):
+        now = time.time()
+        with self.lock:
+            self.db.execute('BEGIN IMMEDIATE')
+            try:
+                row = self.db.execute('''SELECT id, first_page, last_page FROM shards
+                                         WHERE attempts < ? AND (state = 'pending' OR (state = 'leased' AND leased_until < ?))
+                                         ORDER BY first_page LIMIT 1''', (MAX_ATTEMPTS, now)).fetchone()
+                if row is not None:
+                    self.db.execute('''UPDATE shards SET state = 'leased', worker = ?, leased_until = ?, attempts = attempts + 1
+                                       WHERE id = ?''', (worker, now + lease_timeout, row[0]))
+            finally:
+                self.db.execute('COMMIT')
+        if row is None:
+            return None
+        return {'id': row[0], 'first': row[1], 'last': row[2]}
+
+    def renew(self, shard_id, worker, lease_timeout=600):
+        with self.lock:
+            self.db.execute("UPDATE shards SET leased_until = ? WHERE id = ? AND worker = ? AND state = 'leased'",
+                            (time.time() + lease_timeout, shard_id, worker))
+
+    # Hands a shard back to the queue, e.g. when some of its pages could not be fetched
+    def release(self, shard_id, worker):
+        with self.lock:
+            self.db.execute("UPDATE shards SET state = 'pending', worker = NULL WHERE id = ? AND worker = ? AND state = 'leased'",
+                            (shard_id, worker))
+
+    # Returns the hashes this shard may download: unclaimed ones and those it claimed on an earlier lease
+    def claim(self, shard_id, hashes):
+        if not hashes:
+            return []
+        with self.lock:
+            self.db.execute('BEGIN IMMEDIATE')
+            try:
+                self.db.executemany('INSERT OR IGNORE INTO claims VALUES (?, ?)', [(h, shard_id) for h in hashes])
+                owned = set(row[0] for row in self.db.execute(
+                    'SELECT hash FROM claims WHERE shard_id = ? AND hash IN ({})'.format(','.join('?' * len(hashes))),
+                    [shard_id] + list(hashes)))
+            finally:
+                self.db.execute('COMMIT')
+        return [h for h in hashes if h in owned]
+
+    def complete(self, shard_id, worker, rows):
+        with self.lock:
+            self.db.execute('BEGIN IMMEDIATE')
+            try:
+                state = self.db.execute('SELECT state FROM shards WHERE id = ?', (shard_id,)).fetchone()
+                if state is None or state[0] == 'done':
+                    return False
+                self.db.execute('DELETE FROM rows WHERE shard_id = ?', (shard_id,))
+                self.db.executemany('INSERT INTO rows VALUES (?, ?)', [(shard_id, json.dumps(row)) for row in rows])
+                self.db.execute("UPDATE shards SET state = 'done', worker = ?, leased_until = NULL WHERE id = ?",
+                                (worker, shard_id))
+            finally:
+                self.db.execute('COMMIT')
+        return True
+
+    # Shard counts by state; "failed" shards ran out of attempts
+    def status(self):
+        with self.lock:
+            counts = dict(self.db.execute('''SELECT CASE WHEN attempts >= ? AND (state = 'pending' OR (state = 'leased' AND leased_until < ?))
+                                                         THEN 'failed' ELSE state END, COUNT(*)
+                                             FROM shards GROUP BY 1''', (MAX_ATTEMPTS, time.time())).fetchall())
+            counts['rows'] = self.db.execute('SELECT COUNT(*) FROM rows').fetchone()[0]
+        for state in ('pending', 'leased', 'done', 'failed'):
+            counts.setdefault(state, 0)
+        return counts
+
+    def finished(self):
+        status = self.status()
+        return status['pending'] == 0 and status['leased'] == 0
+
+    # Every reported row, in page order
+    def rows(self):
+        with self.lock:
+            rows = self.db.execute('''SELECT r.row FROM rows r JOIN shards s ON s.id = r.shard_id
+                                      ORDER BY s.first_page, r.rowid''').fetchall()
+        for row in rows:
+            yield json.loads(row[0])
+
+    def close(self):
+        with self.lock:
+            self.db.close()
+
+
+class ShardServer:
+    """
+    Serves a ShardQueue over HTTP/JSON so that workers on other machines can use it.
+
+    Every request must carry the shared token in the X-Shard-Token header,
+    one is generated when none is given. The queue hands out the run's
+    options and accepts results, so it is bound to the loopback interface
+    unless another address is asked for.
+    """
+    def __init__(self, shards, port, host=None, token=None):
+        host = host or DEFAULT_LISTEN_HOST
+        self.shards = shards
+        self.token = token or secrets.token_urlsafe(24)
+        queue = shards
+        expected = self.token.encode('utf-8')
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def __authorized(self):
+                if hmac.compare_digest((self.headers.get(TOKEN_HEADER) or '').encode('utf-8'), expected):
+                    return True
+                self.send_error(401)
+                return False
+
+            def do_GET(self):
+                if not self.__authorized():
+                    return
+                if self.path == '/info':
+                    return self.__reply(queue.info())
+                if self.path == '/status':
+                    return self.__reply(queue.status())
+                self.send_error(404)
+
+            def do_POST(self):
+                if not self.__authorized():
+                    return
+                body = json.loads(self.rfile.read(int(self.headers.get('Content-Length') or 0)) or b'{}')
+                try:
+                    if self.path == '/lease':
+                        return self.__reply(queue.lease(body['worker'], body['lease_timeout']))
+                    if self.path == '/renew':
+                        return self.__reply(queue.renew(body['shard'], body['worker'], body['lease_timeout']))
+                    if self.path == '/release':
+                        return self.__reply(queue.release(body['shard'], body['worker']))
+                    if self.path == '/claim':
+                        return self.__reply(queue.claim(body['shard'], body['hashes']))
+                    if self.path == '/complete':
+                        return self.__reply(queue.complete(body['shard'], body['worker'], body['rows']))
+                except (KeyError, TypeError) as error:
+                    return self.send_error(400, str(error))
+                self.send_error(404)
+
+            def __reply(self, value):
+                body = json.dumps(value).encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        self.url = 'http://{}:{}'.format(socket.gethostname() if host == '0.0.0.0' else host, self.server.server_address[1])
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class CoordinatorGone(RuntimeError):
+    """
+    The coordinator of a work run stopped answering, e.g. because every shard is done.
+    """
+
+
+class RemoteShardQueue:
+    """
+    Worker side of a ShardServer, with the ShardQueue methods a worker needs.
+
+    Requests that cannot reach the coordinator are retried with exponential
+    backoff, so a worker rides out a coordinator restart; once the retries
+    run out CoordinatorGone is raised.
+    """
+    def __init__(self, url, timeout=30, token=None, retries=5, backoff=1.0):
+        import requests
+        self.url = url.rstrip('/')
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.errors = (requests.ConnectionError, requests.Timeout)
+        self.session = requests.Session()
+        if token:
+            self.session.headers[TOKEN_HEADER] = token
+
+    def __get(self, path):
+        return self.__request('GET', path)
+
+    def __post(self, path, **body):
+        return self.__request('POST', path, json=body)
+
+    def __request(self, method, path, **kwargs):
+        attempt = 0
+        while True:
+            try:
+                return self.__json(self.session.request(method, self.url + path, timeout=self.timeout, **kwargs))
+            except self.errors as error:
+                if attempt >= self.retries:
+                    raise CoordinatorGone('{} did not answer {} attempts ({})'.format(
+                        self.url, attempt + 1, type(error).__name__))
+            time.sleep(min(self.backoff * 2 ** attempt, 30))
+            attempt += 1
+
+    def __json(self, response):
+        if response.status_code == 401:
+            raise RuntimeError('The coordinator at {} rejected the token. Pass the one it printed with --token '
+                               'or ${}.'.format(self.url, TOKEN_ENV))
+        response.raise_for_status()
+        return response.json()
+
+    def info(self):
+        return self.__get('/info')
+
+    def status(self):
+        return self.__get('/status')
+
+    def finished(self):
+        status = self.status()
+        return status['pending'] == 0 and status['leased'] == 0
+
+    def lease(self, worker, lease_timeout=600):
+        return self.__post('/lease', worker=worker, lease_timeout=lease_timeout)
+
+    def renew(self, shard_id, worker, lease_timeout=600):
+        return self.__post('/renew', shard=shard_id, worker=worker, lease_timeout=lease_timeout)
+
+    def release(self, shard_id, worker):
+        return self.__post('/release', shard=shard_id, worker=worker)
+
+    def claim(self, shard_id, hashes):
+        return self.__post('/claim', shard=shard_id, hashes=list(hashes))
+
+    def complete(self, shard_id, worker, rows):
+        return self.__post('/complete', shard=shard_id, worker=worker, rows=rows)
+
+    def close(self):
+        self.session.close()
+
+
+# A coordinator given as http(s)://host:port is reached over HTTP, anything else is a local queue file
+def open_shards(location, token=None):
+    if location.startswith(('http://', 'https://')):
+        return RemoteShardQueue(location, token=token)
+    return ShardQueue(location)
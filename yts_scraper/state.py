@@ -0,0 +1,78 @@
+import os
+import threading
+import time
+
+INDEX_FILENAME = '.yts-scraper-index.sqlite'
+
+
+class SeenIndex:
+    """
+    Persistent index of torrents and movies handled by previous runs.
+
+    Torrents are keyed by info hash so known ones are skipped before any
+    request is made. Movies are keyed by YTS id and the filter signature of
+    the run that saw them, so that a page made only of seen movies tells a
+    date_added walk that everything after it is already known.
+    """
+    def __init__(self, path, query):
+        self.path = path
+        self.query = query
+        self.skipped = 0
+        self.lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(path) or os.path.curdir, exist_ok=True)
+        import sqlite3                              # loaded by the runs that open the store
+        self.db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('''CREATE TABLE IF NOT EXISTS torrents (
+                               hash TEXT PRIMARY KEY,
+                               movie_id INTEGER NOT NULL,
+                               added REAL NOT NULL)''')
+        self.db.execute('''CREATE TABLE IF NOT EXISTS movies (
+                               movie_id INTEGER NOT NULL,
+                               query TEXT NOT NULL,
+                               added REAL NOT NULL,
+                               PRIMARY KEY (movie_id, query))''')
+
+        # Loaded once so lookups during the run never touch the database
+        self.hashes = set(row[0] for row in self.db.execute('SELECT hash FROM torrents'))
+        self.movies = set(row[0] for row in self.db.execute('SELECT movie_id FROM movies WHERE query = ?', (query,)))
+
+    def has_torrent(self, torrent_hash):
+        return torrent_hash.upper() in self.hashes
+
+    # Torrent predicate for the run's filter, counting what it skips
+    def is_new(self, torrent):
+        if (torrent.hash or '').upper() not in self.hashes:
+            return True
+        with self.lock:
+            self.skipped += 1
+        return False
+
+    def has_movie(self, movie_id):
+        return movie_id in self.movies
+
+    def add_torrent(self, torrent_hash, movie_id):
+        torrent_hash = torrent_hash.upper()
+        with self.lock:
+            if torrent_hash in self.hashes:
+                return
+            self.hashes.add(torrent_hash)
+            self.db.execute('INSERT OR IGNORE INTO torrents VALUES (?, ?, ?)', (torrent_hash, movie_id, time.time()))
+
+    def add_movies(self, movie_ids):
+        now = time.time()
+        with self.lock:
+            new_ids = [movie_id for movie_id in movie_ids if movie_id not in self.movies]
+            if not new_ids:
+                return
+            self.movies.update(new_ids)
+            self.db.executemany('INSERT OR IGNORE INTO movies VALUES (?, ?, ?)',
+                                [(movie_id, self.query, now) for movie_id in new_ids])
+
+    def report(self):
+        return 'Incremental: {} known torrents skipped, {} torrents indexed'.format(self.skipped, len(self.hashes))
+
+    def close(self):
+        with self.lock:
+            self.db.close()
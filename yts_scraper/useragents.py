@@ -0,0 +1,42 @@
+import random
+
+# Desktop platforms as they appear in the user agent strings of current browsers
+PLATFORMS = {
+    'windows': 'Windows NT 10.0; Win64; x64',
+    'mac': 'Macintosh; Intel Mac OS X 10_15_7',
+    'linux': 'X11; Linux x86_64',
+}
+
+CHROME_VERSIONS = range(120, 132)
+FIREFOX_VERSIONS = range(120, 133)
+SAFARI_VERSIONS = ['16.6', '17.0', '17.1', '17.2', '17.3', '17.4', '17.5', '17.6', '18.0', '18.1']
+
+_pool = None
+
+
+# Every combination of the browsers and platforms above, about a hundred strings
+def build_pool():
+    pool = []
+    for version in CHROME_VERSIONS:
+        for platform in PLATFORMS.values():
+            chrome = 'Mozilla/5.0 ({}) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/{}.0.0.0 Safari/537.36'.format(platform, version)
+            pool.append(chrome)
+            if 'Windows' in platform:
+                pool.append(chrome + ' Edg/{}.0.0.0'.format(version))
+    for version in FIREFOX_VERSIONS:
+        for platform in PLATFORMS.values():
+            if 'Mac' in platform:
+                platform = 'Macintosh; Intel Mac OS X 10.15'
+            pool.append('Mozilla/5.0 ({}; rv:{}.0) Gecko/20100101 Firefox/{}.0'.format(platform, version, version))
+    for version in SAFARI_VERSIONS:
+        pool.append('Mozilla/5.0 ({}) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/{} Safari/605.1.15'.format(
+            PLATFORMS['mac'], version))
+    return pool
+
+
+# Picks from a pool that is built on first use and kept for the rest of the process
+def random_user_agent():
+    global _pool
+    if _pool is None:
+        _pool = build_pool()
+    return random.choice(_pool)
@@ -0,0 +1,91 @@
+import argparse
+import re
+import threading
+import time
+
+# Seconds per --interval suffix; a bare number is taken as seconds
+UNITS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+# Consecutive failed polls after which /health reports the watcher as failing
+FAILING_AFTER = 3
+
+
+# argparse type of --interval, e.g. "90", "30s", "5m" or "1h"
+def parse_interval(value):
+    match = re.match(r'^\s*(\d+(?:\.\d+)?)\s*([smhd]?)\s*$', value.lower())
+    if match is None or float(match.group(1)) <= 0:
+        raise argparse.ArgumentTypeError('invalid interval "{}", use e.g. 30s, 5m or 1h'.format(value))
+    return float(match.group(1)) * UNITS[match.group(2) or 's']
+
+
+def _timestamp(seconds):
+    if seconds is None:
+        return None
+    return time.strftime('%Y-%m-%dT%H:%M:%S%z', time.localtime(seconds))
+
+
+class WatchStatus:
+    """
+    Health and progress of a "yts-scraper watch" process.
+
+    Updated by the poll loop and read by the /health endpoint of the
+    metrics server from another thread.
+    """
+    def __init__(self, interval):
+        self.interval = interval
+        self.started = time.time()
+        self.polls = 0
+        self.failed_polls = 0
+        self.consecutive_failures = 0
+        self.polling = False
+        self.last_poll = None
+        self.last_seconds = None
+        self.last_error = None
+        self.last_requests = 0
+        self.last_torrents = 0
+        self.torrents = 0
+        self.next_poll = None
+        self.lock = threading.Lock()
+
+    def poll_started(self):
+        with self.lock:
+            self.polling = True
+            self.last_poll = time.time()
+
+    def poll_finished(self, requests_made, torrents, error=None):
+        with self.lock:
+            self.polling = False
+            self.polls += 1
+            self.last_seconds = time.time() - self.last_poll
+            self.last_requests = requests_made
+            self.last_torrents = torrents
+            self.torrents += torrents
+            self.last_error = str(error) if error is not None else None
+            if error is None:
+                self.consecutive_failures = 0
+            else:
+                self.failed_polls += 1
+                self.consecutive_failures += 1
+            self.next_poll = time.time() + self.interval
+
+    @property
+    def healthy(self):
+        return self.consecutive_failures < FAILING_AFTER
+
+    def record(self, **extra):
+        with self.lock:
+            record = {'status': 'ok' if self.healthy else 'failing',
+                      'polling': self.polling,
+                      'uptime_seconds': round(time.time() - self.started, 1),
+                      'interval_seconds': self.interval,
+                      'polls': self.polls,
+                      'failed_polls': self.failed_polls,
+                      'last_poll': _timestamp(self.last_poll),
+                      'last_poll_seconds': round(self.last_seconds, 3) if self.last_seconds is not None else None,
+                      'last_poll_requests': self.last_requests,
+                      'last_poll_torrents': self.last_torrents,
+                      'last_error': self.last_error,
+                      'torrents': self.torrents,
+                      'next_poll': _timestamp(self.next_poll)}
+        record.update(extra)
+        return record